@@ -1,5 +1,6 @@
 from typing import TypedDict, List, Dict, Any, Optional
 from core.rotator import GeminiKeyRotator
+from core.telemetry import track_node
 from core.models import ProjectState, ResearchArtifact
 from config.keys import GEMINI_MODEL_NAME
 from tools.memory import VectorMemoryTool
@@ -26,6 +27,7 @@ class ResearcherAgent:
         self.search_tool = search_tool
         self.system_instruction = system_instruction
 
+    @track_node("researcher", "researcher")
     async def run(self, state: AgentGraphState) -> Dict[str, Any]:
         """
         [Update] 改为 async 方法以配合异步 Search Tool
@@ -54,18 +56,19 @@ class ResearcherAgent:
             """
             
             # 使用配置中的模型名称
-            response_text = self.rotator.call_gemini_with_rotation(
+            response_text = await self.rotator.call_gemini_with_rotation(
                 model_name=GEMINI_MODEL_NAME,
                 contents=[{"role": "user", "parts": [{"text": prompt}]}],
                 system_instruction=self.system_instruction,
-                response_schema=ResearchArtifact
+                response_schema=ResearchArtifact,
+                priority="default"
             )
             
             if response_text:
                 artifact = ResearchArtifact.model_validate_json(response_text)
                 current_state.artifacts["research"] = artifact.model_dump()
                 current_state.research_summary = artifact.summary
-                self.memory_tool.store_output(current_state.task_id, artifact.summary, "Researcher")
+                await self.memory_tool.store_output(current_state.task_id, artifact.summary, "Researcher")
                 
                 display_text = f"[Researcher Output]\nSummary: {artifact.summary}\nKey Facts: {len(artifact.key_facts)} items."
                 current_state.full_chat_history.append({"role": "model", "parts": [{"text": display_text}]})
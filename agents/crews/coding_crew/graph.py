@@ -19,12 +19,19 @@ def route_review(state: CodingCrewState) -> str:
         # [🔥 Change] 失败了先去反思，而不是直接重写
         return "reflect"
 
+def route_preflight(state: CodingCrewState) -> str:
+    """[Pre-flight] 静态检查通过才进入沙箱；失败时按审查拒绝处理 (反思或达到上限后总结)"""
+    if state.get("preflight_passed", True):
+        return "execute"
+    return route_review(state)
+
 def build_coding_crew_graph(rotator: GeminiKeyRotator, checkpointer: Any = None) -> StateGraph:
     nodes = CodingCrewNodes(rotator)
     workflow = StateGraph(CodingCrewState)
     
     # 添加节点
     workflow.add_node("coder", nodes.coder_node)
+    workflow.add_node("preflight", nodes.preflight_node)
     workflow.add_node("executor", nodes.executor_node)
     workflow.add_node("reviewer", nodes.reviewer_node)
     # [🔥 New] 添加反思节点
@@ -35,7 +42,17 @@ def build_coding_crew_graph(rotator: GeminiKeyRotator, checkpointer: Any = None)
     workflow.set_entry_point("coder")
     
     # 构建边
-    workflow.add_edge("coder", "executor")
+    # [Pre-flight] Coder -> 静态检查 -> (Executor or Reflector)
+    workflow.add_edge("coder", "preflight")
+    workflow.add_conditional_edges(
+        "preflight",
+        route_preflight,
+        {
+            "execute": "executor",
+            "reflect": "reflector",
+            "summarize": "summarizer"
+        }
+    )
     workflow.add_edge("executor", "reviewer")
     
     # 条件路由：Reviewer -> (Reflect or Summarize)
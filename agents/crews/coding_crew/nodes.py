@@ -4,10 +4,13 @@ import os
 from typing import Dict, Any
 
 from core.utils import load_prompt
+from core.telemetry import track_node
+from core.logger_setup import thread_id_ctx
 from core.models import GeminiModel
 from config.keys import GEMINI_MODEL_NAME
 from agents.crews.coding_crew.state import CodingCrewState
-from tools.sandbox import run_python_code
+from tools.sandbox import run_python_code, preflight_code
+from tools.preflight import format_issues
 
 class CodingCrewNodes:
     def __init__(self, rotator):
@@ -15,7 +18,8 @@ class CodingCrewNodes:
         # 获取当前文件所在目录的绝对路径，用于定位 prompts
         self.base_prompt_path = os.path.join(os.path.dirname(__file__), "prompts")
 
-    def coder_node(self, state: CodingCrewState) -> Dict[str, Any]:
+    @track_node("coding_crew", "coder")
+    async def coder_node(self, state: CodingCrewState) -> Dict[str, Any]:
         """
         [Coder] 负责编写代码。
         升级后：能听取 Reflector 的深度反思建议，而不仅仅是 Reviewer 的报错信息。
@@ -43,11 +47,13 @@ class CodingCrewNodes:
         )
         
         # 调用 Gemini 生成代码
-        response = self.rotator.call_gemini_with_rotation(
+        response = await self.rotator.call_gemini_with_rotation(
             model_name=GEMINI_MODEL_NAME,
             contents=[{"role": "user", "parts": [{"text": formatted_prompt}]}],
             system_instruction="你是一个 Python 专家。只输出 Markdown 代码块。",
-            complexity="complex"
+            complexity="complex",
+            stream=True, # 代码生成耗时最长，实时推送 token
+            use_cache=iteration == 1 # 重写轮次需要新的采样
         )
         
         if not response:
@@ -70,7 +76,32 @@ class CodingCrewNodes:
             "reflection": "" 
         }
 
-    def executor_node(self, state: CodingCrewState) -> Dict[str, Any]:
+    @track_node("coding_crew", "preflight")
+    async def preflight_node(self, state: CodingCrewState) -> Dict[str, Any]:
+        """
+        [Pre-flight] 执行前的静态检查 (语法 / 未定义名字 / 沙箱中不存在的模块)
+        失败时直接构造 reject 审查结果交给 Reflector，跳过沙箱执行与 Reviewer 调用。
+        """
+        code = state.get("generated_code", "")
+        issues = preflight_code(code) if code else []
+        if not issues:
+            return {"preflight_passed": True, "preflight_issues": []}
+
+        report = format_issues(issues)
+        print(f"   🛑 [Pre-flight] 发现 {len(issues)} 个问题，跳过执行: {issues[0]['message']}")
+        return {
+            "preflight_passed": False,
+            "preflight_issues": issues,
+            "execution_stdout": "",
+            "execution_stderr": report,
+            "execution_passed": False,
+            "review_status": "reject",
+            "review_feedback": report,
+            "review_report": {"status": "reject", "source": "preflight", "issues": issues}
+        }
+
+    @track_node("coding_crew", "executor")
+    async def executor_node(self, state: CodingCrewState) -> Dict[str, Any]:
         """
         [Executor] 在沙箱中运行代码
         """
@@ -84,21 +115,34 @@ class CodingCrewNodes:
                 "execution_passed": False
             }
             
-        # 使用 sandbox 工具运行
-        result = run_python_code(code)
+        # 使用 sandbox 工具运行 (不阻塞事件循环，超时会被强制终止)
+        # 同一会话 (thread) 的多轮迭代在 kernel 模式下复用常驻解释器 (已加载的模块)；
+        # 每轮都是完整程序，不传 keep_state，使用全新命名空间，避免上一轮的变量掩盖本轮的错误
+        result = await run_python_code(code, session_id=thread_id_ctx.get())
         
         passed = (result["returncode"] == 0)
         status_icon = "✅" if passed else "❌"
+        if result.get("timed_out"):
+            status_icon = "⏱️"
         print(f"   {status_icon} 执行结束. Exit Code: {result['returncode']}")
+        profile = result.get("profile")
+        if profile:
+            peak = f"{profile['peak_rss_bytes'] / 2**20:.0f}MB" if profile["peak_rss_bytes"] else "n/a"
+            cpu = f"{profile['cpu_time_s']}s" if profile["cpu_time_s"] is not None else "n/a"
+            oom = " (OOM)" if profile["oom_killed"] else ""
+            print(f"   📊 资源: wall {profile['wall_time_s']}s, cpu {cpu}, peak {peak}{oom}")
         
         return {
             "execution_stdout": result["stdout"],
             "execution_stderr": result["stderr"],
             "execution_passed": passed,
-            "image_artifacts": result.get("images", []) # 捕获生成的图片
+            "image_artifacts": result.get("images", []), # 捕获生成的图片 (每张打开的图一份)
+            "file_artifacts": result.get("files", []), # 写入 outputs/ 的其他文件
+            "execution_profile": result.get("profile") # 资源画像 (命中结果缓存时为 None)
         }
 
-    def reviewer_node(self, state: CodingCrewState) -> Dict[str, Any]:
+    @track_node("coding_crew", "reviewer")
+    async def reviewer_node(self, state: CodingCrewState) -> Dict[str, Any]:
         """
         [Reviewer] 审查代码质量和执行结果
         """
@@ -113,7 +157,7 @@ class CodingCrewNodes:
             stderr=state.get("execution_stderr", "")
         )
         
-        response = self.rotator.call_gemini_with_rotation(
+        response = await self.rotator.call_gemini_with_rotation(
             model_name=GEMINI_MODEL_NAME,
             contents=[{"role": "user", "parts": [{"text": formatted_prompt}]}],
             system_instruction="你是一个严格的代码审查员。以 JSON 格式输出。",
@@ -146,7 +190,8 @@ class CodingCrewNodes:
             "review_report": report
         }
 
-    def reflector_node(self, state: CodingCrewState) -> Dict[str, Any]:
+    @track_node("coding_crew", "reflector")
+    async def reflector_node(self, state: CodingCrewState) -> Dict[str, Any]:
         """
         [🔥 New Node] Reflector (The Fixer)
         当代码失败时，分析根本原因并制定修复策略。
@@ -163,11 +208,12 @@ class CodingCrewNodes:
             review_report=json.dumps(state.get("review_report", {}), indent=2)
         )
         
-        response = self.rotator.call_gemini_with_rotation(
+        response = await self.rotator.call_gemini_with_rotation(
             model_name=GEMINI_MODEL_NAME,
             contents=[{"role": "user", "parts": [{"text": formatted_prompt}]}],
             system_instruction="你是一个经验丰富的技术 Lead。请分析代码失败的原因并给出具体修复策略。",
-            complexity="complex"
+            complexity="complex",
+            stream=True
         )
         
         print(f"   💡 反思报告: 已生成")
@@ -176,7 +222,8 @@ class CodingCrewNodes:
             "reflection": response
         }
 
-    def summarizer_node(self, state: CodingCrewState) -> Dict[str, Any]:
+    @track_node("coding_crew", "summarizer")
+    async def summarizer_node(self, state: CodingCrewState) -> Dict[str, Any]:
         """
         [Summarizer] 总结最终成果
         """
@@ -190,11 +237,13 @@ class CodingCrewNodes:
             execution_output=state.get("execution_stdout", "")
         )
         
-        response = self.rotator.call_gemini_with_rotation(
+        response = await self.rotator.call_gemini_with_rotation(
             model_name=GEMINI_MODEL_NAME,
             contents=[{"role": "user", "parts": [{"text": formatted_prompt}]}],
             system_instruction="总结任务完成情况。",
-            complexity="simple"
+            complexity="simple",
+            priority="background", # 总结不在关键路径上，让位给交互式调用
+            stream=True
         )
         
         return {
@@ -14,6 +14,10 @@ class CodingCrewState(BaseAgentState):
     generated_code: str = ""
     filename: str = "main.py"
     
+    # [Pre-flight] 执行前静态检查结果
+    preflight_passed: bool = True
+    preflight_issues: List[Dict[str, Any]] = []
+
     # 执行结果
     execution_stdout: str = ""
     execution_stderr: str = ""
@@ -34,4 +38,6 @@ class CodingCrewState(BaseAgentState):
     
     # 产物
     image_artifacts: List[Dict[str, str]] = []
+    file_artifacts: List[Dict[str, Any]] = []
+    execution_profile: Optional[Dict[str, Any]] = None
     global_artifacts: Dict[str, Any] = {}
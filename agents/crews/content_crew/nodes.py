@@ -2,6 +2,7 @@ import json
 from typing import Dict, Any
 from core.rotator import GeminiKeyRotator
 from core.utils import load_prompt
+from core.telemetry import track_node
 from config.keys import GEMINI_MODEL_NAME
 from agents.crews.content_crew.state import ContentCrewState
 
@@ -10,7 +11,8 @@ class ContentCrewNodes:
         self.rotator = rotator
         self.base_prompt_path = base_prompt_path
 
-    def writer_node(self, state: ContentCrewState) -> Dict[str, Any]:
+    @track_node("content_crew", "writer")
+    async def writer_node(self, state: ContentCrewState) -> Dict[str, Any]:
         print(f"\n✍️ [Writer] 正在创作... (迭代: {state.get('iteration_count', 0) + 1})")
         
         prompt = load_prompt(self.base_prompt_path, "writer.md").format(
@@ -19,10 +21,12 @@ class ContentCrewNodes:
             feedback=state.get("editor_feedback", "") or "无 (初稿)"
         )
 
-        response = self.rotator.call_gemini_with_rotation(
+        response = await self.rotator.call_gemini_with_rotation(
             model_name=GEMINI_MODEL_NAME,
             contents=[{"role": "user", "parts": [{"text": prompt}]}],
-            system_instruction="你是一个创意作家。"
+            system_instruction="你是一个创意作家。",
+            priority="default", # Crew 内部调用：排在 interactive (Planner / Orchestrator) 之后
+            use_cache=state.get("iteration_count", 0) == 0 # 重写轮次需要新的采样
         )
         
         return {
@@ -30,16 +34,18 @@ class ContentCrewNodes:
             "iteration_count": state.get("iteration_count", 0) + 1
         }
 
-    def editor_node(self, state: ContentCrewState) -> Dict[str, Any]:
+    @track_node("content_crew", "editor")
+    async def editor_node(self, state: ContentCrewState) -> Dict[str, Any]:
         print(f"🧐 [Editor] 正在审稿...")
         
         prompt = load_prompt(self.base_prompt_path, "editor.md").format(draft=state.get("content_draft", ""))
         
-        response = self.rotator.call_gemini_with_rotation(
+        response = await self.rotator.call_gemini_with_rotation(
             model_name=GEMINI_MODEL_NAME,
             contents=[{"role": "user", "parts": [{"text": prompt}]}],
             system_instruction="你是一个挑剔的主编。只输出 JSON。",
-            response_schema=None
+            response_schema=None,
+            priority="default"
         )
 
         status = "reject"
@@ -3,6 +3,7 @@ from typing import Dict, Any, Literal
 from pydantic import BaseModel, ValidationError
 from core.rotator import GeminiKeyRotator
 from core.utils import load_prompt
+from core.telemetry import track_node
 from config.keys import GEMINI_MODEL_NAME
 from agents.crews.data_crew.state import DataCrewState
 
@@ -15,7 +16,8 @@ class DataCrewNodes:
         self.rotator = rotator
         self.base_prompt_path = base_prompt_path
 
-    def scientist_node(self, state: DataCrewState) -> Dict[str, Any]:
+    @track_node("data_crew", "scientist")
+    async def scientist_node(self, state: DataCrewState) -> Dict[str, Any]:
         print(f"\n📊 [Data Scientist] 正在分析数据... (迭代: {state.get('iteration_count', 0) + 1})")
         
         prompt_template = load_prompt(self.base_prompt_path, "scientist.md")
@@ -29,10 +31,12 @@ class DataCrewNodes:
             feedback=feedback if feedback else "无 (初稿)"
         )
 
-        response = self.rotator.call_gemini_with_rotation(
+        response = await self.rotator.call_gemini_with_rotation(
             model_name=GEMINI_MODEL_NAME,
             contents=[{"role": "user", "parts": [{"text": formatted_prompt}]}],
-            system_instruction="你是一个客观的数据科学家。"
+            system_instruction="你是一个客观的数据科学家。",
+            priority="default", # Crew 内部调用：排在 interactive (Planner / Orchestrator) 之后
+            use_cache=state.get("iteration_count", 0) == 0 # 重写轮次需要新的采样
         )
 
         return {
@@ -40,7 +44,8 @@ class DataCrewNodes:
             "iteration_count": state.get("iteration_count", 0) + 1
         }
 
-    def analyst_node(self, state: DataCrewState) -> Dict[str, Any]:
+    @track_node("data_crew", "analyst")
+    async def analyst_node(self, state: DataCrewState) -> Dict[str, Any]:
         """
         [SWARM 2.0] 带 Auto-Fix 机制的分析师节点
         """
@@ -66,11 +71,13 @@ class DataCrewNodes:
             else:
                 final_prompt_text = base_prompt
 
-            response = self.rotator.call_gemini_with_rotation(
+            response = await self.rotator.call_gemini_with_rotation(
                 model_name=GEMINI_MODEL_NAME,
                 contents=[{"role": "user", "parts": [{"text": final_prompt_text}]}],
                 system_instruction="你是一个严苛的商业分析师。只输出 JSON。",
-                response_schema=AnalystDecision 
+                response_schema=AnalystDecision,
+                priority="default",
+                use_cache=attempt == 0 # Auto-Fix 重试不能重放上一次的错误输出
             )
 
             try:
@@ -4,10 +4,12 @@ import json  # [Fix] Import json
 from typing import Dict, Any
 from agents.common_types import AgentGraphState
 from core.rotator import GeminiKeyRotator
+from core.telemetry import track_node
 from config.keys import GEMINI_MODEL_NAME
 from core.utils import load_prompt
 from core.crew_registry import crew_registry
 
+@track_node("orchestrator", "orchestrator")
 async def orchestrator_node(state: AgentGraphState, rotator: GeminiKeyRotator) -> Dict[str, Any]:
     """
     [Orchestrator] 总指挥节点 (Async)
@@ -41,7 +43,9 @@ async def orchestrator_node(state: AgentGraphState, rotator: GeminiKeyRotator) -
         model_name=GEMINI_MODEL_NAME,
         contents=[{"role": "user", "parts": [{"text": full_prompt}]}],
         system_instruction="You are the system orchestrator. Select the single best crew for the job.",
-        complexity="simple"
+        complexity="simple",
+        priority="interactive", # 关键路径：优先于后台调用调度
+        hedge=True # 尾延迟直接影响每一步的端到端耗时
     )
     
     # [Fix] Robust JSON Parsing Logic
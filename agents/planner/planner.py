@@ -1,6 +1,9 @@
+import json
 from typing import List, Dict, Any
 from pydantic import BaseModel, Field
+from agents.common_types import AgentGraphState
 from core.rotator import GeminiKeyRotator
+from core.telemetry import track_node
 from config.keys import GEMINI_MODEL_NAME
 
 class PlanStep(BaseModel):
@@ -23,7 +26,8 @@ class PlannerAgent:
         self.rotator = rotator
         self.model = GEMINI_MODEL_NAME
 
-    def create_plan(self, user_input: str) -> Dict[str, Any]:
+    @track_node("planner", "planner")
+    async def create_plan(self, user_input: str) -> Dict[str, Any]:
         print(f"\n🗺️ [Planner] 正在制定全局战略计划...")
         
         prompt = f"""
@@ -42,11 +46,12 @@ class PlannerAgent:
         """
         
         try:
-            response = self.rotator.call_gemini_with_rotation(
+            response = await self.rotator.call_gemini_with_rotation(
                 model_name=self.model,
                 contents=[{"role": "user", "parts": [{"text": prompt}]}],
                 system_instruction="You are a strict planner. Output JSON only.",
-                response_schema=ProjectPlan
+                response_schema=ProjectPlan,
+                priority="interactive" # 系统入口：计划生成前后续节点都在等待
             )
             
             if response:
@@ -63,3 +68,14 @@ class PlannerAgent:
             return {}
         
         return {}
+
+async def planner_node(state: AgentGraphState, rotator: GeminiKeyRotator) -> Dict[str, Any]:
+    """
+    [Planner] 主图入口节点 (Async)
+    生成全局计划并以 JSON 字符串写入 ProjectState.plan，随后交给 Orchestrator。
+    """
+    ps = state["project_state"]
+    plan = await PlannerAgent(rotator).create_plan(ps.user_input)
+    if plan:
+        ps.plan = json.dumps(plan, ensure_ascii=False)
+    return {"project_state": ps}
@@ -10,11 +10,15 @@ import json
 import logging
 from collections import defaultdict
 
-from config.keys import GEMINI_API_KEYS, PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME
+from config.keys import GATEWAY_API_BASE, GEMINI_API_KEYS, PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME, SANDBOX_PREWARM_ON_STARTUP
 from core.rotator import GeminiKeyRotator
 from core.api_models import TaskRequest  # [Fix] Import unified model
+from core.logger_setup import thread_id_ctx, token_usage_ctx
+from core.events import event_sink_ctx
+from core.telemetry import new_usage_counter, sandbox_metrics
 from tools.memory import VectorMemoryTool
 from tools.search import GoogleSearchTool
+from tools.sandbox import prewarm_default_sandbox
 from workflow.graph import build_agent_workflow
 from langgraph.checkpoint.memory import MemorySaver
 from core.models import ProjectState
@@ -37,7 +41,7 @@ app.add_middleware(
 
 # 初始化全局组件
 checkpointer = MemorySaver()
-rotator = GeminiKeyRotator(GEMINI_API_KEYS[0], GEMINI_API_KEYS[0]) # Assuming keys provided in env
+rotator = GeminiKeyRotator(GATEWAY_API_BASE, GEMINI_API_KEYS) # [Multi-Key] 全部 Key 进入轮询池
 memory = VectorMemoryTool(PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME)
 search = GoogleSearchTool()
 
@@ -61,6 +65,12 @@ class EventStreamManager:
             payload = {"type": event_type, "timestamp": time.strftime("%H:%M:%S"), "data": data}
             await self.active_streams[task_id].put(payload)
 
+    def push_event_nowait(self, task_id: str, event_type: str, data: Any):
+        """同步版本，供节点内部的增量事件 (token 等) 通过 event sink 调用"""
+        if task_id in self.active_streams:
+            payload = {"type": event_type, "timestamp": time.strftime("%H:%M:%S"), "data": data}
+            self.active_streams[task_id].put_nowait(payload)
+
     async def close_stream(self, task_id: str):
         if task_id in self.active_streams:
             await self.active_streams[task_id].put(None) # 发送结束信号
@@ -80,6 +90,12 @@ async def run_workflow_background(task_id: str, initial_input: Dict, config: Dic
     [Fix] Added cancellation handling
     """
     thread_id = config["configurable"]["thread_id"]
+    # 调度器按 thread_id 做公平排队
+    thread_id_ctx.set(thread_id)
+    # [Cost Telemetry] 本次运行的 Token 累计值 (节点内的 LLM 调用原地累加)
+    token_usage_ctx.set(new_usage_counter())
+    # [Streaming] 节点内部的增量事件 (token / sandbox_output 等) 直接写入该任务的 SSE 队列
+    event_sink_ctx.set(lambda event_type, data: stream_manager.push_event_nowait(task_id, event_type, data))
     logger.info(f"🚀 [Background] Workflow started for: {task_id}")
     
     await stream_manager.push_event(task_id, "macro_log", {
@@ -132,17 +148,50 @@ async def run_workflow_background(task_id: str, initial_input: Dict, config: Dic
         await stream_manager.push_event(task_id, "error", str(e))
     finally:
         logger.info(f"🏁 Workflow finished: {task_id}")
+        await stream_manager.push_event(task_id, "token_usage", dict(token_usage_ctx.get() or {}))
         await stream_manager.push_event(task_id, "macro_log", {
             "agent": "System", "message": "Task Completed/Stopped.", "run_id": None
         })
         await stream_manager.close_stream(task_id)
 
+# --- Lifecycle ---
+
+@app.on_event("startup")
+async def on_startup():
+    """预建 LLM 连接池，避免首个请求承担握手开销"""
+    await rotator.startup()
+    if SANDBOX_PREWARM_ON_STARTUP:
+        # 沙箱镜像首次构建可能需要几分钟，在后台线程中进行，不阻塞服务启动
+        asyncio.get_running_loop().run_in_executor(None, prewarm_default_sandbox)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """优雅关闭：写完排队的记忆写入，释放 keep-alive 连接"""
+    await memory.close()
+    await rotator.aclose()
+
 # --- Endpoints ---
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "Gemini Commander API"}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """[Monitoring] 运行时性能指标"""
+    return {
+        "http_pool": rotator.get_pool_stats(),
+        "api_keys": rotator.get_key_stats(),
+        "llm_scheduler": rotator.get_scheduler_stats(),
+        "circuit_breakers": rotator.get_breaker_stats(),
+        "hedging": rotator.get_hedge_stats(),
+        "llm_cache": rotator.get_cache_stats(),
+        "single_flight": rotator.get_single_flight_stats(),
+        "llm_usage": rotator.get_usage_stats(),
+        "sandbox": sandbox_metrics.get_stats(),
+        "vector_memory": memory.get_stats()
+    }
+
 @app.post("/api/start_task")
 async def start_task(req: TaskRequest, background_tasks: BackgroundTasks):
     """启动任务并准备流"""
@@ -1,13 +1,83 @@
 import os
+import json
 
 # --- Gateway & API Configuration ---
 GATEWAY_API_BASE = os.getenv("GATEWAY_API_BASE", "https://generativelanguage.googleapis.com/v1beta/openai/")
 GATEWAY_SECRET = os.getenv("GATEWAY_SECRET", "") # Google AI Studio Key
 
+def _parse_key_list(raw: str) -> list:
+    """支持 JSON 数组 (["k1", "k2"]) 或逗号分隔 (k1,k2) 两种写法"""
+    raw = (raw or "").strip()
+    if not raw:
+        return []
+    try:
+        parsed = json.loads(raw)
+        if isinstance(parsed, list):
+            return [str(k).strip() for k in parsed if str(k).strip()]
+    except json.JSONDecodeError:
+        pass
+    return [k.strip() for k in raw.split(",") if k.strip()]
+
+def _parse_float_map(raw: str) -> dict:
+    """JSON 对象写法 ({"coding_crew": 0.98})，解析失败时返回空字典"""
+    try:
+        parsed = json.loads(raw or "{}")
+        return {str(k): float(v) for k, v in parsed.items()} if isinstance(parsed, dict) else {}
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return {}
+
+# [Multi-Key] 多 Key 轮询池；未配置时回退到单个 GATEWAY_SECRET
+GEMINI_API_KEYS = _parse_key_list(os.getenv("GEMINI_API_KEYS", "")) or ([GATEWAY_SECRET] if GATEWAY_SECRET else [])
+
+# 每个 Key 的限流额度 (Requests / Tokens per minute)
+GEMINI_KEY_RPM = int(os.getenv("GEMINI_KEY_RPM", "60"))
+GEMINI_KEY_TPM = int(os.getenv("GEMINI_KEY_TPM", "1000000"))
+# 429 且无 Retry-After 时的默认冷却时间 (秒)
+GEMINI_KEY_COOLDOWN = float(os.getenv("GEMINI_KEY_COOLDOWN", "30"))
+
 # --- Vector DB ---
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "")
 PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
 VECTOR_INDEX_NAME = os.getenv("VECTOR_INDEX_NAME", "swarm-memory")
+# 向量索引后端: auto (配置了 Pinecone 则使用，否则关闭记忆) | pinecone | local (进程内索引，需显式开启) | none
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "auto").lower()
+# 本地索引向量数达到该值后启用 IVF 近似检索 (0 = 始终精确检索)；每次查询扫描的簇数
+MEMORY_ANN_MIN_VECTORS = int(os.getenv("MEMORY_ANN_MIN_VECTORS", "20000"))
+MEMORY_ANN_NPROBE = int(os.getenv("MEMORY_ANN_NPROBE", "8"))
+# 设置目录后本地索引持久化到磁盘 (mmap 只追加文件，多进程共享只读页)，留空则仅使用内存
+MEMORY_LOCAL_PATH = os.getenv("MEMORY_LOCAL_PATH", "")
+# 磁盘向量精度 (float32 | float16)；float16 体积减半，检索精度损失可忽略
+MEMORY_VECTOR_DTYPE = os.getenv("MEMORY_VECTOR_DTYPE", "float32").lower()
+# 每次写入后 fsync (防止系统崩溃丢数据；关闭后只防进程崩溃)
+MEMORY_FSYNC = os.getenv("MEMORY_FSYNC", "true").lower() in ("1", "true", "yes")
+# 已删除/被覆盖的行占比超过该值时后台压缩
+MEMORY_COMPACT_RATIO = float(os.getenv("MEMORY_COMPACT_RATIO", "0.3"))
+# [Write-Behind] 记忆与缓存写入进入有界队列，后台批量 upsert：队列容量、单批上限、攒批窗口 (毫秒)
+MEMORY_WRITE_QUEUE_SIZE = int(os.getenv("MEMORY_WRITE_QUEUE_SIZE", "1024"))
+MEMORY_WRITE_BATCH_SIZE = int(os.getenv("MEMORY_WRITE_BATCH_SIZE", "64"))
+MEMORY_WRITE_FLUSH_MS = float(os.getenv("MEMORY_WRITE_FLUSH_MS", "200"))
+# 关闭时等待队列写完的最长时间 (秒)
+MEMORY_WRITE_CLOSE_TIMEOUT = float(os.getenv("MEMORY_WRITE_CLOSE_TIMEOUT", "10"))
+
+# --- Semantic Cache ---
+# 命中阈值 (余弦相似度)；SEMANTIC_CACHE_THRESHOLDS 可按 crew 名或模型名单独设置，优先级 crew > 模型 > 默认
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_THRESHOLDS = _parse_float_map(os.getenv("SEMANTIC_CACHE_THRESHOLDS", ""))
+# 条目有效期 (秒) 与总条目上限；超出上限时按 lru | lfu 淘汰
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_EVICTION = os.getenv("SEMANTIC_CACHE_EVICTION", "lru").lower()
+
+# --- Embedding ---
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+# 按内容哈希缓存嵌入向量 (确定性结果，TTL 可以很长)；设置路径后启用 SQLite 磁盘层
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "4096"))
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", str(7 * 24 * 3600)))
+EMBED_CACHE_DB_PATH = os.getenv("EMBED_CACHE_DB_PATH", "")
+# [Micro-Batching] 在窗口 (毫秒) 内到达的嵌入请求合并为一次批量调用；单批上限 (API 限制 100)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX_SIZE = min(100, int(os.getenv("EMBED_BATCH_MAX_SIZE", "100")))
 
 # --- Model Tiers [Protocol Phase 1] ---
 # TIER 1: 高速、低成本。适用于分类、简单总结、搜索查询生成。
@@ -19,3 +89,94 @@ TIER_2_PRO = "gemini-2.5-flash-preview-09-2025"
 
 # Default fallback
 GEMINI_MODEL_NAME = TIER_2_PRO
+
+# --- HTTP Connection Pool ---
+# Rotator 复用的长连接池配置 (所有 LLM 调用共享同一个 AsyncClient)
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+HTTP_ENABLE_HTTP2 = os.getenv("HTTP_ENABLE_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# --- LLM Admission Control ---
+# 全局同时在途的 LLM 调用上限，以及低优先级请求的老化时间 (秒)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_PRIORITY_AGING_SECONDS = float(os.getenv("LLM_PRIORITY_AGING_SECONDS", "30"))
+
+# --- Circuit Breaker & Adaptive Timeout (per endpoint / model tier) ---
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_LATENCY_THRESHOLD = float(os.getenv("BREAKER_LATENCY_THRESHOLD", "45"))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", "5"))
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# 自适应超时 = clamp(p95 × multiplier, min, max)，样本不足时使用默认值
+LLM_DEFAULT_TIMEOUT = float(os.getenv("LLM_DEFAULT_TIMEOUT", "60"))
+LLM_MIN_TIMEOUT = float(os.getenv("LLM_MIN_TIMEOUT", "5"))
+LLM_MAX_TIMEOUT = float(os.getenv("LLM_MAX_TIMEOUT", "120"))
+LLM_TIMEOUT_MULTIPLIER = float(os.getenv("LLM_TIMEOUT_MULTIPLIER", "2.0"))
+
+# --- Hedged Requests ---
+# 调用超过近期延迟的 HEDGE_PERCENTILE 分位仍未返回时，发出一个对冲请求
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.2"))
+# 对冲请求占可对冲调用的最大比例 (预算上限)
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+
+# --- Exact-Match LLM Response Cache ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+# 只缓存 temperature 不高于该值的请求 (默认仅确定性请求，即 response_schema 结构化调用)；采样结果被重放会抹掉重试 / 重新生成依赖的多样性
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0"))
+# 设置路径后启用 SQLite 磁盘层 (跨进程重启保留)，留空则仅使用内存
+LLM_CACHE_DB_PATH = os.getenv("LLM_CACHE_DB_PATH", "")
+
+# --- Sandbox Container Pool ---
+# 预热的沙箱容器数量 (默认与 CPU 核数一致，上限 8)，并发执行时各自独占一个容器
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", str(min(8, os.cpu_count() or 2))))
+# 单个容器执行多少次后回收重建，避免残留状态累积
+SANDBOX_MAX_RUNS_PER_CONTAINER = int(os.getenv("SANDBOX_MAX_RUNS_PER_CONTAINER", "50"))
+SANDBOX_MEM_LIMIT = os.getenv("SANDBOX_MEM_LIMIT", "512m")
+SANDBOX_CPUS = float(os.getenv("SANDBOX_CPUS", "0.5"))
+# 所有容器都忙时，借出操作的最长等待时间 (秒)
+SANDBOX_CHECKOUT_TIMEOUT = float(os.getenv("SANDBOX_CHECKOUT_TIMEOUT", "60"))
+# 单次代码执行的墙钟超时 (秒)，超时后强制杀死容器内的进程
+SANDBOX_EXEC_TIMEOUT = float(os.getenv("SANDBOX_EXEC_TIMEOUT", "120"))
+# 单次执行中每个输出流 (stdout / stderr) 最多缓冲的字节数，超出部分截断丢弃
+SANDBOX_MAX_OUTPUT_BYTES = int(os.getenv("SANDBOX_MAX_OUTPUT_BYTES", str(1024 * 1024)))
+# [Persistent Kernel] 同一编码会话的多次执行复用容器内常驻的 Python 解释器 (预加载常用库)
+SANDBOX_KERNEL_ENABLED = os.getenv("SANDBOX_KERNEL_ENABLED", "false").lower() in ("1", "true", "yes")
+SANDBOX_KERNEL_PRELOAD = [m.strip() for m in os.getenv("SANDBOX_KERNEL_PRELOAD", "numpy,pandas,matplotlib").split(",") if m.strip()]
+# [Result Cache] 确定性代码 (无网络 / 随机性 / 时间依赖) 的执行结果缓存，按总字节数 LRU 淘汰
+SANDBOX_RESULT_CACHE_ENABLED = os.getenv("SANDBOX_RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SANDBOX_RESULT_CACHE_MAX_BYTES = int(os.getenv("SANDBOX_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SANDBOX_RESULT_CACHE_MAX_ENTRIES = int(os.getenv("SANDBOX_RESULT_CACHE_MAX_ENTRIES", "256"))
+# [Artifacts] 单次执行取回的产出物 (outputs/ 目录与自动保存的图) 的单文件 / 总大小 / 数量上限
+SANDBOX_MAX_ARTIFACT_BYTES = int(os.getenv("SANDBOX_MAX_ARTIFACT_BYTES", str(10 * 1024 * 1024)))
+SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES = int(os.getenv("SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES", str(32 * 1024 * 1024)))
+SANDBOX_MAX_ARTIFACTS = int(os.getenv("SANDBOX_MAX_ARTIFACTS", "20"))
+
+# --- Sandbox Backend ---
+# docker: 容器池 (隔离最强) / local: 本机子进程 + rlimits (无需 Docker，适合 CI) / auto: Docker 不可用时回退到 local
+SANDBOX_BACKEND = os.getenv("SANDBOX_BACKEND", "auto").lower()
+# [Local] 执行脚本的解释器 (留空则使用当前解释器) 与每次执行临时目录的根路径 (留空则使用系统临时目录)
+SANDBOX_LOCAL_PYTHON = os.getenv("SANDBOX_LOCAL_PYTHON", "")
+SANDBOX_LOCAL_ROOT = os.getenv("SANDBOX_LOCAL_ROOT", "")
+# [Local] 以 root 运行时切换到该用户执行脚本 (例如 nobody)，留空则不切换
+SANDBOX_LOCAL_USER = os.getenv("SANDBOX_LOCAL_USER", "")
+# [Local] 通过 unshare 断开脚本的网络 (当前系统不支持时自动跳过)
+SANDBOX_LOCAL_ISOLATE_NETWORK = os.getenv("SANDBOX_LOCAL_ISOLATE_NETWORK", "true").lower() in ("1", "true", "yes")
+# [Local] 脚本可写入的单个文件大小上限 (RLIMIT_FSIZE)
+SANDBOX_LOCAL_MAX_FILE_BYTES = int(os.getenv("SANDBOX_LOCAL_MAX_FILE_BYTES", str(64 * 1024 * 1024)))
+
+# --- Sandbox Image ---
+# 预装依赖的沙箱镜像：在基础镜像上安装 SANDBOX_PACKAGES，tag 由依赖集合的哈希决定 (swarm-sandbox:<hash>)
+SANDBOX_BASE_IMAGE = os.getenv("SANDBOX_BASE_IMAGE", "python:3.9-slim")
+SANDBOX_PACKAGES = [p.strip() for p in os.getenv("SANDBOX_PACKAGES", "numpy,pandas,matplotlib,seaborn,scipy").split(",") if p.strip()]
+SANDBOX_IMAGE_REPO = os.getenv("SANDBOX_IMAGE_REPO", "swarm-sandbox")
+# 显式指定镜像 (例如 CI 中预先构建好的) 时跳过托管构建
+SANDBOX_IMAGE = os.getenv("SANDBOX_IMAGE", "")
+# 镜像不存在时是否在本地构建 (首次需要几分钟)；关闭后回退到基础镜像
+SANDBOX_IMAGE_AUTO_BUILD = os.getenv("SANDBOX_IMAGE_AUTO_BUILD", "true").lower() in ("1", "true", "yes")
+# 服务启动时在后台准备镜像并预热容器池
+SANDBOX_PREWARM_ON_STARTUP = os.getenv("SANDBOX_PREWARM_ON_STARTUP", "true").lower() in ("1", "true", "yes")
@@ -12,5 +12,5 @@ class StreamEvent(BaseModel):
     """
     流式输出的事件模型 (Server-Sent Events 结构)
     """
-    event_type: str = Field(..., description="事件类型 (e.g., 'token', 'log', 'error', 'finish')")
+    event_type: str = Field(..., description="事件类型 (e.g., 'token', 'sandbox_output', 'sandbox_profile', 'log', 'error', 'finish')")
     data: Dict[str, Any] = Field(default_factory=dict, description="事件的具体载荷数据")
@@ -0,0 +1,175 @@
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger("CircuitBreaker")
+
+class LatencyTracker:
+    """滑动窗口内的延迟分布 (秒)"""
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+class CircuitBreaker:
+    """
+    [Resilience] 单个 (endpoint, model) 的熔断器
+    - CLOSED: 正常放行，统计滑动时间窗内的错误率与 p95 延迟
+    - OPEN: 错误率或 p95 超阈值后熔断，冷却期内直接拒绝 (fail fast)
+    - HALF_OPEN: 冷却结束后只放行一个探测请求，成功则恢复，失败则重新熔断
+    同时基于观测到的 p95 延迟给出自适应超时。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        error_rate_threshold: float = 0.5,
+        latency_threshold: float = 45.0,
+        min_requests: int = 5,
+        window_seconds: float = 60.0,
+        open_seconds: float = 30.0,
+        default_timeout: float = 60.0,
+        min_timeout: float = 5.0,
+        max_timeout: float = 120.0,
+        timeout_multiplier: float = 2.0
+    ):
+        self.name = name
+        self.error_rate_threshold = error_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        # (timestamp, ok, latency)
+        self._window: Deque[Tuple[float, bool, Optional[float]]] = deque()
+        self.latency = LatencyTracker()
+        self._stats = {"successes": 0, "failures": 0, "rejections": 0, "trips": 0}
+
+    def _prune(self, now: float):
+        while self._window and now - self._window[0][0] > self.window_seconds:
+            self._window.popleft()
+
+    def allow_request(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.open_seconds:
+                self._stats["rejections"] += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info(f"🟡 Breaker [{self.name}] half-open. Probing upstream...")
+
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self._stats["rejections"] += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float):
+        now = time.monotonic()
+        self._stats["successes"] += 1
+        self.latency.record(latency)
+        if self.state == self.HALF_OPEN:
+            self._close()
+            return
+        self._window.append((now, True, latency))
+        self._evaluate(now)
+
+    def record_failure(self, latency: Optional[float] = None):
+        now = time.monotonic()
+        self._stats["failures"] += 1
+        if self.state == self.HALF_OPEN:
+            self._trip(now, "probe failed")
+            return
+        self._window.append((now, False, latency))
+        self._evaluate(now)
+
+    def record_neutral(self):
+        """既非成功也非上游故障 (如 Key 限流、请求参数错误)：仅释放半开探测名额"""
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = False
+
+    def _evaluate(self, now: float):
+        self._prune(now)
+        total = len(self._window)
+        if self.state != self.CLOSED or total < self.min_requests:
+            return
+        failures = sum(1 for _, ok, _ in self._window if not ok)
+        error_rate = failures / total
+        if error_rate >= self.error_rate_threshold:
+            self._trip(now, f"error rate {error_rate:.0%}")
+            return
+        latencies = sorted(lat for _, ok, lat in self._window if ok and lat is not None)
+        if len(latencies) >= self.min_requests:
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            if p95 >= self.latency_threshold:
+                self._trip(now, f"p95 latency {p95:.1f}s")
+
+    def _trip(self, now: float, reason: str):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._window.clear()
+        self._stats["trips"] += 1
+        logger.warning(f"🔴 Breaker [{self.name}] OPEN ({reason}). Failing fast for {self.open_seconds:.0f}s.")
+
+    def _close(self):
+        self.state = self.CLOSED
+        self._probe_in_flight = False
+        self._window.clear()
+        logger.info(f"🟢 Breaker [{self.name}] closed. Upstream recovered.")
+
+    def adaptive_timeout(self) -> float:
+        """超时 = p95 × multiplier，限制在 [min_timeout, max_timeout]；样本不足时使用默认值"""
+        if len(self.latency) < self.min_requests:
+            return self.default_timeout
+        p95 = self.latency.percentile(0.95) or self.default_timeout
+        return max(self.min_timeout, min(self.max_timeout, p95 * self.timeout_multiplier))
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50 = self.latency.percentile(0.50)
+        p95 = self.latency.percentile(0.95)
+        return {
+            "state": self.state,
+            "timeout_s": round(self.adaptive_timeout(), 1),
+            "latency_p50_s": round(p50, 2) if p50 is not None else None,
+            "latency_p95_s": round(p95, 2) if p95 is not None else None,
+            **self._stats
+        }
+
+class BreakerRegistry:
+    """按 (endpoint, model) 懒创建熔断器"""
+    def __init__(self, **breaker_kwargs):
+        self._breaker_kwargs = breaker_kwargs
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, endpoint: str, model: str) -> CircuitBreaker:
+        key = (endpoint, model)
+        if key not in self._breakers:
+            self._breakers[key] = CircuitBreaker(name=model, **self._breaker_kwargs)
+        return self._breakers[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {f"{endpoint}|{model}": b.get_stats() for (endpoint, model), b in self._breakers.items()}
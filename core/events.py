@@ -0,0 +1,23 @@
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Callable
+
+# [Streaming] 当前工作流的事件出口 (由 engine / api_server 在运行前注入)
+# 节点、Rotator、沙箱等深层组件通过 emit_event 推送增量事件 (token / sandbox_output ...)，
+# 无需把回调层层传参。LangGraph 创建的子任务会自动继承该上下文。
+EventSink = Callable[[str, Dict[str, Any]], None]
+event_sink_ctx: ContextVar[Optional[EventSink]] = ContextVar("event_sink", default=None)
+
+def has_event_sink() -> bool:
+    """是否有消费者在监听增量事件"""
+    return event_sink_ctx.get() is not None
+
+def emit_event(event_type: str, data: Dict[str, Any]) -> None:
+    """向当前工作流的事件流推送一个事件；没有监听者时静默丢弃"""
+    sink = event_sink_ctx.get()
+    if sink is None:
+        return
+    try:
+        sink(event_type, data)
+    except Exception:
+        # 事件推送失败不能影响主流程
+        pass
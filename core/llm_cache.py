@@ -0,0 +1,238 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("LLM-Cache")
+
+def stable_hash(obj: Any) -> str:
+    """对任意 JSON 可序列化对象计算稳定的内容哈希 (跨进程一致，不受 hash 随机化影响)"""
+    raw = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """
+    [Exact-Match Cache] 两级确定性缓存
+    - L1: 进程内 LRU (OrderedDict)，容量 max_entries
+    - L2: 可选 SQLite 磁盘层，进程重启后仍然有效
+    两级共享同一个 TTL；值需可 JSON 序列化。线程安全。
+    """
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        db_path: Optional[str] = None,
+        max_disk_entries: int = 100_000,
+        table: str = "llm_cache"
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.table = table
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expired": 0}
+        self._writes_since_trim = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_accessed ON {self.table}(accessed_at)")
+            except Exception as e:
+                logger.error(f"Disk cache init failed ({db_path}): {e}. Falling back to memory only.")
+                self._db = None
+
+    @staticmethod
+    def make_key(
+        model: str,
+        system_instruction: str,
+        contents: Any,
+        response_schema: Any,
+        temperature: Optional[float]
+    ) -> str:
+        """缓存键 = (model, system_instruction, contents, response_schema, temperature) 的内容哈希"""
+        if hasattr(response_schema, "model_json_schema"):
+            response_schema = response_schema.model_json_schema()
+        return stable_hash({
+            "model": model,
+            "system_instruction": system_instruction or "",
+            "contents": contents,
+            "response_schema": response_schema,
+            "temperature": temperature
+        })
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            value = self._disk_get(key, now)
+            if value is not None:
+                self._stats["hits"] += 1
+                self._stats["disk_hits"] += 1
+                self._memory_put(key, value, now)
+                return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._stats["sets"] += 1
+            self._memory_put(key, value, now)
+            self._disk_put(key, value, now)
+
+    async def aget(self, key: str, executor: Optional[Executor] = None) -> Optional[Any]:
+        """[Async] 供事件循环调用：启用磁盘层时在线程池中查询，避免 SQLite I/O 阻塞事件循环"""
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.get_running_loop().run_in_executor(executor, self.get, key)
+
+    async def aset(self, key: str, value: Any, executor: Optional[Executor] = None):
+        """[Async] 供事件循环调用：启用磁盘层时在线程池中写入"""
+        if self._db is None:
+            self.set(key, value)
+            return
+        await asyncio.get_running_loop().run_in_executor(executor, self.set, key, value)
+
+    def _memory_put(self, key: str, value: Any, now: float):
+        self._memory[key] = (now + self.ttl, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_get(self, key: str, now: float) -> Optional[Any]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._stats["expired"] += 1
+                return None
+            self._db.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except Exception as e:
+            logger.warning(f"Disk cache read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, value: Any, now: float):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl, now)
+            )
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= 256:
+                self._writes_since_trim = 0
+                self._trim_disk(now)
+        except Exception as e:
+            logger.warning(f"Disk cache write failed: {e}")
+
+    def _trim_disk(self, now: float):
+        """清理过期条目，并按最近访问时间淘汰超出容量的部分"""
+        self._db.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table}")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "disk_enabled": self._db is not None,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                **self._stats
+            }
+
+class SingleFlight:
+    """
+    [Single-Flight] 在途请求合并
+    相同 key 的并发调用共享同一个上游任务，只发出一次请求。
+    - 每个等待者通过 asyncio.shield 等待共享任务，单个等待者被取消不会影响其他人
+    - 最后一个等待者离开时才取消共享任务，避免无人接收的请求继续消耗配额
+    注意：共享任务运行在发起者 (leader) 的上下文中。
+    """
+    def __init__(self):
+        self._flights: Dict[str, Dict[str, Any]] = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "abandoned": 0}
+
+    async def do(self, key: str, factory):
+        """factory 为无参协程工厂，只在当前 key 没有在途任务时调用"""
+        flight = self._flights.get(key)
+        if flight is None or flight["task"].done():
+            task = asyncio.create_task(factory())
+            flight = {"task": task, "waiters": 0}
+            self._flights[key] = flight
+            task.add_done_callback(lambda _t, k=key, f=flight: self._forget(k, f))
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+
+        task = flight["task"]
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not task.done():
+                # 所有等待者都已离开 (被取消)，终止上游请求
+                self._stats["abandoned"] += 1
+                task.cancel()
+
+    def is_in_flight(self, key: str) -> bool:
+        flight = self._flights.get(key)
+        return flight is not None and not flight["task"].done()
+
+    def _forget(self, key: str, flight: Dict[str, Any]):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._flights), **self._stats}
@@ -9,9 +9,15 @@ from typing import Optional, Dict
 trace_id_ctx: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
 node_id_ctx: ContextVar[Optional[str]] = ContextVar("node_id", default=None)
 phase_ctx: ContextVar[Optional[str]] = ContextVar("phase", default="UNKNOWN")
+# 当前会话 (LangGraph thread_id)，用于调度公平性与成本归因
+thread_id_ctx: ContextVar[Optional[str]] = ContextVar("thread_id", default=None)
+# 当前执行的 Crew 与图节点 (如 coding_crew / coder)，由 core.telemetry.track_node 设置
+crew_ctx: ContextVar[Optional[str]] = ContextVar("crew", default=None)
+agent_node_ctx: ContextVar[Optional[str]] = ContextVar("agent_node", default=None)
 
 # [Protocol Phase 4] Token 计数器上下文
-# 格式示例: {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150}
+# 格式示例: {"prompt_tokens": 100, "completion_tokens": 50, "cached_tokens": 0, "total_tokens": 150}
+# 工作流入口放入一个新 dict，各 LLM 调用原地累加 (子任务共享同一个 dict)
 token_usage_ctx: ContextVar[Optional[Dict[str, int]]] = ContextVar("token_usage", default=None)
 
 class JSONFormatter(logging.Formatter):
@@ -42,6 +48,12 @@ class JSONFormatter(logging.Formatter):
         phase = phase_ctx.get()
         if phase: log_object["protocol_phase"] = phase
 
+        crew = crew_ctx.get()
+        if crew: log_object["crew"] = crew
+
+        agent_node = agent_node_ctx.get()
+        if agent_node: log_object["agent_node"] = agent_node
+
         # [Protocol Phase 4] Token 成本监控
         # 优先读取 logger.info(..., extra={'token_usage': ...}) 中的显式传值
         # 其次读取上下文中的累积值
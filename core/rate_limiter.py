@@ -0,0 +1,209 @@
+import time
+import logging
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger("KeyPool")
+
+class TokenBucket:
+    """
+    经典令牌桶: capacity 为桶容量，每秒补充 refill_rate 个令牌。
+    非线程安全，设计为在单个事件循环内使用。
+    """
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.tokens = float(capacity)
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self._last = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def time_until(self, amount: float) -> float:
+        """距离桶内攒够 amount 个令牌还需多少秒 (0 表示立即可用)"""
+        self._refill()
+        # 超过容量的请求只要桶满即可放行，否则永远无法满足
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        if self.refill_rate <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.refill_rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        """预估值大于实际消耗时归还差额"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+@dataclass
+class KeyState:
+    """单个 API Key 的运行时状态"""
+    key: str
+    rpm: TokenBucket
+    tpm: TokenBucket
+    cooldown_until: float = 0.0
+    in_flight: int = 0
+    stats: Dict[str, int] = field(default_factory=lambda: {"requests": 0, "throttled": 0, "errors": 0})
+
+    @property
+    def label(self) -> str:
+        """日志/监控中使用的脱敏标识"""
+        return f"...{self.key[-4:]}" if len(self.key) > 4 else "***"
+
+    def wait_time(self, est_tokens: int) -> float:
+        """该 Key 能够承接一个 est_tokens 大小的请求还需等待的秒数"""
+        now = time.monotonic()
+        cooldown = max(0.0, self.cooldown_until - now)
+        return max(cooldown, self.rpm.time_until(1), self.tpm.time_until(est_tokens))
+
+class KeyPool:
+    """
+    [Multi-Key Rotation] API Key 池
+    - 每个 Key 独立的 RPM / TPM 令牌桶
+    - 选择负载最低 (in-flight 最少、剩余额度最多) 的健康 Key
+    - 被 429 限流的 Key 进入冷却期 (优先使用 Retry-After)
+    """
+    def __init__(self, keys: List[str], rpm: int, tpm: int, default_cooldown: float = 30.0):
+        # 去重并保持顺序
+        unique_keys = [k for k in dict.fromkeys(keys) if k]
+        self.default_cooldown = default_cooldown
+        self.keys: List[KeyState] = [
+            KeyState(
+                key=k,
+                rpm=TokenBucket(rpm, rpm / 60.0),
+                tpm=TokenBucket(tpm, tpm / 60.0)
+            )
+            for k in unique_keys
+        ]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def estimate_tokens(payload: Dict[str, Any]) -> int:
+        """粗略估算请求 Token 数 (约 4 字符 / token)，仅用于 TPM 预扣"""
+        chars = 0
+        for content in payload.get("contents", []):
+            for part in content.get("parts", []):
+                chars += len(part.get("text", "") or "")
+        sys_inst = payload.get("systemInstruction", {})
+        for part in sys_inst.get("parts", []):
+            chars += len(part.get("text", "") or "")
+        return max(1, chars // 4)
+
+    def acquire(self, est_tokens: int, exclude: Optional[set] = None) -> Optional[KeyState]:
+        """
+        立即选取一个可用 Key 并预扣额度；没有可用 Key 时返回 None。
+        调用方应通过 next_available_in() 决定等待时长。
+        """
+        exclude = exclude or set()
+        candidates = [ks for ks in self.keys if ks.key not in exclude and ks.wait_time(est_tokens) == 0]
+        if not candidates:
+            return None
+        # Least-loaded: 先比较在途请求数，再比较 RPM / TPM 剩余额度
+        best = min(candidates, key=lambda ks: (ks.in_flight, -ks.rpm.available(), -ks.tpm.available()))
+        best.rpm.consume(1)
+        best.tpm.consume(est_tokens)
+        best.in_flight += 1
+        best.stats["requests"] += 1
+        return best
+
+    def release(self, ks: KeyState, est_tokens: int = 0, actual_tokens: Optional[int] = None):
+        """请求结束后归还在途计数，并按实际用量修正 TPM 预扣"""
+        ks.in_flight = max(0, ks.in_flight - 1)
+        if actual_tokens is not None:
+            self.settle(ks, est_tokens, actual_tokens)
+
+    def settle(self, ks: KeyState, est_tokens: int, actual_tokens: int):
+        """按响应中的实际 Token 用量修正 TPM 预扣 (多退少补)"""
+        if actual_tokens < est_tokens:
+            ks.tpm.refund(est_tokens - actual_tokens)
+        elif actual_tokens > est_tokens:
+            ks.tpm.consume(actual_tokens - est_tokens)
+
+    def next_available_in(self, est_tokens: int, exclude: Optional[set] = None) -> float:
+        """所有 Key 中最早可用的等待时间"""
+        exclude = exclude or set()
+        waits = [ks.wait_time(est_tokens) for ks in self.keys if ks.key not in exclude]
+        return min(waits) if waits else float("inf")
+
+    def mark_throttled(self, ks: KeyState, retry_after: Optional[float] = None):
+        """429: 将 Key 放入冷却期"""
+        cooldown = retry_after if retry_after is not None else self.default_cooldown
+        ks.cooldown_until = time.monotonic() + cooldown
+        ks.stats["throttled"] += 1
+        logger.warning(f"🧊 Key {ks.label} throttled. Cooling down for {cooldown:.1f}s")
+
+    def mark_error(self, ks: KeyState):
+        ks.stats["errors"] += 1
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析 Retry-After 头 (秒数或 HTTP 日期)"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except Exception:
+            return None
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "key": ks.label,
+                "in_flight": ks.in_flight,
+                "rpm_available": round(ks.rpm.available(), 1),
+                "tpm_available": round(ks.tpm.available()),
+                "cooldown_remaining_s": round(max(0.0, ks.cooldown_until - now), 1),
+                **ks.stats
+            }
+            for ks in self.keys
+        ]
+
+class HedgeBudget:
+    """
+    [Hedging] 对冲请求预算
+    每个允许对冲的调用积攒 ratio 个额度 (上限 burst)，发出一次对冲消耗 1 个额度，
+    从而把对冲带来的额外开销限制在约 ratio 比例以内。
+    """
+    def __init__(self, ratio: float, burst: float = 5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+        self._stats = {"eligible_calls": 0, "hedges_issued": 0, "hedge_wins": 0, "budget_denied": 0}
+
+    def record_call(self):
+        self._stats["eligible_calls"] += 1
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self._stats["hedges_issued"] += 1
+            return True
+        self._stats["budget_denied"] += 1
+        return False
+
+    def record_win(self):
+        self._stats["hedge_wins"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"ratio": self.ratio, "tokens": round(self.tokens, 2), **self._stats}
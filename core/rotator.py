@@ -1,21 +1,202 @@
 import asyncio
 import random
 import logging
+import json
+import time
 import httpx
-from typing import List, Dict, Any, Optional, Literal
-from config.keys import TIER_1_FAST, TIER_2_PRO
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import List, Dict, Any, Optional, Literal, Union, Tuple, AsyncIterator, Callable
+from config.keys import (
+    TIER_1_FAST, TIER_2_PRO, GATEWAY_API_BASE,
+    HTTP_POOL_MAX_CONNECTIONS, HTTP_POOL_MAX_KEEPALIVE, HTTP_POOL_KEEPALIVE_EXPIRY, HTTP_ENABLE_HTTP2,
+    GEMINI_KEY_RPM, GEMINI_KEY_TPM, GEMINI_KEY_COOLDOWN,
+    LLM_MAX_CONCURRENCY, LLM_PRIORITY_AGING_SECONDS,
+    BREAKER_ERROR_RATE, BREAKER_LATENCY_THRESHOLD, BREAKER_MIN_REQUESTS, BREAKER_WINDOW_SECONDS,
+    BREAKER_OPEN_SECONDS, LLM_DEFAULT_TIMEOUT, LLM_MIN_TIMEOUT, LLM_MAX_TIMEOUT, LLM_TIMEOUT_MULTIPLIER,
+    HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY, HEDGE_BUDGET_RATIO,
+    LLM_CACHE_ENABLED, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL, LLM_CACHE_DB_PATH, LLM_CACHE_MAX_TEMPERATURE
+)
+from core.rate_limiter import KeyPool, HedgeBudget
+from core.scheduler import LLMScheduler
+from core.circuit_breaker import BreakerRegistry, CircuitBreaker
+from core.llm_cache import LLMResponseCache, SingleFlight
+from core.logger_setup import thread_id_ctx, node_id_ctx, crew_ctx
+from core.events import emit_event, has_event_sink
+from core.telemetry import llm_metrics, extract_usage
+
+# HTTP/2 需要可选依赖 h2 (pip install httpx[http2])，缺失时回退到 HTTP/1.1
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 logger = logging.getLogger("GeminiRotator")
 
+# 所有 Key 都在冷却时，单次最多等待的秒数 (超过则直接放弃本次调用)
+MAX_KEY_WAIT_SECONDS = 60.0
+
 class GeminiKeyRotator:
-    def __init__(self, base_url: str, api_key: str):
+    def __init__(
+        self,
+        base_url: Union[str, List[str]] = GATEWAY_API_BASE,
+        api_keys: Union[str, List[str], None] = None,
+        max_connections: int = HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections: int = HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry: float = HTTP_POOL_KEEPALIVE_EXPIRY,
+        http2: bool = HTTP_ENABLE_HTTP2,
+        rpm_per_key: int = GEMINI_KEY_RPM,
+        tpm_per_key: int = GEMINI_KEY_TPM,
+        max_concurrency: int = LLM_MAX_CONCURRENCY
+    ):
+        # [Compat] 兼容旧调用方式 GeminiKeyRotator(GEMINI_API_KEYS)
+        if isinstance(base_url, (list, tuple)):
+            api_keys, base_url = list(base_url), GATEWAY_API_BASE
+        if isinstance(api_keys, str):
+            api_keys = [api_keys]
+
         # 移除末尾斜杠，防止拼接时出现双斜杠
         self.base_url = base_url.rstrip("/")
-        self.api_key = api_key
+
+        # [Multi-Key] Key 池：每个 Key 独立限流，429 时自动切换到健康 Key
+        self.key_pool = KeyPool(api_keys or [], rpm=rpm_per_key, tpm=tpm_per_key, default_cooldown=GEMINI_KEY_COOLDOWN)
+        self.api_key = self.key_pool.keys[0].key if self.key_pool.keys else ""
+
+        # [Admission Control] 所有上游调用先经过全局调度器排队
+        self.scheduler = LLMScheduler(max_concurrency, aging_seconds=LLM_PRIORITY_AGING_SECONDS)
+
+        # [Resilience] 每个 (endpoint, model tier) 一个熔断器，并提供基于 p95 的自适应超时
+        self.breakers = BreakerRegistry(
+            error_rate_threshold=BREAKER_ERROR_RATE,
+            latency_threshold=BREAKER_LATENCY_THRESHOLD,
+            min_requests=BREAKER_MIN_REQUESTS,
+            window_seconds=BREAKER_WINDOW_SECONDS,
+            open_seconds=BREAKER_OPEN_SECONDS,
+            default_timeout=LLM_DEFAULT_TIMEOUT,
+            min_timeout=LLM_MIN_TIMEOUT,
+            max_timeout=LLM_MAX_TIMEOUT,
+            timeout_multiplier=LLM_TIMEOUT_MULTIPLIER
+        )
+
+        # [Hedging] 对冲请求预算 (仅对 hedge=True 的调用生效)
+        self.hedge_budget = HedgeBudget(HEDGE_BUDGET_RATIO)
+
+        # [Exact-Match Cache] 字节级相同的请求直接命中，先于任何网络 I/O
+        self.response_cache: Optional[LLMResponseCache] = None
+        if LLM_CACHE_ENABLED:
+            self.response_cache = LLMResponseCache(
+                max_entries=LLM_CACHE_MAX_ENTRIES,
+                ttl=LLM_CACHE_TTL,
+                db_path=LLM_CACHE_DB_PATH or None
+            )
+
+        # [Single-Flight] 相同请求并发到达时只发出一次上游调用
+        self.single_flight = SingleFlight()
         
         # [Fix] 自动检测模式：如果 URL 中不包含 googleapis，则认为是我们的私有 RP 网关
         self.is_gateway = "googleapis.com" not in self.base_url
 
+        # [Performance] 长连接池：整个进程生命周期复用同一个 AsyncClient，
+        # 避免每次 LLM 调用都重新进行 TCP + TLS 握手。
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._http2 = http2 and HTTP2_AVAILABLE
+        if http2 and not HTTP2_AVAILABLE:
+            logger.info("HTTP/2 requested but 'h2' is not installed. Falling back to HTTP/1.1.")
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_created_at: Optional[float] = None
+        self._pool_stats = {"requests": 0, "in_flight": 0, "errors": 0, "clients_created": 0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """懒加载共享的 AsyncClient (首次调用或 aclose 之后重新创建)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=self._http2,
+                limits=self._limits,
+                timeout=httpx.Timeout(60.0, connect=10.0)
+            )
+            self._client_created_at = time.time()
+            self._pool_stats["clients_created"] += 1
+            logger.info(f"🔌 HTTP pool created (http2={self._http2}, max_connections={self._limits.max_connections})")
+        return self._client
+
+    async def startup(self):
+        """[Lifecycle] 预创建连接池 (FastAPI startup 时调用)"""
+        self._get_client()
+
+    async def aclose(self):
+        """[Lifecycle] 关闭连接池，释放所有 keep-alive 连接 (FastAPI shutdown 时调用)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("🔌 HTTP pool closed.")
+        self._client = None
+        if self.response_cache is not None:
+            self.response_cache.close()
+
+    async def _request(self, method: str, url: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """所有出站请求的统一入口，负责连接池统计"""
+        client = self._get_client()
+        self._pool_stats["requests"] += 1
+        self._pool_stats["in_flight"] += 1
+        try:
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            return await client.request(method, url, **kwargs)
+        except Exception:
+            self._pool_stats["errors"] += 1
+            raise
+        finally:
+            self._pool_stats["in_flight"] -= 1
+
+    @asynccontextmanager
+    async def _stream_request(self, method: str, url: str, timeout: Optional[float] = None, **kwargs):
+        """流式请求入口 (与 _request 共享连接池与统计)"""
+        client = self._get_client()
+        self._pool_stats["requests"] += 1
+        self._pool_stats["in_flight"] += 1
+        try:
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            async with client.stream(method, url, **kwargs) as response:
+                yield response
+        except Exception:
+            self._pool_stats["errors"] += 1
+            raise
+        finally:
+            self._pool_stats["in_flight"] -= 1
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        [Monitoring] 连接池统计信息
+        连接级别的数据来自 httpcore 的连接池 (若可访问)。
+        """
+        stats: Dict[str, Any] = dict(self._pool_stats)
+        stats.update({
+            "http2": self._http2,
+            "max_connections": self._limits.max_connections,
+            "max_keepalive_connections": self._limits.max_keepalive_connections,
+            "keepalive_expiry": self._limits.keepalive_expiry,
+            "client_open": self._client is not None and not self._client.is_closed,
+            "client_age_s": round(time.time() - self._client_created_at, 1) if self._client_created_at and self._client else None,
+        })
+
+        # httpx 未公开连接池接口，这里防御性地读取 httpcore 连接列表
+        connections = []
+        try:
+            pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+        except Exception:
+            connections = []
+        idle = sum(1 for c in connections if getattr(c, "is_idle", lambda: False)())
+        stats["connections_open"] = len(connections)
+        stats["connections_idle"] = idle
+        stats["connections_active"] = len(connections) - idle
+        return stats
+
     async def check_gateway_health(self) -> str:
         """
         [Fix] 智能健康检查，根据是否是 Gateway 决定检查逻辑 (Async)
@@ -24,28 +205,58 @@ class GeminiKeyRotator:
             return "misconfigured_no_key"
         
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                if self.is_gateway:
-                    # RP 模式：检查专用健康接口 /health
-                    url = f"{self.base_url}/health"
-                    resp = await client.get(url)
-                    if resp.status_code == 200:
-                        return "connected"
-                    else:
-                        return f"error_{resp.status_code}"
+            # [Performance] 复用共享连接池，健康检查同时起到连接保活的作用
+            if self.is_gateway:
+                # RP 模式：检查专用健康接口 /health
+                url = f"{self.base_url}/health"
+                resp = await self._request("GET", url, timeout=5.0)
+                if resp.status_code == 200:
+                    return "connected"
+                else:
+                    return f"error_{resp.status_code}"
+            else:
+                # Google 模式：列出模型 (轻量级请求)
+                url = f"{self.base_url}/models?key={self.api_key}"
+                resp = await self._request("GET", url, timeout=5.0)
+                if resp.status_code == 200:
+                    return "connected"
                 else:
-                    # Google 模式：列出模型 (轻量级请求)
-                    url = f"{self.base_url}/models?key={self.api_key}"
-                    resp = await client.get(url)
-                    if resp.status_code == 200:
-                        return "connected"
-                    else:
-                        return f"error_{resp.status_code}"
+                    return f"error_{resp.status_code}"
         except Exception as e:
             # 记录异常以便调试
             logger.debug(f"Health check failed: {str(e)}")
             return "disconnected"
 
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 调度器队列深度与排队耗时"""
+        return self.scheduler.get_stats()
+
+    def get_breaker_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 各模型 Tier 的熔断状态、延迟分位与当前超时"""
+        return self.breakers.get_stats()
+
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 对冲请求的发出次数、胜出次数与预算"""
+        return self.hedge_budget.get_stats()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 精确匹配缓存的命中率与容量"""
+        if not self.response_cache:
+            return {"enabled": False}
+        return {**self.response_cache.get_stats(), "max_temperature": LLM_CACHE_MAX_TEMPERATURE}
+
+    def get_single_flight_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 在途请求合并次数"""
+        return self.single_flight.get_stats()
+
+    def get_usage_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 按 node / crew / thread / tier 聚合的 Token 用量与耗时"""
+        return llm_metrics.get_stats()
+
+    def get_key_stats(self) -> List[Dict[str, Any]]:
+        """[Monitoring] 各 Key 的限流额度、冷却状态与调用统计"""
+        return self.key_pool.get_stats()
+
     def _get_model_by_complexity(self, complexity: str) -> str:
         """根据复杂度路由到对应的模型 Tier"""
         if complexity == "simple":
@@ -55,6 +266,11 @@ class GeminiKeyRotator:
         else:
             return TIER_2_PRO # Default safe
 
+    def _tier_candidates(self, target_model: str) -> List[str]:
+        """主 Tier 在前，另一个 Tier 作为熔断时的降级目标"""
+        fallback = TIER_1_FAST if target_model == TIER_2_PRO else TIER_2_PRO
+        return [target_model] if fallback == target_model else [target_model, fallback]
+
     async def call_gemini_with_rotation(
         self,
         model_name: str,
@@ -62,13 +278,53 @@ class GeminiKeyRotator:
         system_instruction: str = "",
         response_schema: Optional[Any] = None,
         complexity: Literal["simple", "complex"] = "complex",
-        semantic_cache_tool: Optional[Any] = None # [Phase 3] 注入缓存工具
+        semantic_cache_tool: Optional[Any] = None, # [Phase 3] 注入缓存工具
+        priority: Literal["interactive", "default", "background"] = "default",
+        hedge: bool = False,
+        stream: bool = False,
+        use_cache: bool = True
     ) -> str:
         """
         调用 Gemini API，支持自动路由、重试和语义缓存。(Async)
         自动适配 Gateway (RP) 和 Google 原生 API。
+        priority 决定在全局调度器中的排队优先级。
+        hedge=True 时对慢请求发出对冲 (用于关键路径上的延迟敏感调用)。
+        stream=True 时以 token 事件实时推送增量输出，返回值仍为完整文本。
+        精确匹配缓存只对确定性请求生效 (temperature <= LLM_CACHE_MAX_TEMPERATURE)；
+        use_cache=False 跳过缓存与请求合并 (重试 / 重新生成等需要独立采样的调用)。
         """
-        # [Phase 3] Cache Hit Check
+        started = time.monotonic()
+        # [Smart Routing]
+        target_model = model_name
+        if complexity:
+            target_model = self._get_model_by_complexity(complexity)
+            
+        payload = self._build_payload(contents, system_instruction, response_schema, complexity)
+
+        # [Exact-Match Cache] 在语义缓存与网络请求之前检查
+        temperature = payload["generationConfig"].get("temperature")
+        request_key = LLMResponseCache.make_key(
+            target_model, system_instruction, contents,
+            payload["generationConfig"].get("responseSchema"),
+            temperature
+        )
+        # 采样请求 (temperature > 阈值) 不缓存：相同 prompt 应得到新的样本
+        cacheable = use_cache and (temperature or 0.0) <= LLM_CACHE_MAX_TEMPERATURE
+        cache_key = request_key if cacheable and self.response_cache is not None else None
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                if stream and has_event_sink():
+                    emit_event("token", {"delta": cached, "model": target_model, "node_id": node_id_ctx.get(), "cached": True})
+                llm_metrics.record_call(target_model, time.monotonic() - started, source="exact_cache")
+                return cached
+
+        # [Phase 3] Cache Hit Check (按 model / system_instruction / crew / schema 分命名空间)
+        semantic_query = ""
+        semantic_namespace = {
+            "model": target_model, "system_instruction": system_instruction,
+            "crew": crew_ctx.get(), "response_schema": response_schema
+        }
         if semantic_cache_tool and contents:
             try:
                 # 提取用户 Query (简化逻辑: 取最后一个 user part)
@@ -80,24 +336,123 @@ class GeminiKeyRotator:
                 
                 if len(last_user_msg) > 10: # 太短的不查
                     # 注意：假设 memory tool 已经异步化
-                    cached_res = await semantic_cache_tool.check_semantic_cache(last_user_msg)
+                    semantic_query = last_user_msg
+                    cached_res = await semantic_cache_tool.check_semantic_cache(last_user_msg, **semantic_namespace)
                     if cached_res:
+                        llm_metrics.record_call(target_model, time.monotonic() - started, source="semantic_cache")
                         return cached_res
             except Exception as e:
                 logger.warning(f"Cache check skipped due to error: {e}")
 
-        # [Smart Routing]
-        target_model = model_name
-        if complexity:
-            target_model = self._get_model_by_complexity(complexity)
-            
-        # --- [Fix] 构造请求 Payload ---
-        headers = {"Content-Type": "application/json"}
-        
+        # [Streaming] 仅在有事件消费者且输出为自由文本时走流式，对冲调用不流式
+        use_stream = stream and not hedge and not response_schema and has_event_sink()
+
+        def dispatch():
+            return self._dispatch(target_model, payload, priority, hedge, use_stream, cache_key)
+
+        # use_cache=False 表示调用方需要独立采样，不与其他请求合并
+        if not use_cache:
+            result = await dispatch()
+            llm_metrics.record_call(target_model, time.monotonic() - started, ok=bool(result))
+            return result
+
+        # [Single-Flight] 相同请求已在途时共享其结果，而不是再发一次
+        follower = self.single_flight.is_in_flight(request_key)
+        result = await self.single_flight.do(request_key, dispatch)
+        if follower and result and stream and has_event_sink():
+            # 跟随者看不到 leader 的增量 token，结果就绪后一次性推送
+            emit_event("token", {"delta": result, "model": target_model, "node_id": node_id_ctx.get(), "coalesced": True})
+        llm_metrics.record_call(
+            target_model, time.monotonic() - started, ok=bool(result),
+            source="coalesced" if follower else "upstream"
+        )
+        if semantic_query and result and not follower:
+            # 未命中时写回语义缓存 (后台批量写入，不增加本次调用的延迟)
+            try:
+                await semantic_cache_tool.store_cache(semantic_query, result, **semantic_namespace)
+            except Exception as e:
+                logger.warning(f"Semantic cache store skipped due to error: {e}")
+        return result
+
+    async def _dispatch(
+        self,
+        target_model: str,
+        payload: Dict[str, Any],
+        priority: str,
+        hedge: bool,
+        use_stream: bool,
+        cache_key: Optional[str]
+    ) -> str:
+        """
+        发出上游请求，并在熔断时降级到另一个 Tier。
+        调度器槽位按每次尝试获取：等待 Key 冷却与退避期间不占用槽位，限流的调用不会挤占交互式流量。
+        """
+        slot = self._slot_factory(priority)
+        # [Resilience] 主 Tier 熔断时自动降级到另一个 Tier
+        for model in self._tier_candidates(target_model):
+            breaker = self.breakers.get(self.base_url, model)
+            if use_stream:
+                result = await self._collect_stream(model, payload, breaker, slot)
+            elif hedge:
+                result = await self._send_hedged(model, payload, breaker, slot)
+            else:
+                result = await self._send_with_retries(model, payload, breaker, slot)
+            if result is not None:
+                if result and cache_key is not None:
+                    await self.response_cache.aset(cache_key, result)
+                return result
+            logger.warning(f"⚡ Tier [{model}] unavailable (circuit open). Trying fallback tier...")
+        logger.error("All model tiers unavailable. Failing fast.")
+        return ""
+
+    def _slot_factory(self, priority: str) -> Callable[[], Any]:
+        """返回获取调度器槽位的上下文工厂 (在调用方的上下文中固定 thread_id)"""
+        return partial(self.scheduler.slot, priority=priority, thread_id=thread_id_ctx.get())
+
+    async def call_batch(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        [Fan-out] 批量调用：N 个相互独立的请求并发下发，整体耗时约为一次往返。
+        每个 request 为 call_gemini_with_rotation 的关键字参数 (至少包含 model_name 与 contents)。
+        所有请求仍经过调度器、Key 池与熔断器，因此并发度受全局限额约束。
+        返回与输入顺序一致的列表，每项为 {"ok": bool, "result": str, "error": Optional[str]}，
+        单个请求失败不影响其他请求。
+        注：Gemini 的 batchGenerateContent 是异步长任务 (小时级 SLA)，不适合交互式扇出，这里不使用。
+        """
+        async def run_one(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                result = await self.call_gemini_with_rotation(**kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Batch item failed: {e}")
+                return {"ok": False, "result": "", "error": str(e)}
+            if not result:
+                return {"ok": False, "result": "", "error": "Empty response"}
+            return {"ok": True, "result": result, "error": None}
+
+        if not requests:
+            return []
+        return list(await asyncio.gather(*(run_one(dict(req)) for req in requests)))
+
+    def _build_payload(
+        self,
+        contents: List[Dict[str, Any]],
+        system_instruction: str = "",
+        response_schema: Optional[Any] = None,
+        complexity: Optional[str] = "complex"
+    ) -> Dict[str, Any]:
+        """
+        --- [Fix] 构造请求 Payload ---
+        结构化输出 (response_schema) 是决策 / 解析类调用，使用 temperature 0 保证结果确定，
+        同时使其落入精确匹配缓存的范围。
+        """
+        temperature = 0.7 if complexity == "complex" else 0.3
+        if response_schema:
+            temperature = 0.0
         payload = {
             "contents": contents,
             "generationConfig": {
-                "temperature": 0.7 if complexity == "complex" else 0.3, 
+                "temperature": temperature,
             }
         }
 
@@ -110,47 +465,357 @@ class GeminiKeyRotator:
                 payload["generationConfig"]["responseSchema"] = response_schema.model_json_schema()
             elif isinstance(response_schema, dict):
                 payload["generationConfig"]["responseSchema"] = response_schema
+        return payload
 
-        # --- [Fix] 根据模式分叉 ---
-        url = ""
-        
+    async def stream_gemini(
+        self,
+        model_name: str,
+        contents: List[Dict[str, Any]],
+        system_instruction: str = "",
+        complexity: Literal["simple", "complex"] = "complex",
+        priority: Literal["interactive", "default", "background"] = "default"
+    ) -> AsyncIterator[str]:
+        """
+        [Streaming] 流式调用，逐个产出文本增量 (Async Iterator)。
+        Google 原生模式使用 streamGenerateContent (alt=sse)，Gateway 模式使用 chat/completions SSE。
+        """
+        started = time.monotonic()
+        target_model = self._get_model_by_complexity(complexity) if complexity else model_name
+        payload = self._build_payload(contents, system_instruction, None, complexity)
+        produced = False
+
+        slot = self._slot_factory(priority)
+        try:
+            for model in self._tier_candidates(target_model):
+                status: Dict[str, Any] = {}
+                async for delta in self._iter_stream(model, payload, self.breakers.get(self.base_url, model), status, slot):
+                    produced = True
+                    yield delta
+                if not status.get("circuit_open"):
+                    return
+                logger.warning(f"⚡ Tier [{model}] unavailable (circuit open). Trying fallback tier...")
+        finally:
+            llm_metrics.record_call(target_model, time.monotonic() - started, ok=produced)
+
+    async def _collect_stream(
+        self,
+        target_model: str,
+        payload: Dict[str, Any],
+        breaker: CircuitBreaker,
+        slot: Callable[[], Any]
+    ) -> Optional[str]:
+        """消费流式输出：逐块推送 token 事件，并拼接为完整文本返回"""
+        status: Dict[str, Any] = {}
+        chunks: List[str] = []
+        async for delta in self._iter_stream(target_model, payload, breaker, status, slot):
+            chunks.append(delta)
+            emit_event("token", {"delta": delta, "model": target_model, "node_id": node_id_ctx.get()})
+        if status.get("circuit_open") and not chunks:
+            return None
+        return "".join(chunks)
+
+    async def _iter_stream(
+        self,
+        target_model: str,
+        payload: Dict[str, Any],
+        breaker: CircuitBreaker,
+        status: Dict[str, Any],
+        slot: Callable[[], Any]
+    ) -> AsyncIterator[str]:
+        """
+        单个 Tier 的流式请求 (多 Key 故障转移 + 熔断)。
+        只有在尚未产出任何内容时才会重试；status["circuit_open"] 表示该 Tier 已熔断。
+        每次尝试单独占用调度器槽位，等待 Key 与退避时归还。
+        """
+        if self.is_gateway:
+            # include_usage: 让 OpenAI 兼容网关在最后一个数据块中返回 usage
+            payload = {**payload, "model": target_model, "stream": True, "stream_options": {"include_usage": True}}
+
+        est_tokens = KeyPool.estimate_tokens(payload)
+        retries = max(3, len(self.key_pool))
+        attempt = 0
+        while attempt < retries:
+            wait_time = None
+            outcome = "neutral"
+            yielded = False
+            status_code = None
+            retry_after = None
+            async with slot():
+                ks = self.key_pool.acquire(est_tokens)
+                if ks is None:
+                    wait_time = self.key_pool.next_available_in(est_tokens)
+                elif not breaker.allow_request():
+                    self.key_pool.release(ks, est_tokens, actual_tokens=0)
+                    status["circuit_open"] = True
+                    return
+                else:
+                    attempt += 1
+                    url, headers = self._build_request(target_model, ks.key, stream=True)
+                    started = time.monotonic()
+                    usage = None
+                    try:
+                        # 流式请求中 timeout 作用于相邻两个数据块之间的读取间隔
+                        async with self._stream_request("POST", url, headers=headers, json=payload, timeout=breaker.adaptive_timeout()) as response:
+                            status_code = response.status_code
+                            if status_code == 200:
+                                async for line in response.aiter_lines():
+                                    delta, chunk_usage = self._parse_sse_line(line)
+                                    if chunk_usage:
+                                        # 用量通常只出现在最后一个数据块 (Gemini 为累计值)
+                                        usage = chunk_usage
+                                    if delta:
+                                        yielded = True
+                                        yield delta
+                                outcome = "success"
+                            else:
+                                await response.aread()
+                                retry_after = response.headers.get("Retry-After")
+                                if status_code in [500, 502, 503, 504]:
+                                    outcome = "failure"
+                                elif status_code != 429:
+                                    logger.error(f"Stream API Failed: {response.text}")
+                    except Exception as e:
+                        outcome = "failure"
+                        self.key_pool.mark_error(ks)
+                        logger.error(f"Stream request failed: {e}")
+                    finally:
+                        latency = time.monotonic() - started
+                        self.key_pool.release(ks, est_tokens, usage["total_tokens"] if usage else None)
+                        if usage:
+                            llm_metrics.record_usage(target_model, usage)
+                        if outcome == "success":
+                            breaker.record_success(latency)
+                        elif outcome == "failure":
+                            breaker.record_failure(latency)
+                        else:
+                            breaker.record_neutral()
+
+            if ks is None:
+                if wait_time > MAX_KEY_WAIT_SECONDS:
+                    logger.error(f"No API key available within {MAX_KEY_WAIT_SECONDS}s (keys={len(self.key_pool)}).")
+                    return
+                await asyncio.sleep(wait_time)
+                continue
+            if outcome == "success" or yielded:
+                # 已输出部分内容时无法透明重试，直接结束
+                return
+            if status_code == 429:
+                self.key_pool.mark_throttled(ks, KeyPool.parse_retry_after(retry_after))
+            elif outcome == "failure":
+                if breaker.state != CircuitBreaker.OPEN:
+                    await asyncio.sleep(2 ** (attempt - 1))
+            else:
+                self.key_pool.mark_error(ks)
+                return
+
+    def _hedge_delay(self, breaker: CircuitBreaker) -> Optional[float]:
+        """对冲触发延迟 = 近期延迟的 HEDGE_PERCENTILE 分位；样本不足时不对冲"""
+        if len(breaker.latency) < HEDGE_MIN_SAMPLES:
+            return None
+        delay = breaker.latency.percentile(HEDGE_PERCENTILE)
+        return max(HEDGE_MIN_DELAY, delay) if delay is not None else None
+
+    async def _send_hedged(
+        self,
+        target_model: str,
+        payload: Dict[str, Any],
+        breaker: CircuitBreaker,
+        slot: Callable[[], Any]
+    ) -> Optional[str]:
+        """
+        [Hedging] 推测性重复请求
+        主请求超过延迟分位仍未返回时，换一个 Key (单 Key 时换另一个 Tier) 发出对冲请求，
+        取先成功返回的结果并取消落败者。对冲请求同样经过调度器，占用自己的槽位。
+        """
+        self.hedge_budget.record_call()
+        delay = self._hedge_delay(breaker)
+        primary = asyncio.create_task(self._send_with_retries(target_model, payload, breaker, slot))
+        if delay is None:
+            return await primary
+
+        secondary: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self.hedge_budget.try_spend():
+                return await primary
+
+            # 多 Key 时 least-loaded 会自然选中主请求之外的 Key；单 Key 时改走另一个 Tier
+            hedge_model = target_model
+            if len(self.key_pool) <= 1:
+                hedge_model = self._tier_candidates(target_model)[-1]
+            hedge_breaker = self.breakers.get(self.base_url, hedge_model)
+            logger.info(f"🏎️ Hedging slow call after {delay:.2f}s ({target_model} -> {hedge_model})")
+            secondary = asyncio.create_task(self._send_with_retries(hedge_model, payload, hedge_breaker, slot))
+
+            pending = {primary, secondary}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = self._task_result(task, None)
+                    if result:
+                        if task is secondary:
+                            self.hedge_budget.record_win()
+                        return result
+            # 两个请求都失败：沿用主请求的语义 (None 表示熔断降级)
+            return self._task_result(primary, "")
+        finally:
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _task_result(task: asyncio.Task, default: Optional[str]) -> Optional[str]:
+        """读取已完成任务的结果；被取消或抛出异常的任务返回 default (task.exception() 对已取消任务会抛 CancelledError)"""
+        if task.cancelled() or task.exception() is not None:
+            return default
+        return task.result()
+
+    async def _send_with_retries(
+        self,
+        target_model: str,
+        payload: Dict[str, Any],
+        breaker: CircuitBreaker,
+        slot: Callable[[], Any]
+    ) -> Optional[str]:
+        """
+        Retry Logic (共享连接池 + 多 Key 故障转移 + 熔断)
+        返回 None 表示该 Tier 已熔断，调用方应降级到其他 Tier。
+        每次尝试单独占用调度器槽位；等待 Key 冷却与退避 sleep 都在槽位之外。
+        """
+        if self.is_gateway:
+            payload = {**payload, "model": target_model}
+
+        est_tokens = KeyPool.estimate_tokens(payload)
+        # 每个 Key 至少有一次尝试机会
+        retries = max(3, len(self.key_pool))
+        attempt = 0
+        while attempt < retries:
+            wait_time = None
+            response = None
+            async with slot():
+                ks = self.key_pool.acquire(est_tokens)
+                if ks is None:
+                    wait_time = self.key_pool.next_available_in(est_tokens)
+                elif not breaker.allow_request():
+                    self.key_pool.release(ks, est_tokens, actual_tokens=0)
+                    return None
+                else:
+                    attempt += 1
+                    url, headers = self._build_request(target_model, ks.key)
+                    timeout = breaker.adaptive_timeout()
+                    started = time.monotonic()
+                    outcome = "neutral"
+
+                    try:
+                        response = await self._request("POST", url, headers=headers, json=payload, timeout=timeout)
+                    except Exception as e:
+                        outcome = "failure"
+                        self.key_pool.mark_error(ks)
+                        if isinstance(e, httpx.TimeoutException):
+                            logger.error(f"Request timed out after {timeout:.1f}s ({target_model})")
+                        else:
+                            logger.error(f"Request failed: {e}")
+                    finally:
+                        # 无论成功、失败还是被取消 (对冲落败)，都必须归还 Key 与半开探测名额
+                        latency = time.monotonic() - started
+                        self.key_pool.release(ks)
+                        if response is not None and response.status_code == 200:
+                            outcome = "success"
+                        elif response is not None and response.status_code in [500, 502, 503, 504]:
+                            outcome = "failure"
+                        if outcome == "success":
+                            breaker.record_success(latency)
+                        elif outcome == "failure":
+                            breaker.record_failure(latency)
+                        else:
+                            # Key 限流 / 请求参数错误 / 被取消 不计入模型 Tier 的熔断统计
+                            breaker.record_neutral()
+
+            if ks is None:
+                if wait_time > MAX_KEY_WAIT_SECONDS:
+                    logger.error(f"No API key available within {MAX_KEY_WAIT_SECONDS}s (keys={len(self.key_pool)}).")
+                    break
+                logger.info(f"⏳ All keys throttled or at quota. Waiting {wait_time:.1f}s...")
+                await asyncio.sleep(wait_time)
+                continue
+
+            if response is None:
+                if breaker.state != CircuitBreaker.OPEN:
+                    await asyncio.sleep(1)
+                continue
+
+            if response.status_code == 200:
+                data = response.json()
+                usage = extract_usage(data)
+                if usage:
+                    # [Cost Telemetry] 记录真实用量，并按实际值修正该 Key 的 TPM 预扣
+                    llm_metrics.record_usage(target_model, usage)
+                    self.key_pool.settle(ks, est_tokens, usage["total_tokens"])
+                return self._extract_text(data)
+
+            if response.status_code == 429:
+                # [Failover] 限流只影响当前 Key：冷却它并立刻换下一个健康 Key，不再原地 sleep
+                retry_after = KeyPool.parse_retry_after(response.headers.get("Retry-After"))
+                self.key_pool.mark_throttled(ks, retry_after)
+            elif response.status_code in [500, 502, 503, 504]:
+                # 服务端故障与 Key 无关，仍然指数退避
+                self.key_pool.mark_error(ks)
+                if breaker.state == CircuitBreaker.OPEN:
+                    # 已熔断：不再退避，下一轮直接降级
+                    continue
+                wait_time = 2 ** (attempt - 1)
+                logger.warning(f"API Error {response.status_code}. Retrying in {wait_time}s...")
+                await asyncio.sleep(wait_time)
+            else:
+                self.key_pool.mark_error(ks)
+                logger.error(f"API Failed: {response.text}")
+                break
+                
+        return ""
+
+    def _build_request(self, target_model: str, api_key: str, stream: bool = False) -> Tuple[str, Dict[str, str]]:
+        """根据模式 (Gateway / Google 原生) 构造 URL 与请求头"""
+        headers = {"Content-Type": "application/json"}
         if self.is_gateway:
-            # === Gateway (RP) 模式 ===
+            # === Gateway (RP) 模式 === (流式通过 payload 中的 stream 字段开启)
             url = f"{self.base_url}/v1/chat/completions"
-            headers["Authorization"] = f"Bearer {self.api_key}"
-            payload["model"] = target_model
+            headers["Authorization"] = f"Bearer {api_key}"
+        elif stream:
+            # === Google 原生流式 (SSE) ===
+            url = f"{self.base_url}/{target_model}:streamGenerateContent?alt=sse&key={api_key}"
         else:
             # === Google 原生模式 ===
-            url = f"{self.base_url}/{target_model}:generateContent?key={self.api_key}"
-
-        # Retry Logic
-        retries = 3
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            for attempt in range(retries):
-                try:
-                    response = await client.post(url, headers=headers, json=payload)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        candidates = data.get("candidates", [])
-                        if candidates:
-                            content = candidates[0].get("content", {})
-                            parts = content.get("parts", [])
-                            if parts:
-                                text_resp = parts[0].get("text", "")
-                                return text_resp
-                        return "" 
-                    
-                    elif response.status_code in [429, 500, 503]:
-                        wait_time = 2 ** attempt
-                        logger.warning(f"API Error {response.status_code}. Retrying in {wait_time}s...")
-                        await asyncio.sleep(wait_time)
-                    else:
-                        logger.error(f"API Failed: {response.text}")
-                        break
-                        
-                except Exception as e:
-                    logger.error(f"Request failed: {e}")
-                    await asyncio.sleep(1)
-                
+            url = f"{self.base_url}/{target_model}:generateContent?key={api_key}"
+        return url, headers
+
+    @classmethod
+    def _parse_sse_line(cls, line: str) -> Tuple[str, Optional[Dict[str, int]]]:
+        """
+        解析一行 SSE 数据，兼容 Gemini (candidates) 与 OpenAI (choices.delta) 两种格式。
+        返回 (文本增量, Token 用量)，没有用量信息的数据块用量为 None。
+        """
+        if not line.startswith("data:"):
+            return "", None
+        data_str = line[5:].strip()
+        if not data_str or data_str == "[DONE]":
+            return "", None
+        try:
+            data = json.loads(data_str)
+        except json.JSONDecodeError:
+            return "", None
+        usage = extract_usage(data)
+        choices = data.get("choices")
+        if choices:
+            return (choices[0].get("delta") or {}).get("content") or "", usage
+        return cls._extract_text(data), usage
+
+    @staticmethod
+    def _extract_text(data: Dict[str, Any]) -> str:
+        """从响应体中提取首个候选的文本"""
+        candidates = data.get("candidates", [])
+        if candidates:
+            content = candidates[0].get("content", {})
+            parts = content.get("parts", [])
+            if parts:
+                return parts[0].get("text", "")
         return ""
@@ -0,0 +1,153 @@
+import asyncio
+import time
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Deque, Tuple, Optional
+
+logger = logging.getLogger("LLM-Scheduler")
+
+# 优先级 (数值越小越先调度)
+PRIORITY_LEVELS: Dict[str, int] = {
+    "interactive": 0,  # Orchestrator 决策等关键路径调用
+    "default": 1,      # 普通 Crew 节点
+    "background": 2,   # Summarizer 等可延后的调用
+}
+
+class LLMScheduler:
+    """
+    [Admission Control] 全局 LLM 调用调度器
+    - 有界并发窗口：同时在途的上游调用不超过 max_concurrency
+    - 优先级队列：interactive > default > background (带老化防饿死)
+    - 公平排队：同一优先级内按 thread_id 轮转，避免单个会话独占窗口
+    """
+    def __init__(self, max_concurrency: int, aging_seconds: float = 30.0, stats_window: int = 1000):
+        self.max_concurrency = max(1, max_concurrency)
+        self.aging_seconds = aging_seconds
+        self._in_flight = 0
+        # priority -> thread_id -> deque[(future, enqueued_at)]
+        self._queues: Dict[int, "OrderedDict[str, Deque[Tuple[asyncio.Future, float]]]"] = {
+            level: OrderedDict() for level in sorted(set(PRIORITY_LEVELS.values()))
+        }
+        self._wait_times: Deque[float] = deque(maxlen=stats_window)
+        self._stats = {"admitted": 0, "queued": 0, "cancelled_while_queued": 0, "aged_promotions": 0}
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "default", thread_id: Optional[str] = None):
+        """获取一个并发槽位，退出上下文时自动归还"""
+        await self._acquire(priority, thread_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: str, thread_id: Optional[str]):
+        level = PRIORITY_LEVELS.get(priority, PRIORITY_LEVELS["default"])
+        # Fast path: 窗口未满且无人排队
+        if self._in_flight < self.max_concurrency and not self.queue_depth():
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            self._wait_times.append(0.0)
+            return
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        enqueued_at = time.monotonic()
+        thread_key = thread_id or "_anonymous"
+        self._queues[level].setdefault(thread_key, deque()).append((fut, enqueued_at))
+        self._stats["queued"] += 1
+
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 槽位已分配但调用方已离开：立即转交给下一个等待者
+                self._release()
+            else:
+                self._stats["cancelled_while_queued"] += 1
+                self._discard(level, thread_key, fut)
+            raise
+
+        self._wait_times.append(time.monotonic() - enqueued_at)
+
+    def _release(self):
+        self._in_flight = max(0, self._in_flight - 1)
+        self._dispatch()
+
+    def _dispatch(self):
+        """在窗口有空余时唤醒等待者"""
+        while self._in_flight < self.max_concurrency:
+            fut = self._pop_next()
+            if fut is None:
+                return
+            if fut.done():
+                continue
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            fut.set_result(None)
+
+    def _pop_next(self) -> Optional[asyncio.Future]:
+        now = time.monotonic()
+        levels = sorted(self._queues)
+
+        # 老化: 低优先级中等待超过 aging_seconds 的请求优先放行，避免后台任务饿死
+        for level in levels[1:]:
+            for thread_key, waiters in self._queues[level].items():
+                if waiters and now - waiters[0][1] >= self.aging_seconds:
+                    self._stats["aged_promotions"] += 1
+                    return self._pop_from(level, thread_key)
+
+        for level in levels:
+            queues = self._queues[level]
+            if queues:
+                # Round-robin: 取队首 thread，出队后若仍有等待者则移到队尾
+                thread_key = next(iter(queues))
+                return self._pop_from(level, thread_key)
+        return None
+
+    def _pop_from(self, level: int, thread_key: str) -> asyncio.Future:
+        queues = self._queues[level]
+        waiters = queues.pop(thread_key)
+        fut, _ = waiters.popleft()
+        if waiters:
+            queues[thread_key] = waiters
+        return fut
+
+    def _discard(self, level: int, thread_key: str, fut: asyncio.Future):
+        waiters = self._queues[level].get(thread_key)
+        if not waiters:
+            return
+        for entry in list(waiters):
+            if entry[0] is fut:
+                waiters.remove(entry)
+                break
+        if not waiters:
+            del self._queues[level][thread_key]
+
+    def queue_depth(self) -> int:
+        return sum(len(w) for queues in self._queues.values() for w in queues.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 队列深度、在途数量与排队耗时分布"""
+        waits = sorted(self._wait_times)
+
+        def pct(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1)
+
+        level_names = {v: k for k, v in PRIORITY_LEVELS.items()}
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth(),
+            "queue_depth_by_priority": {
+                level_names[level]: sum(len(w) for w in queues.values())
+                for level, queues in self._queues.items()
+            },
+            "waiting_threads": len({t for queues in self._queues.values() for t in queues}),
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+            **self._stats
+        }
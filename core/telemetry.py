@@ -0,0 +1,254 @@
+import asyncio
+import functools
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable
+
+from core.circuit_breaker import LatencyTracker
+from core.logger_setup import token_usage_ctx, thread_id_ctx, crew_ctx, agent_node_ctx
+
+logger = logging.getLogger("Telemetry")
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens")
+
+def extract_usage(data: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """
+    从响应体中提取 Token 用量，兼容两种格式:
+    - Gemini: usageMetadata.{promptTokenCount, candidatesTokenCount, cachedContentTokenCount, totalTokenCount}
+    - OpenAI (Gateway): usage.{prompt_tokens, completion_tokens, total_tokens, prompt_tokens_details.cached_tokens}
+    """
+    meta = data.get("usageMetadata")
+    if meta:
+        prompt = int(meta.get("promptTokenCount") or 0)
+        completion = int(meta.get("candidatesTokenCount") or 0)
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "cached_tokens": int(meta.get("cachedContentTokenCount") or 0),
+            "total_tokens": int(meta.get("totalTokenCount") or prompt + completion)
+        }
+    usage = data.get("usage")
+    if usage:
+        prompt = int(usage.get("prompt_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or 0)
+        details = usage.get("prompt_tokens_details") or {}
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "cached_tokens": int(details.get("cached_tokens") or 0),
+            "total_tokens": int(usage.get("total_tokens") or prompt + completion)
+        }
+    return None
+
+def new_usage_counter() -> Dict[str, int]:
+    """供工作流入口放入 token_usage_ctx 的空计数器"""
+    return {f: 0 for f in USAGE_FIELDS}
+
+class _Aggregate:
+    """单个维度取值 (如 crew=coding_crew) 下的累计指标"""
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.tokens = {f: 0 for f in USAGE_FIELDS}
+        self.latency_total = 0.0
+        self.latency = LatencyTracker()
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50 = self.latency.percentile(0.50)
+        p95 = self.latency.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            **self.tokens,
+            "latency_total_s": round(self.latency_total, 2),
+            "latency_p50_s": round(p50, 2) if p50 is not None else None,
+            "latency_p95_s": round(p95, 2) if p95 is not None else None
+        }
+
+class LLMMetrics:
+    """
+    [Cost Telemetry] 进程内 LLM 调用指标注册表
+    按 node / crew / thread / tier 四个维度聚合调用次数、Token 用量与耗时。
+    维度取值来自上下文变量，调用方无需显式传参。thread 维度按 LRU 限制数量。
+    """
+    DIMENSIONS = ("node", "crew", "thread", "tier")
+
+    def __init__(self, max_threads: int = 512):
+        self.max_threads = max_threads
+        self._by: Dict[str, "OrderedDict[str, _Aggregate]"] = {d: OrderedDict() for d in self.DIMENSIONS}
+        self._total = _Aggregate()
+
+    def _labels(self, model: str) -> Dict[str, str]:
+        return {
+            "node": agent_node_ctx.get() or "unknown",
+            "crew": crew_ctx.get() or "unknown",
+            "thread": thread_id_ctx.get() or "unknown",
+            "tier": model
+        }
+
+    def _aggregates(self, model: str):
+        yield self._total
+        for dim, label in self._labels(model).items():
+            bucket = self._by[dim]
+            agg = bucket.get(label)
+            if agg is None:
+                agg = bucket[label] = _Aggregate()
+            bucket.move_to_end(label)
+            if dim == "thread" and len(bucket) > self.max_threads:
+                bucket.popitem(last=False)
+            yield agg
+
+    def record_usage(self, model: str, usage: Dict[str, int]):
+        """记录一次上游响应的 Token 用量，并累加到当前上下文的 token_usage_ctx"""
+        for agg in self._aggregates(model):
+            for f in USAGE_FIELDS:
+                agg.tokens[f] += usage.get(f, 0)
+
+        current = token_usage_ctx.get()
+        if current is None:
+            current = new_usage_counter()
+            token_usage_ctx.set(current)
+        for f in USAGE_FIELDS:
+            current[f] = current.get(f, 0) + usage.get(f, 0)
+
+    def record_call(self, model: str, latency: float, ok: bool = True, source: str = "upstream"):
+        """
+        记录一次逻辑调用 (call_gemini_with_rotation 的一次返回)。
+        source: upstream / exact_cache / semantic_cache / coalesced
+        """
+        for agg in self._aggregates(model):
+            agg.calls += 1
+            agg.latency_total += latency
+            agg.latency.record(latency)
+            if not ok:
+                agg.errors += 1
+            if source in ("exact_cache", "semantic_cache"):
+                agg.cache_hits += 1
+            elif source == "coalesced":
+                agg.coalesced += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "total": self._total.to_dict(),
+            **{f"by_{dim}": {label: agg.to_dict() for label, agg in bucket.items()} for dim, bucket in self._by.items()}
+        }
+
+    def reset(self):
+        self._by = {d: OrderedDict() for d in self.DIMENSIONS}
+        self._total = _Aggregate()
+
+# 全局单例
+llm_metrics = LLMMetrics()
+
+class Histogram:
+    """固定分桶直方图 (累计计数，形如 Prometheus histogram)"""
+    def __init__(self, bounds):
+        self.bounds = sorted(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        buckets, cumulative = {}, 0
+        for bound, n in zip(self.bounds + [float("inf")], self.counts):
+            cumulative += n
+            buckets["+Inf" if bound == float("inf") else f"<={bound:g}"] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "buckets": buckets
+        }
+
+class SandboxMetrics:
+    """
+    [Profiling] 沙箱执行资源画像的聚合 (墙钟 / CPU / 峰值内存 / CPU 利用率直方图与 OOM、超时计数)，
+    用于依据实际数据调整 mem_limit、nano_cpus 与容器池大小。
+    """
+    WALL_BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    CPU_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    MEMORY_MB_BOUNDS = (32, 64, 128, 256, 384, 512, 1024, 2048)
+    UTILIZATION_BOUNDS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0)
+
+    def __init__(self):
+        self.reset()
+
+    def record(self, profile: Dict[str, Any], timed_out: bool = False):
+        self.runs += 1
+        if timed_out:
+            self.timeouts += 1
+        if profile.get("oom_killed"):
+            self.oom_kills += 1
+        self.wall_time.observe(profile["wall_time_s"])
+        if profile.get("cpu_time_s") is not None:
+            self.cpu_time.observe(profile["cpu_time_s"])
+        if profile.get("cpu_utilization") is not None:
+            self.cpu_utilization.observe(profile["cpu_utilization"])
+        if profile.get("peak_rss_bytes") is not None:
+            self.peak_memory_mb.observe(profile["peak_rss_bytes"] / (1024 * 1024))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "timeouts": self.timeouts,
+            "oom_kills": self.oom_kills,
+            "wall_time_s": self.wall_time.to_dict(),
+            "cpu_time_s": self.cpu_time.to_dict(),
+            "cpu_utilization": self.cpu_utilization.to_dict(),
+            "peak_memory_mb": self.peak_memory_mb.to_dict()
+        }
+
+    def reset(self):
+        self.runs = 0
+        self.timeouts = 0
+        self.oom_kills = 0
+        self.wall_time = Histogram(self.WALL_BOUNDS)
+        self.cpu_time = Histogram(self.CPU_BOUNDS)
+        self.cpu_utilization = Histogram(self.UTILIZATION_BOUNDS)
+        self.peak_memory_mb = Histogram(self.MEMORY_MB_BOUNDS)
+
+# 全局单例
+sandbox_metrics = SandboxMetrics()
+
+def track_node(crew: str, node: str) -> Callable:
+    """
+    节点装饰器：在节点执行期间设置 crew / agent_node 上下文，
+    使节点内的 LLM 调用按 Crew 与节点归因。同时支持同步与异步节点。
+    """
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                crew_token = crew_ctx.set(crew)
+                node_token = agent_node_ctx.set(node)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    agent_node_ctx.reset(node_token)
+                    crew_ctx.reset(crew_token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            crew_token = crew_ctx.set(crew)
+            node_token = agent_node_ctx.set(node)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                agent_node_ctx.reset(node_token)
+                crew_ctx.reset(crew_token)
+        return sync_wrapper
+    return decorator
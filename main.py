@@ -13,7 +13,7 @@ from langgraph.checkpoint.memory import MemorySaver
 load_dotenv()
 
 # 导入配置
-from config.keys import GEMINI_API_KEYS, PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME
+from config.keys import GATEWAY_API_BASE, GEMINI_API_KEYS, PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME
 
 # 导入核心模块
 from core.rotator import GeminiKeyRotator
@@ -162,43 +162,48 @@ async def main():
 
     # 2. 初始化工具链
     print("\n🔧 正在初始化工具链...")
-    rotator = GeminiKeyRotator(GEMINI_API_KEYS)
+    rotator = GeminiKeyRotator(GATEWAY_API_BASE, GEMINI_API_KEYS)
     memory = VectorMemoryTool(PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME)
     search = GoogleSearchTool()
     
-    # 初始化持久化存储
-    checkpointer = MemorySaver()
+    try:
+        # 初始化持久化存储
+        checkpointer = MemorySaver()
 
-    # 3. 构建图 (Agent Workflow)
-    print("🕸️ 正在构建 Agent 工作流图...")
-    # 注意：这里我们传入 checkpointer，让子图也能共享（如果我们在 build_agent_workflow 里处理好的话）
-    app = build_agent_workflow(rotator, memory, search, checkpointer=checkpointer)
+        # 3. 构建图 (Agent Workflow)
+        print("🕸️ 正在构建 Agent 工作流图...")
+        # 注意：这里我们传入 checkpointer，让子图也能共享（如果我们在 build_agent_workflow 里处理好的话）
+        app = build_agent_workflow(rotator, memory, search, checkpointer=checkpointer)
 
-    # 4. 准备初始状态
-    initial_task, _ = get_user_input()
+        # 4. 准备初始状态
+        initial_task, _ = get_user_input()
     
-    task_id = f"AutoTask_{int(time.time())}"
-    user_parts = [{"text": initial_task}]
+        task_id = f"AutoTask_{int(time.time())}"
+        user_parts = [{"text": initial_task}]
     
-    project_state = ProjectState(
-        task_id=task_id,
-        user_input=initial_task,
-        full_chat_history=[{"role": "user", "parts": user_parts}]
-    )
+        project_state = ProjectState(
+            task_id=task_id,
+            user_input=initial_task,
+            full_chat_history=[{"role": "user", "parts": user_parts}]
+        )
     
-    # 主线程 ID
-    thread_id = "main_thread_1"
-    config = {"configurable": {"thread_id": thread_id}}
+        # 主线程 ID
+        thread_id = "main_thread_1"
+        config = {"configurable": {"thread_id": thread_id}}
     
-    print(f"\n🚀 开始执行任务: {task_id}")
+        print(f"\n🚀 开始执行任务: {task_id}")
     
-    initial_input = {"project_state": project_state}
+        initial_input = {"project_state": project_state}
 
-    # 5. 双线程启动
-    workflow_task = asyncio.create_task(run_workflow_loop(app, config, initial_input))
-    listener_task = asyncio.create_task(input_listener(app, config))
-    
-    await asyncio.gather(workflow_task, listener_task)
+        # 5. 双线程启动
+        workflow_task = asyncio.create_task(run_workflow_loop(app, config, initial_input))
+        listener_task = asyncio.create_task(input_listener(app, config))
+
+        await asyncio.gather(workflow_task, listener_task)
+    finally:
+        # 写完排队中的记忆写入，并关闭连接池 (与 api_server 的 shutdown 一致)
+        await memory.close()
+        await rotator.aclose()
 
 if __name__ == "__main__":
     try:
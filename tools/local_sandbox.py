@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import signal
+import asyncio
+import logging
+import tempfile
+import subprocess
+from typing import List, Optional, Dict, Any, AsyncIterator, Set
+
+try:
+    import resource
+except ImportError:
+    # 非 POSIX 平台没有 rlimits，只保留超时保护
+    resource = None
+
+from config.keys import (
+    SANDBOX_MEM_LIMIT, SANDBOX_EXEC_TIMEOUT, SANDBOX_MAX_OUTPUT_BYTES, SANDBOX_RESULT_CACHE_ENABLED,
+    SANDBOX_MAX_ARTIFACT_BYTES, SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES, SANDBOX_MAX_ARTIFACTS,
+    SANDBOX_LOCAL_PYTHON, SANDBOX_LOCAL_ROOT, SANDBOX_LOCAL_USER,
+    SANDBOX_LOCAL_ISOLATE_NETWORK, SANDBOX_LOCAL_MAX_FILE_BYTES
+)
+from tools import sandbox_artifacts, sandbox_image, sandbox_profile
+from tools.sandbox_backend import SandboxBackend, _OutputBuffer, TIMEOUT_EXIT_CODE
+
+logger = logging.getLogger("Tools-Sandbox")
+
+# 超时发出 KILL 后，等待输出管道关闭与进程退出的最长时间
+KILL_GRACE_SECONDS = 2.0
+
+def parse_size(value: str) -> int:
+    """解析 Docker 风格的内存大小: 512m / 2g / 1048576"""
+    value = str(value).strip().lower()
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+class LocalSandbox(SandboxBackend):
+    """
+    [Local Backend] 不依赖 Docker 的本机子进程沙箱
+    - 每次执行使用独立的临时目录，脚本以该目录为工作目录与 HOME，环境变量不继承宿主机 (不泄露 API Key)
+    - rlimits: CPU 时间、地址空间 (内存)、单文件大小，禁止 core dump
+    - 以 root 运行时可切换到低权限用户；系统支持时通过 unshare 断开网络
+    - 脚本在独立的进程组中运行，超时或取消时整组杀死
+    隔离强度弱于容器，适合 CI / 无 Docker 的开发环境。不支持持久 kernel，session_id / keep_state 会被忽略。
+    """
+    backend_name = "local"
+
+    def __init__(
+        self,
+        python: Optional[str] = None,
+        run_root: Optional[str] = None,
+        user: Optional[str] = None,
+        mem_limit: str = SANDBOX_MEM_LIMIT,
+        max_file_bytes: int = SANDBOX_LOCAL_MAX_FILE_BYTES,
+        isolate_network: bool = SANDBOX_LOCAL_ISOLATE_NETWORK,
+        exec_timeout: float = SANDBOX_EXEC_TIMEOUT,
+        max_output_bytes: int = SANDBOX_MAX_OUTPUT_BYTES,
+        result_cache: bool = SANDBOX_RESULT_CACHE_ENABLED,
+        max_artifact_bytes: int = SANDBOX_MAX_ARTIFACT_BYTES,
+        max_artifacts_total_bytes: int = SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES,
+        max_artifacts: int = SANDBOX_MAX_ARTIFACTS
+    ):
+        super().__init__(
+            exec_timeout=exec_timeout,
+            max_output_bytes=max_output_bytes,
+            result_cache=result_cache,
+            max_artifact_bytes=max_artifact_bytes,
+            max_artifacts_total_bytes=max_artifacts_total_bytes,
+            max_artifacts=max_artifacts
+        )
+        self.python = python or SANDBOX_LOCAL_PYTHON or sys.executable
+        self.image = f"local:{self.python}"
+        self.run_root = run_root or SANDBOX_LOCAL_ROOT or os.path.join(tempfile.gettempdir(), "swarm_runs")
+        os.makedirs(self.run_root, exist_ok=True)
+        self.mem_limit = mem_limit
+        self.mem_bytes = parse_size(mem_limit)
+        self.max_file_bytes = max_file_bytes
+
+        self.user = user if user is not None else (SANDBOX_LOCAL_USER or None)
+        if self.user and os.geteuid() != 0:
+            logger.warning(f"Cannot switch sandbox user to '{self.user}' without root. Running as current user.")
+            self.user = None
+        self._net_prefix: List[str] = self._probe_network_isolation() if isolate_network else []
+        self._available_modules = self._discover_modules()
+        self._stats = {"runs": 0, "timeouts": 0, "cancelled": 0}
+
+    def _popen_user_kwargs(self) -> Dict[str, Any]:
+        return {"user": self.user} if self.user else {}
+
+    def _probe_network_isolation(self) -> List[str]:
+        """
+        探测可用的网络隔离方式：root 直接 unshare --net；
+        普通用户 (包括切换后的用户) 需要借助 user namespace。都不可用时返回空前缀。
+        """
+        if shutil.which("unshare") is None:
+            logger.warning("unshare not found. Local sandbox runs WITHOUT network isolation.")
+            return []
+        candidates = []
+        if os.geteuid() == 0 and not self.user:
+            candidates.append(["unshare", "--net"])
+        candidates.append(["unshare", "--user", "--map-root-user", "--net"])
+        for prefix in candidates:
+            try:
+                probe = subprocess.run(
+                    prefix + [self.python, "-c", "pass"],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    timeout=10, **self._popen_user_kwargs()
+                )
+                if probe.returncode == 0:
+                    logger.info(f"🔒 Local sandbox network isolation: {' '.join(prefix)}")
+                    return prefix
+            except Exception:
+                continue
+        logger.warning("Namespaces unavailable. Local sandbox runs WITHOUT network isolation.")
+        return []
+
+    def _discover_modules(self) -> Optional[Set[str]]:
+        """[Pre-flight] 记录执行解释器可导入的模块"""
+        try:
+            result = subprocess.run(
+                [self.python, "-c", sandbox_image.LIST_MODULES_SCRIPT],
+                stdin=subprocess.DEVNULL, capture_output=True, timeout=30, **self._popen_user_kwargs()
+            )
+            if result.returncode == 0:
+                self._python_version = sandbox_image.parse_python_version(result.stdout)
+                return sandbox_image.parse_module_list(result.stdout)
+        except Exception as e:
+            logger.warning(f"Failed to list local sandbox modules: {e}")
+        return None
+
+    def _cache_limits(self, timeout: float) -> Dict[str, Any]:
+        return {"mem_limit": self.mem_limit, "max_file_bytes": self.max_file_bytes, "timeout": timeout}
+
+    def _rlimits(self, timeout: float):
+        """返回在子进程 exec 前执行的 preexec_fn (此时已切换用户，只能调低限制)"""
+        if resource is None:
+            return None
+        cpu_seconds = int(timeout) + 1
+        mem_bytes = self.mem_bytes
+        file_bytes = self.max_file_bytes
+
+        def apply():
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+            resource.setrlimit(resource.RLIMIT_AS, (mem_bytes, mem_bytes))
+            resource.setrlimit(resource.RLIMIT_FSIZE, (file_bytes, file_bytes))
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        return apply
+
+    def _env(self, run_dir: str) -> Dict[str, str]:
+        """最小化的环境变量：不继承宿主机环境，避免泄露密钥"""
+        return {
+            "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"),
+            "HOME": run_dir,
+            "TMPDIR": run_dir,
+            "LANG": "C.UTF-8",
+            "PYTHONUNBUFFERED": "1",
+            "PYTHONDONTWRITEBYTECODE": "1",
+            "MPLBACKEND": "Agg",
+            # 多线程 BLAS 会预留大量虚拟内存，容易触发 RLIMIT_AS
+            "OMP_NUM_THREADS": "1",
+            "OPENBLAS_NUM_THREADS": "1",
+            "MKL_NUM_THREADS": "1"
+        }
+
+    def _prepare_run(self, run_dir: str, code: str):
+        os.makedirs(os.path.join(run_dir, sandbox_artifacts.OUTPUT_DIR))
+        with open(os.path.join(run_dir, "script.py"), "w", encoding="utf-8") as f:
+            f.write(self._wrap_code_with_plot_saving(code))
+        if self.user:
+            for root, dirs, files in os.walk(run_dir):
+                for name in [root] + [os.path.join(root, x) for x in dirs + files]:
+                    shutil.chown(name, user=self.user)
+
+    @staticmethod
+    def _kill_group(proc: asyncio.subprocess.Process):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def _execute(
+        self,
+        code: str,
+        timeout: float,
+        session_id: Optional[str],
+        keep_state: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        run_id = uuid.uuid4().hex
+        run_dir = os.path.join(self.run_root, run_id)
+        self._stats["runs"] += 1
+        proc: Optional[asyncio.subprocess.Process] = None
+        finished = False
+        pumps: List[asyncio.Task] = []
+        try:
+            try:
+                self._prepare_run(run_dir, code)
+                proc = await asyncio.create_subprocess_exec(
+                    *self._net_prefix, *sandbox_profile.launcher_argv(self.python),
+                    cwd=run_dir,
+                    env=self._env(run_dir),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                    preexec_fn=self._rlimits(timeout),
+                    **self._popen_user_kwargs()
+                )
+            except Exception as e:
+                logger.error(f"Failed to start local sandbox process: {e}")
+                finished = True
+                yield {"type": "result", "result": self._error_result(f"System Error: Sandbox unavailable ({str(e)})")}
+                return
+
+            logger.info(f"Running code in local sandbox (run {run_id[:8]}, pid {proc.pid})...")
+            started = time.monotonic()
+            chunks: asyncio.Queue = asyncio.Queue()
+
+            async def pump(stream: str, reader: asyncio.StreamReader):
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    chunks.put_nowait((stream, data))
+                chunks.put_nowait((stream, None))
+
+            pumps = [
+                asyncio.ensure_future(pump("stdout", proc.stdout)),
+                asyncio.ensure_future(pump("stderr", proc.stderr))
+            ]
+            buffers = {"stdout": _OutputBuffer(self.max_output_bytes), "stderr": _OutputBuffer(self.max_output_bytes)}
+            deadline = started + timeout
+            timed_out = False
+            open_streams = 2
+            while open_streams:
+                try:
+                    stream, data = await asyncio.wait_for(chunks.get(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    if timed_out:
+                        # 已 kill 但管道仍被脱离进程组的后代持有：放弃剩余输出
+                        break
+                    timed_out = True
+                    self._kill_group(proc)
+                    deadline = time.monotonic() + KILL_GRACE_SECONDS
+                    continue
+                if data is None:
+                    open_streams -= 1
+                    continue
+                text = buffers[stream].append(data)
+                if text:
+                    yield {"type": stream, "data": text, "run_id": run_id}
+
+            try:
+                returncode = await asyncio.wait_for(proc.wait(), KILL_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                self._kill_group(proc)
+                returncode = await proc.wait()
+            # 脚本退出后清理它留在进程组里的后台进程
+            self._kill_group(proc)
+            duration = time.monotonic() - started
+
+            # 只有墙钟超时 (上面的 watchdog kill) 或超出 RLIMIT_CPU (内核发送 SIGXCPU) 才算超时；
+            # CPU 硬限制触发的 SIGKILL 晚于墙钟截止时间，已由 watchdog 覆盖
+            timed_out = timed_out or returncode == -signal.SIGXCPU
+            stdout = buffers["stdout"].getvalue()
+            stderr = buffers["stderr"].getvalue()
+            # RLIMIT_AS 下内存耗尽表现为 MemoryError，由启动器记录在 .usage.json 中
+            profile = sandbox_profile.build_profile(run_id, duration, self._read_usage(run_dir))
+            if timed_out:
+                self._stats["timeouts"] += 1
+                returncode = TIMEOUT_EXIT_CODE
+                logger.warning(f"⏱️ Local sandbox run {run_id[:8]} timed out after {duration:.1f}s. Process killed.")
+                stderr = (stderr + f"\n[SYSTEM] Execution timed out after {timeout:.0f}s and was killed.").lstrip()
+            elif returncode == -signal.SIGKILL:
+                # 不是我们发出的 SIGKILL：通常来自系统 OOM killer (没有 cgroup 计数器可以确认)
+                profile["oom_killed"] = True
+                logger.warning(f"💥 Local sandbox run {run_id[:8]} was killed by SIGKILL (likely out of memory).")
+                stderr = (stderr + "\n[SYSTEM] Execution was killed (SIGKILL), most likely out of memory.").lstrip()
+            elif profile["oom_killed"]:
+                logger.warning(f"💥 Local sandbox run {run_id[:8]} ran out of memory (mem_limit={self.mem_limit}).")
+
+            loop = asyncio.get_running_loop()
+            artifacts, _ = await loop.run_in_executor(
+                None, sandbox_artifacts.collect_artifacts,
+                os.path.join(run_dir, sandbox_artifacts.OUTPUT_DIR), run_id[:8],
+                self.max_artifact_bytes, self.max_artifacts_total_bytes, self.max_artifacts
+            )
+            if artifacts:
+                logger.info(f"📸 Retrieved {len(artifacts)} artifact(s) from local sandbox.")
+            finished = True
+            yield {"type": "result", "result": self._build_result(
+                stdout, stderr, artifacts, returncode, timed_out, duration,
+                buffers["stdout"].truncated or buffers["stderr"].truncated, profile
+            )}
+        finally:
+            for task in pumps:
+                task.cancel()
+            if proc is not None and not finished:
+                # 被取消 / 迭代被提前关闭
+                self._kill_group(proc)
+                self._spawn_background(proc.wait())
+                self._stats["cancelled"] += 1
+                logger.info(f"🛑 Local sandbox run {run_id[:8]} cancelled.")
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    @staticmethod
+    def _read_usage(run_dir: str) -> Optional[Dict[str, Any]]:
+        """读取启动器写出的资源用量；进程被 kill 时文件不存在"""
+        try:
+            with open(os.path.join(run_dir, sandbox_profile.USAGE_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend_name,
+            "result_cache": self.result_cache.get_stats() if self.result_cache else {"enabled": False},
+            "python": self.python,
+            "user": self.user,
+            "network_isolated": bool(self._net_prefix),
+            **self._stats
+        }
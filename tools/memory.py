@@ -1,139 +1,379 @@
 import os
 import logging
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple, Awaitable
 # 假设使用 google.generativeai 或其他方式获取 embedding
 import google.generativeai as genai 
 
-try:
-    from pinecone import Pinecone
-except ImportError:
-    Pinecone = None
+from config.keys import (
+    MEMORY_BACKEND, EMBEDDING_MODEL,
+    MEMORY_WRITE_QUEUE_SIZE, MEMORY_WRITE_BATCH_SIZE, MEMORY_WRITE_FLUSH_MS, MEMORY_WRITE_CLOSE_TIMEOUT,
+    EMBED_CACHE_ENABLED, EMBED_CACHE_MAX_ENTRIES, EMBED_CACHE_TTL, EMBED_CACHE_DB_PATH,
+    EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX_SIZE
+)
+from core.llm_cache import LLMResponseCache, stable_hash
+from tools.vector_index import create_vector_index
+from tools.semantic_cache import SemanticCache
 
 logger = logging.getLogger("Tools-Memory")
 
+# Gemini Embedding 的非对称检索 task_type
+EMBED_TASK_QUERY = "retrieval_query"
+EMBED_TASK_DOCUMENT = "retrieval_document"
+
+class EmbeddingBatcher:
+    """
+    [Micro-Batching] 嵌入请求合并
+    window 秒内到达的请求 (或攒满 max_batch 条) 合并为一次批量调用，相同文本只嵌入一次。
+    embed_batch 为同步批量函数 (在线程池中执行)，返回与输入等长的向量列表，失败的条目为 []。
+    """
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        window: float = EMBED_BATCH_WINDOW_MS / 1000,
+        max_batch: int = EMBED_BATCH_MAX_SIZE
+    ):
+        self.embed_batch = embed_batch
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._background: set = set()
+        self._stats = {"requests": 0, "batches": 0, "texts_embedded": 0, "max_batch_seen": 0}
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # 事件循环更换 (例如多次 asyncio.run)：旧循环上的等待者已不存在
+            self._loop, self._pending, self._timer = loop, [], None
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self._stats["requests"] += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self._stats["batches"] += 1
+        self._stats["texts_embedded"] += len(texts)
+        self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(texts))
+        try:
+            loop = asyncio.get_running_loop()
+            vectors = await loop.run_in_executor(None, self.embed_batch, texts)
+            by_text = dict(zip(texts, vectors))
+        except Exception as e:
+            logger.error(f"Embedding batch failed: {e}")
+            by_text = {}
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text.get(text) or [])
+
+    def get_stats(self) -> Dict[str, Any]:
+        batches = self._stats["batches"]
+        return {
+            "avg_batch_size": round(self._stats["texts_embedded"] / batches, 2) if batches else 0.0,
+            **self._stats
+        }
+
+class WriteBehindQueue:
+    """
+    [Write-Behind] 向量写入的后台批量队列
+    - submit 把记录放入有界队列后立即返回；队列已满时默认丢弃该记录并记录日志，
+      不让调用方 (例如 LLM 调用的返回路径) 被写入速度拖住；block=True 时改为等待 (背压)
+    - 后台 worker 攒满 batch_size 条或等待 flush_interval 秒后，把整批交给 write_batch
+    - flush() 等待已提交的记录全部写完；close() 用于进程退出前
+    write_batch 失败只记录日志，不影响后续批次。
+    """
+    def __init__(
+        self,
+        write_batch: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        max_queue: int = MEMORY_WRITE_QUEUE_SIZE,
+        batch_size: int = MEMORY_WRITE_BATCH_SIZE,
+        flush_interval: float = MEMORY_WRITE_FLUSH_MS / 1000
+    ):
+        self.write_batch = write_batch
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # 正在等待 flush 的调用数；大于 0 时 worker 不再攒批
+        self._urgent = 0
+        self._stats = {"submitted": 0, "written": 0, "failed": 0, "batches": 0, "dropped": 0, "backpressure_waits": 0}
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # 事件循环更换 (例如多次 asyncio.run)：旧循环上的队列与 worker 已失效
+            if self._queue is not None and self._queue.qsize():
+                logger.warning(f"Dropping {self._queue.qsize()} memory write(s) queued on a closed event loop.")
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._wakeup = asyncio.Event()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, record: Dict[str, Any], block: bool = False):
+        self._ensure_worker()
+        if self._queue.full():
+            if not block:
+                self._stats["dropped"] += 1
+                # 持续溢出时每 100 条记录一次日志
+                if self._stats["dropped"] % 100 == 1:
+                    logger.warning(
+                        f"Memory write queue full ({self.max_queue}); dropped {self._stats['dropped']} write(s) so far."
+                    )
+                return
+            self._stats["backpressure_waits"] += 1
+        await self._queue.put(record)
+        self._stats["submitted"] += 1
+        # worker 手里还有一条，队列中 batch_size - 1 条即凑满一批
+        if self._queue.qsize() >= self.batch_size - 1:
+            self._wakeup.set()
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            first = await queue.get()
+            if queue.qsize() < self.batch_size - 1 and not self._urgent:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [first]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self.write_batch(batch)
+                self._stats["written"] += len(batch)
+            except Exception as e:
+                self._stats["failed"] += len(batch)
+                logger.error(f"Memory write batch failed ({len(batch)} record(s)): {e}")
+            finally:
+                self._stats["batches"] += 1
+                for _ in batch:
+                    queue.task_done()
+
+    async def flush(self):
+        """等待已提交的记录全部写完"""
+        if self._queue is None or self._loop is not asyncio.get_running_loop():
+            return
+        self._urgent += 1
+        self._wakeup.set()
+        try:
+            await self._queue.join()
+        finally:
+            self._urgent -= 1
+
+    async def close(self, timeout: float = MEMORY_WRITE_CLOSE_TIMEOUT):
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Memory write queue not drained within {timeout}s; {self.pending()} write(s) dropped.")
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"pending": self.pending(), "max_queue": self.max_queue, **self._stats}
+
 class VectorMemoryTool:
     """
     [Protocol Phase 3 Enhanced]
     支持语义缓存 (Semantic Caching) 的向量记忆工具。
     已全面异步化 (Async I/O non-blocking)。
+    索引后端可插拔 (见 tools/vector_index.py)：MEMORY_BACKEND=local 时使用进程内索引，不依赖 Pinecone。
     """
-    def __init__(self, api_key: str, environment: str, index_name: str):
-        # 检查是否具备启用条件
-        self.enabled = bool(api_key and index_name and Pinecone)
-        self.index = None
+    def __init__(self, api_key: str, environment: str, index_name: str, backend: str = MEMORY_BACKEND):
+        self.index, self.backend = create_vector_index(backend, api_key, index_name)
+        self.enabled = self.index is not None
         if self.enabled:
-            try:
-                self.pc = Pinecone(api_key=api_key)
-                self.index = self.pc.Index(index_name)
-            except Exception as e:
-                logger.error(f"Pinecone init failed: {e}")
-                self.enabled = False
+            logger.info(f"🧠 Vector memory backend: {self.backend}")
         else:
-            logger.warning("Pinecone not configured. Memory & Caching disabled.")
+            logger.warning(f"Vector memory disabled (MEMORY_BACKEND={backend}).")
 
-    def _get_embedding_sync(self, text: str) -> List[float]:
-        """同步获取嵌入 (内部 Helper)"""
-        if not text: return []
+        # [Embedding Cache] 相同文本 (同一模型、同一 task_type) 的嵌入只计算一次
+        self.embedding_cache: Optional[LLMResponseCache] = None
+        if EMBED_CACHE_ENABLED:
+            self.embedding_cache = LLMResponseCache(
+                max_entries=EMBED_CACHE_MAX_ENTRIES,
+                ttl=EMBED_CACHE_TTL,
+                db_path=EMBED_CACHE_DB_PATH or None,
+                table="embedding_cache"
+            )
+        # 写入索引的文档与查询使用不同的 task_type (非对称检索)，各自合并批量调用
+        self.embedding_batchers = {
+            task_type: EmbeddingBatcher(partial(self._embed_batch_sync, task_type=task_type))
+            for task_type in (EMBED_TASK_QUERY, EMBED_TASK_DOCUMENT)
+        }
+        # [Write-Behind] 写入在后台批量进行；upsert 使用专用的单线程执行器，不占用默认线程池
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-writer")
+        self.write_queue = WriteBehindQueue(self._write_batch)
+        # [Semantic Cache] 命名空间、TTL 与容量控制见 tools/semantic_cache.py
+        self.semantic_cache: Optional[SemanticCache] = None
+        if self.enabled:
+            self.semantic_cache = SemanticCache(self.index, self._get_embedding, self.write_queue.submit)
+
+    def _embed_batch_sync(self, texts: List[str], task_type: str = EMBED_TASK_QUERY) -> List[List[float]]:
+        """同步批量获取嵌入 (内部 Helper，一次 API 调用)"""
         try:
-            # 这里的 model 需与您的 Pinecone index 维度一致 (e.g., 768)
+            # 这里的 model 需与向量索引的维度一致 (e.g., 768)
             result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=text,
-                task_type="retrieval_query"
+                model=EMBEDDING_MODEL,
+                content=texts,
+                task_type=task_type
             )
             return result['embedding']
         except Exception as e:
             logger.error(f"Embedding failed: {e}")
-            return []
+            return [[] for _ in texts]
 
-    async def _get_embedding(self, text: str) -> List[float]:
-        """异步获取嵌入 (Non-blocking wrapper)"""
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._get_embedding_sync, text)
+    async def _get_embedding(self, text: str, task_type: str = EMBED_TASK_QUERY) -> List[float]:
+        """
+        异步获取嵌入 (先查缓存；未命中的并发请求由 batcher 合并为批量调用)
+        task_type: 查询使用 retrieval_query，写入索引的文档使用 retrieval_document。
+        缓存的磁盘层与 batcher 一样在线程池中访问，不阻塞事件循环。
+        """
+        if not text: return []
+        key = stable_hash({"model": EMBEDDING_MODEL, "task_type": task_type, "text": text})
+        if self.embedding_cache is not None:
+            cached = await self.embedding_cache.aget(key)
+            if cached is not None:
+                return cached
+        vector = await self.embedding_batchers[task_type].embed(text)
+        if vector and self.embedding_cache is not None:
+            await self.embedding_cache.aset(key, list(vector))
+        return vector
 
-    async def check_semantic_cache(self, query: str, threshold: float = 0.95) -> Optional[str]:
+    async def check_semantic_cache(
+        self,
+        query: str,
+        threshold: Optional[float] = None,
+        model: str = "",
+        system_instruction: str = "",
+        crew: Optional[str] = None,
+        response_schema: Any = None
+    ) -> Optional[str]:
         """
         [Phase 3] 语义缓存命中检查 (Async)
+        只在 (model, system_instruction, crew, response_schema) 相同的命名空间内查找；
+        threshold 为空时使用按 crew / 模型配置的阈值。
         """
-        if not self.enabled or not self.index: return None
+        if not self.enabled or self.semantic_cache is None: return None
 
         try:
-            # 1. 获取向量 (Async)
-            vector = await self._get_embedding(query)
-            if not vector: return None
-
-            # 2. 查询 Pinecone (Run in Executor)
-            loop = asyncio.get_running_loop()
-            
-            # 定义同步查询函数
-            def _query_pinecone():
-                return self.index.query(
-                    vector=vector,
-                    top_k=1,
-                    include_metadata=True,
-                    filter={"type": "cache_entry"} 
-                )
-            
-            response = await loop.run_in_executor(None, _query_pinecone)
-
-            if response and response.matches:
-                match = response.matches[0]
-                if match.score >= threshold:
-                    logger.info(f"⚡️ [Cache Hit] Query: '{query[:20]}...' (Score: {match.score:.4f})")
-                    return match.metadata.get("response_text")
-        
+            return await self.semantic_cache.lookup(
+                query, model, system_instruction, crew, response_schema, threshold=threshold
+            )
         except Exception as e:
             logger.warning(f"Cache lookup failed: {e}")
             
         return None
 
-    async def store_cache(self, query: str, response: str):
-        """将 LLM 的问答对存入缓存 (Async)"""
-        if not self.enabled or not self.index: return
+    async def _write_batch(self, records: List[Dict[str, Any]]):
+        """[Write-Behind] 批量嵌入 (并发请求由 batcher 合并) 后一次 upsert；删除在写入之后执行"""
+        deletes = [vector_id for r in records if r.get("op") == "delete" for vector_id in r["ids"]]
+        records = [r for r in records if r.get("op") != "delete"]
+        vectors = await asyncio.gather(*(self._get_embedding(r["text"], EMBED_TASK_DOCUMENT) for r in records))
+        upserts = [
+            {"id": r["id"], "values": vector, "metadata": r["metadata"]}
+            for r, vector in zip(records, vectors) if vector
+        ]
+        if len(upserts) < len(records):
+            logger.warning(f"Skipped {len(records) - len(upserts)} memory write(s) without embeddings.")
+        loop = asyncio.get_running_loop()
+        if upserts:
+            await loop.run_in_executor(self._write_executor, partial(self.index.upsert, vectors=upserts))
+        if deletes:
+            await loop.run_in_executor(self._write_executor, partial(self.index.delete, deletes))
+
+    async def store_cache(
+        self,
+        query: str,
+        response: str,
+        model: str = "",
+        system_instruction: str = "",
+        crew: Optional[str] = None,
+        response_schema: Any = None
+    ):
+        """将 LLM 的问答对存入对应命名空间的缓存 (Async，写入在后台批量完成)"""
+        if not self.enabled or self.semantic_cache is None: return
         try:
-            vector = await self._get_embedding(query)
-            if vector:
-                loop = asyncio.get_running_loop()
-                def _upsert_cache():
-                    self.index.upsert(vectors=[{
-                        "id": f"cache-{hash(query)}",
-                        "values": vector,
-                        "metadata": {
-                            "type": "cache_entry",
-                            "query_text": query,
-                            "response_text": response
-                        }
-                    }])
-                await loop.run_in_executor(None, _upsert_cache)
+            await self.semantic_cache.store(query, response, model, system_instruction, crew, response_schema)
         except Exception as e:
             logger.warning(f"Failed to store cache: {e}")
 
     async def store_output(self, task_id: str, content: str, agent_role: str):
         """
-        存储 Agent 的产出到长期记忆中 (Async)
+        存储 Agent 的产出到长期记忆中 (Async，写入在后台批量完成)
         """
-        if not self.enabled or not self.index: 
-            logger.info(f"💾 [Memory Mock] Storing output from {agent_role} (Pinecone Disabled)")
+        if not self.enabled or self.index is None: 
+            logger.info(f"💾 [Memory Mock] Storing output from {agent_role} (Memory Disabled)")
             return
 
         try:
-            vector = await self._get_embedding(content)
-            if vector:
-                loop = asyncio.get_running_loop()
-                def _upsert_memory():
-                    self.index.upsert(vectors=[{
-                        "id": f"mem-{task_id}-{agent_role}-{hash(content)}",
-                        "values": vector,
-                        "metadata": {
-                            "type": "agent_output",
-                            "task_id": task_id,
-                            "agent": agent_role,
-                            "content_snippet": content[:500]
-                        }
-                    }])
-                await loop.run_in_executor(None, _upsert_memory)
-                logger.info(f"💾 [Memory] Saved output from {agent_role}")
+            # 长期记忆不在 LLM 调用的返回路径上，队列满时等待而不是丢弃
+            await self.write_queue.submit({
+                "id": f"mem-{task_id}-{agent_role}-{stable_hash(content)[:16]}",
+                "text": content,
+                "metadata": {
+                    "type": "agent_output",
+                    "task_id": task_id,
+                    "agent": agent_role,
+                    "content_snippet": content[:500]
+                }
+            }, block=True)
+            logger.info(f"💾 [Memory] Queued output from {agent_role}")
         except Exception as e:
             logger.error(f"Failed to store output: {e}")
+
+    async def flush(self):
+        """等待排队中的记忆写入全部落地"""
+        await self.write_queue.flush()
+
+    async def close(self):
+        """[Lifecycle] 退出前写完排队的记录，并释放索引与缓存资源 (阻塞的收尾工作在线程池中进行)"""
+        await self.write_queue.close()
+        await asyncio.get_running_loop().run_in_executor(None, self._close_sync)
+
+    def _close_sync(self):
+        # 等待写线程上正在进行的 upsert / delete 结束后再关闭索引
+        self._write_executor.shutdown(wait=True)
+        if self.index is not None:
+            self.index.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 向量索引与嵌入统计"""
+        return {
+            "backend": self.backend,
+            "index": self.index.get_stats() if self.index is not None else None,
+            "embedding_cache": self.embedding_cache.get_stats() if self.embedding_cache else None,
+            "embedding_batcher": {task_type: b.get_stats() for task_type, b in self.embedding_batchers.items()},
+            "write_queue": self.write_queue.get_stats(),
+            "semantic_cache": self.semantic_cache.get_stats() if self.semantic_cache else None
+        }
@@ -0,0 +1,147 @@
+"""
+[Pre-flight] 执行前的静态检查
+在代码进入沙箱之前，用 ast 做几项廉价的检查，提前发现注定失败的运行：
+- 语法错误 (按沙箱解释器的语法版本解析，再完整 compile，包括 return 在函数外等编译期错误)
+- 未定义的名字 (保守策略：名字在任意作用域被绑定过即视为已定义)
+- 沙箱中不存在的模块
+发现问题时直接返回精确的错误，省去一次容器执行和一次 Reviewer 调用。
+"""
+import ast
+import builtins
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+# 出现这些调用时，名字可能被动态定义，跳过未定义名字检查
+_DYNAMIC_SCOPE_CALLS = {"exec", "eval", "globals", "locals", "vars", "__import__", "setattr"}
+# 模块级隐式存在的名字
+_MODULE_NAMES = {"__name__", "__file__", "__doc__", "__builtins__", "__spec__", "__loader__", "__package__", "__annotations__"}
+# 能捕获 ImportError 的异常类型 (except 子句中按名字匹配)
+_IMPORT_ERROR_NAMES = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+def _bound_names(tree: ast.AST) -> Set[str]:
+    """收集代码中任意位置绑定的名字"""
+    names: Set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif hasattr(ast, "MatchAs") and isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif hasattr(ast, "MatchMapping") and isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+def _has_dynamic_scope(tree: ast.AST) -> bool:
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+            return True
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _DYNAMIC_SCOPE_CALLS:
+            return True
+    return False
+
+def _imported_modules(tree: ast.AST) -> List[Dict[str, Any]]:
+    """顶层模块名及其所在行 (相对导入不检查)"""
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                modules.append({"module": alias.name.split(".")[0], "line": node.lineno})
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append({"module": node.module.split(".")[0], "line": node.lineno})
+    return modules
+
+def _catches_import_error(handler: ast.ExceptHandler) -> bool:
+    """except 子句是否会捕获 ImportError (裸 except、ImportError / ModuleNotFoundError 及其基类)"""
+    if handler.type is None:
+        return True
+    types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    for node in types:
+        name = node.attr if isinstance(node, ast.Attribute) else getattr(node, "id", None)
+        if name in _IMPORT_ERROR_NAMES:
+            return True
+    return False
+
+def _is_guarded_import(tree: ast.AST, line: int) -> bool:
+    """import 位于 try 主体中且该 try 有捕获 ImportError 的 except 子句时，视为可选依赖"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Try) and any(_catches_import_error(h) for h in node.handlers):
+            start, end = node.body[0].lineno, node.body[-1].end_lineno or node.body[-1].lineno
+            if start <= line <= end:
+                return True
+    return False
+
+def preflight_check(
+    code: str,
+    available_modules: Optional[Set[str]] = None,
+    predefined: Optional[Set[str]] = None,
+    python_version: Optional[Tuple[int, int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    返回发现的问题列表 [{"kind": "syntax" | "undefined_name" | "unavailable_import", "line", "message"}]，
+    没有问题时返回空列表。
+    available_modules: 沙箱中可导入的顶层模块；为 None 时跳过导入检查。
+    predefined: 执行前会被注入的名字 (例如沙箱自动注入的 plt)。
+    python_version: 沙箱解释器的 (major, minor)；宿主解释器更新时，拒绝沙箱无法解析的新语法 (如 3.9 中的 match)。
+    为 None 时按宿主解释器的语法检查。
+    """
+    try:
+        # 先按沙箱版本的语法解析，再用宿主 compile 补充编译期检查
+        tree = ast.parse(code, "script.py", feature_version=python_version)
+        compile(code, "script.py", "exec", dont_inherit=True)
+    except SyntaxError as e:
+        detail = f"{e.msg} (line {e.lineno})"
+        if e.text:
+            detail += f": {e.text.strip()}"
+        return [{"kind": "syntax", "line": e.lineno, "message": f"SyntaxError: {detail}"}]
+    except ValueError as e:
+        # 例如源码中包含空字节
+        return [{"kind": "syntax", "line": None, "message": f"ValueError: {e}"}]
+
+    issues: List[Dict[str, Any]] = []
+
+    if not _has_dynamic_scope(tree):
+        defined = _bound_names(tree) | set(dir(builtins)) | _MODULE_NAMES | (predefined or set())
+        reported: Set[str] = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) \
+                    and node.id not in defined and node.id not in reported:
+                reported.add(node.id)
+                issues.append({
+                    "kind": "undefined_name",
+                    "line": node.lineno,
+                    "message": f"NameError: name '{node.id}' is not defined (line {node.lineno})"
+                })
+
+    if available_modules is not None:
+        reported = set()
+        for item in _imported_modules(tree):
+            module = item["module"]
+            if module in available_modules or module in reported or _is_guarded_import(tree, item["line"]):
+                continue
+            reported.add(module)
+            issues.append({
+                "kind": "unavailable_import",
+                "line": item["line"],
+                "message": (
+                    f"ModuleNotFoundError: No module named '{module}' (line {item['line']}). "
+                    "It is not installed in the sandbox and cannot be installed at runtime; use an available library instead."
+                )
+            })
+
+    issues.sort(key=lambda i: i["line"] or 0)
+    return issues
+
+def format_issues(issues: List[Dict[str, Any]]) -> str:
+    """格式化为类似 stderr 的文本，供 Reflector 阅读"""
+    lines = ["[PRE-FLIGHT] Static check failed before execution:"]
+    lines.extend(f"- {issue['message']}" for issue in issues)
+    return "\n".join(lines)
@@ -1,5 +1,7 @@
 from typing import List
+from config.keys import SANDBOX_PACKAGES
 from core.protocol import ToolDefinition
+from tools.sandbox_image import import_names
 
 class ToolRegistry:
     """
@@ -29,7 +31,7 @@ class ToolRegistry:
     def get_sandbox_schema() -> ToolDefinition:
         return {
             "name": "python_sandbox",
-            "description": "Python 代码沙箱。用于执行计算、数据分析、绘图或运行算法。支持 pandas, matplotlib, numpy 等库。",
+            "description": f"Python 代码沙箱。用于执行计算、数据分析、绘图或运行算法。预装 {', '.join(import_names(SANDBOX_PACKAGES))} 等库。",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -1,110 +1,631 @@
-import docker
+try:
+    import docker
+except ImportError:
+    # [Optional] 未安装 docker SDK 时只能使用本地后端 (tools/local_sandbox.py)
+    docker = None
 import time
 import logging
 import tarfile
 import io
-import base64
 import os
-from typing import Tuple, List, Optional, Dict
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Tuple, List, Optional, Dict, Any, AsyncIterator
+
+from config.keys import (
+    SANDBOX_POOL_SIZE, SANDBOX_MAX_RUNS_PER_CONTAINER, SANDBOX_MEM_LIMIT,
+    SANDBOX_CPUS, SANDBOX_CHECKOUT_TIMEOUT, SANDBOX_EXEC_TIMEOUT, SANDBOX_MAX_OUTPUT_BYTES,
+    SANDBOX_KERNEL_ENABLED, SANDBOX_KERNEL_PRELOAD, SANDBOX_RESULT_CACHE_ENABLED,
+    SANDBOX_MAX_ARTIFACT_BYTES, SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES, SANDBOX_MAX_ARTIFACTS,
+    SANDBOX_BACKEND, SANDBOX_IMAGE, SANDBOX_PACKAGES
+)
+from tools import sandbox_kernel, sandbox_artifacts, sandbox_image, sandbox_profile
+from tools.sandbox_backend import SandboxBackend, _OutputBuffer, TIMEOUT_EXIT_CODE
+from tools.local_sandbox import LocalSandbox
+from tools.preflight import preflight_check
 
 logger = logging.getLogger("Tools-Sandbox")
 
-class DockerSandbox:
+# 每次执行在容器内独占的临时目录根路径: /tmp/runs/<run_id>/
+RUNS_ROOT = "/tmp/runs"
+# 统计容器内进程数 (清理临时目录后执行)，用于发现脚本遗留的后台进程
+_CLEANUP_CMD = "rm -rf {run_dir} && ls -d /proc/[0-9]* | wc -l"
+_PROC_COUNT_CMD = "ls -d /proc/[0-9]* | wc -l"
+# 容器内 timeout 发出 TERM 后，再等待多久发送 KILL；宿主侧兜底超时也额外等待这么久
+KILL_GRACE_SECONDS = 5.0
+
+@dataclass
+class PooledContainer:
+    """池中的一个沙箱容器"""
+    slot: int
+    name: str
+    container: Any
+    runs: int = 0
+    # 空闲时容器内的进程数基线；执行后超出基线说明有残留进程
+    baseline_procs: int = 0
+    # [Persistent Kernel] 已安装 kernel 脚本；当前 kernel 归属的会话 (None 表示没有 kernel)
+    kernel_installed: bool = False
+    kernel_session: Optional[str] = None
+
+class DockerSandbox(SandboxBackend):
     """
     [Speculative Warming Enhanced]
     安全执行 Python 代码的沙箱环境。支持容器预热。
     已修复: 移除 Shell 注入风险，支持真实图片提取。
+    [Container Pool] 维护 N 个预热容器 (swarm_sandbox_runner_<i>)，每次执行借出一个独占使用：
+    - 每次执行使用独立的临时目录，并发执行互不覆盖脚本与图片
+    - 借出前做健康检查；执行 K 次后或发现残留状态 (污染) 时回收重建
+    [Persistent Kernel] 开启 kernel 模式后，带 session_id 的执行优先借出该会话上次使用的容器，
+    在其中常驻的解释器里运行 (见 tools/sandbox_kernel.py)，省去每轮迭代的进程启动与 import 开销。
     """
-    def __init__(self, image: str = "python:3.9-slim"):
+    backend_name = "docker"
+
+    def __init__(
+        self,
+        image: Optional[str] = None,
+        pool_size: int = SANDBOX_POOL_SIZE,
+        max_runs_per_container: int = SANDBOX_MAX_RUNS_PER_CONTAINER,
+        mem_limit: str = SANDBOX_MEM_LIMIT,
+        cpus: float = SANDBOX_CPUS,
+        checkout_timeout: float = SANDBOX_CHECKOUT_TIMEOUT,
+        exec_timeout: float = SANDBOX_EXEC_TIMEOUT,
+        max_output_bytes: int = SANDBOX_MAX_OUTPUT_BYTES,
+        kernel_enabled: bool = SANDBOX_KERNEL_ENABLED,
+        kernel_preload: Optional[List[str]] = None,
+        result_cache: bool = SANDBOX_RESULT_CACHE_ENABLED,
+        max_artifact_bytes: int = SANDBOX_MAX_ARTIFACT_BYTES,
+        max_artifacts_total_bytes: int = SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES,
+        max_artifacts: int = SANDBOX_MAX_ARTIFACTS
+    ):
+        if docker is None:
+            raise RuntimeError("docker SDK is not installed. Use SANDBOX_BACKEND=local instead.")
+        super().__init__(
+            exec_timeout=exec_timeout,
+            max_output_bytes=max_output_bytes,
+            result_cache=result_cache,
+            max_artifact_bytes=max_artifact_bytes,
+            max_artifacts_total_bytes=max_artifacts_total_bytes,
+            max_artifacts=max_artifacts
+        )
         self.client = docker.from_env()
-        self.image = image
+        # [Sandbox Image] 未显式指定镜像时由 prepare_image() 确定托管镜像 (构建可能耗时数分钟，不在构造函数中进行)
+        self._explicit_image = image or SANDBOX_IMAGE or None
+        self.image: Optional[str] = self._explicit_image
+        self._image_lock = threading.Lock()
         self.container_name = "swarm_sandbox_runner"
-        self.container = None
+        self.pool_size = max(1, pool_size)
+        self.max_runs_per_container = max(1, max_runs_per_container)
+        self.mem_limit = mem_limit
+        self.nano_cpus = int(cpus * 1e9)
+        self.checkout_timeout = checkout_timeout
+        self.kernel_enabled = kernel_enabled
+        self.kernel_preload = SANDBOX_KERNEL_PRELOAD if kernel_preload is None else kernel_preload
+
+        self._idle: List[PooledContainer] = []
+        # 尚未创建容器的槽位 (懒创建，warm_up 时一次性填满)
+        self._free_slots: List[int] = list(range(self.pool_size))
+        self._lock = threading.RLock()
+        self._idle_cond = threading.Condition(self._lock)
         self._is_warming = False
+        # 专用线程池：Docker SDK 全部是阻塞调用，长时间运行的脚本不能占满默认 executor
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size * 2 + 2, thread_name_prefix="sandbox")
+        self._stats = {
+            "runs": 0, "created": 0, "recycled": 0, "contaminated": 0, "unhealthy": 0,
+            "checkout_waits": 0, "timeouts": 0, "cancelled": 0, "kernel_runs": 0, "kernel_affinity_hits": 0
+        }
+
+    def prepare_image(self) -> str:
+        """
+        [Sandbox Image] 确定容器使用的镜像：未显式指定时使用按 SANDBOX_PACKAGES 构建的托管镜像 (不存在则构建)。
+        阻塞调用，可能耗时数分钟；create_sandbox 在确认 Docker 可达后调用，异步代码须经线程池进入。
+        """
+        with self._image_lock:
+            if self.image is None:
+                self.image = sandbox_image.ensure_image(self.client)
+            return self.image
 
     def warm_up(self):
         """
-        [New] 预热容器
-        在任务正式开始前调用，确保容器处于 Running 状态，减少首次执行延迟。
+        [New] 预热容器池
+        在任务正式开始前调用，确保所有槽位的容器处于 Running 状态，减少首次执行延迟。
         """
         if self._is_warming:
             logger.info("🔥 Sandbox is already warming up...")
             return
 
-        logger.info("🔥 [Speculative] Pre-warming sandbox container...")
+        logger.info(f"🔥 [Speculative] Pre-warming sandbox pool ({self.pool_size} containers)...")
         self._is_warming = True
         try:
-            self._ensure_container()
-            logger.info("🔥 Sandbox warmed up and ready!")
+            while True:
+                slot = self._claim_slot()
+                if slot is None:
+                    break
+                try:
+                    self._checkin_idle(self._start_container(slot))
+                except Exception:
+                    self._release_slot(slot)
+                    raise
+            logger.info("🔥 Sandbox pool warmed up and ready!")
         except Exception as e:
             logger.error(f"Failed to warm up sandbox: {e}")
         finally:
             self._is_warming = False
 
-    def _ensure_container(self):
-        """确保容器正在运行且配置正确"""
+    def _claim_slot(self) -> Optional[int]:
+        with self._lock:
+            return self._free_slots.pop(0) if self._free_slots else None
+
+    def _release_slot(self, slot: int):
+        with self._lock:
+            self._free_slots.append(slot)
+
+    def _start_container(self, slot: int, fresh: bool = False) -> PooledContainer:
+        """
+        确保槽位对应的容器正在运行且配置正确。
+        fresh=True 时删除旧容器后重建 (用于回收)；否则复用同名容器 (例如进程重启后)。
+        """
+        name = f"{self.container_name}_{slot}"
+        container = None
+        self.prepare_image()
         try:
             # 1. 尝试获取现有容器
             try:
-                self.container = self.client.containers.get(self.container_name)
-                if self.container.status != "running":
-                    logger.info("Restarting stopped sandbox container...")
-                    self.container.start()
+                container = self.client.containers.get(name)
+                if fresh:
+                    container.remove(force=True)
+                    container = None
+                elif container.status != "running":
+                    logger.info(f"Restarting stopped sandbox container {name}...")
+                    container.start()
+                    self._warm_imports(container)
             except docker.errors.NotFound:
+                container = None
+
+            if container is None:
                 # 2. 如果不存在，创建新的
-                logger.info("Starting new sandbox container...")
-                self.container = self.client.containers.run(
+                logger.info(f"Starting new sandbox container {name}...")
+                container = self.client.containers.run(
                     self.image,
                     detach=True,
                     tty=True,
-                    name=self.container_name,
+                    name=name,
                     # 限制资源防止滥用
-                    mem_limit="512m",
-                    nano_cpus=500000000, # 0.5 CPU
+                    mem_limit=self.mem_limit,
+                    nano_cpus=self.nano_cpus,
                     network_mode="none" # 断网，确保安全 (如果需要联网安装库需调整)
                 )
-            
+                self._stats["created"] += 1
+                self._warm_imports(container)
+            else:
+                # 复用的容器可能残留上一进程的执行目录
+                container.exec_run(["rm", "-rf", RUNS_ROOT])
+
         except Exception as e:
-            logger.error(f"Sandbox container error: {e}")
+            logger.error(f"Sandbox container error ({name}): {e}")
             raise e
 
-    def run_code(self, code: str) -> Tuple[str, str, List[Dict[str, str]]]:
+        if self._available_modules is None:
+            self._discover_modules(container)
+        pc = PooledContainer(slot=slot, name=name, container=container)
+        pc.baseline_procs = self._count_processes(pc)
+        return pc
+
+    def _warm_imports(self, container):
         """
-        执行代码并返回 (stdout, stderr, image_artifacts)
+        [Sandbox Image] 页缓存预热：容器启动后用一次性解释器 import 常用库，把库文件读入页缓存。
+        之后每次执行仍启动新的解释器并完整执行 import，省下的只是首次执行的磁盘读取；
+        要真正跳过 import 需开启 kernel 模式 (常驻解释器按 SANDBOX_KERNEL_PRELOAD 预加载)。
         """
-        self._ensure_container()
-        
+        if not SANDBOX_PACKAGES:
+            return
+        started = time.monotonic()
+        try:
+            container.exec_run(sandbox_image.warm_import_command(SANDBOX_PACKAGES))
+            logger.info(f"🔥 Warmed page cache for imports in {container.name} ({time.monotonic() - started:.1f}s).")
+        except Exception as e:
+            logger.warning(f"Failed to warm page cache in {container.name}: {e}")
+
+    def _discover_modules(self, container):
+        """[Pre-flight] 记录镜像中可导入的模块 (每个进程只需探测一次)"""
+        try:
+            result = container.exec_run(["python", "-c", sandbox_image.LIST_MODULES_SCRIPT])
+            if result.exit_code == 0:
+                self._available_modules = sandbox_image.parse_module_list(result.output)
+                self._python_version = sandbox_image.parse_python_version(result.output)
+        except Exception as e:
+            logger.warning(f"Failed to list sandbox modules in {container.name}: {e}")
+
+    def python_version(self) -> Optional[Tuple[int, int]]:
+        """容器尚未探测时，托管镜像 (及构建失败时的回退) 的版本即基础镜像的版本"""
+        if self._python_version is None and self._explicit_image is None:
+            return sandbox_image.base_python_version()
+        return self._python_version
+
+    def _count_processes(self, pc: PooledContainer, command: str = _PROC_COUNT_CMD) -> int:
+        result = pc.container.exec_run(["sh", "-c", command])
+        if result.exit_code != 0:
+            raise RuntimeError(result.output.decode("utf-8", errors="replace").strip())
+        return int(result.output.decode().strip() or 0)
+
+    def _is_healthy(self, pc: PooledContainer) -> bool:
+        try:
+            pc.container.reload()
+            return pc.container.status == "running"
+        except Exception:
+            return False
+
+    def _recycle(self, pc: PooledContainer) -> Optional[PooledContainer]:
+        """删除并重建容器；重建失败时归还槽位，下次借出时再尝试创建"""
+        self._stats["recycled"] += 1
+        logger.info(f"♻️ Recycling sandbox container {pc.name} after {pc.runs} run(s)")
+        try:
+            return self._start_container(pc.slot, fresh=True)
+        except Exception:
+            self._release_slot(pc.slot)
+            return None
+
+    def _checkout(self, session_id: Optional[str] = None) -> PooledContainer:
+        """
+        借出一个健康的容器；所有容器都忙时阻塞等待，超时抛出 TimeoutError。
+        session_id 不为空时优先借出该会话 kernel 所在的容器 (会话亲和)。
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            pc = None
+            slot = None
+            with self._idle_cond:
+                while True:
+                    pc = self._take_idle(session_id, steal=False)
+                    if pc is not None:
+                        break
+                    # 宁可新建容器，也不抢占其他会话的 kernel
+                    slot = self._claim_slot()
+                    if slot is not None:
+                        break
+                    pc = self._take_idle(session_id, steal=True)
+                    if pc is not None:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No sandbox container available within {self.checkout_timeout:.0f}s")
+                    self._stats["checkout_waits"] += 1
+                    self._idle_cond.wait(remaining)
+
+            if pc is None:
+                try:
+                    pc = self._start_container(slot)
+                except Exception:
+                    self._release_slot(slot)
+                    raise
+
+            if self._is_healthy(pc):
+                return pc
+            self._stats["unhealthy"] += 1
+            logger.warning(f"Sandbox container {pc.name} unhealthy. Recycling...")
+            pc = self._recycle(pc)
+            if pc is not None:
+                return pc
+
+    def _take_idle(self, session_id: Optional[str], steal: bool = True) -> Optional[PooledContainer]:
+        """
+        从空闲列表取出容器：同会话的 kernel 容器 > 没有 kernel 的容器 > (steal=True 时) 任意容器。
+        调用方需持有锁。
+        """
+        if not self._idle:
+            return None
+        choice = None
+        if session_id is not None:
+            choice = next((pc for pc in self._idle if pc.kernel_session == session_id), None)
+            if choice is not None:
+                self._stats["kernel_affinity_hits"] += 1
+        if choice is None:
+            choice = next((pc for pc in self._idle if pc.kernel_session is None), None)
+        if choice is None and steal:
+            choice = self._idle[0]
+        if choice is not None:
+            self._idle.remove(choice)
+        return choice
+
+    def _checkin_idle(self, pc: PooledContainer):
+        with self._idle_cond:
+            self._idle.append(pc)
+            self._idle_cond.notify()
+
+    def _checkin(self, pc: PooledContainer, contaminated: bool = False):
+        """归还容器：达到执行次数上限或被污染时先回收重建"""
+        pc.runs += 1
+        if contaminated:
+            self._stats["contaminated"] += 1
+        if contaminated or pc.runs >= self.max_runs_per_container:
+            pc = self._recycle(pc)
+            if pc is None:
+                with self._idle_cond:
+                    # 槽位已归还，唤醒等待者去重建容器
+                    self._idle_cond.notify()
+                return
+        self._checkin_idle(pc)
+
+    def _cleanup_run(self, pc: PooledContainer, run_dir: str) -> Tuple[bool, str]:
+        """
+        删除本次执行的临时目录，并检查是否有残留进程。
+        删除前在同一次 exec 中读取资源画像 (.usage.json 与 cgroup 计数器)。
+        返回 (是否干净, 画像原始输出)；False 表示容器已被污染。
+        """
+        command = f"{sandbox_profile.probe_command(run_dir)}; {_CLEANUP_CMD.format(run_dir=run_dir)}"
+        try:
+            result = pc.container.exec_run(["sh", "-c", command])
+            output = result.output.decode("utf-8", errors="replace").strip()
+            if result.exit_code != 0:
+                raise RuntimeError(output)
+            lines = output.splitlines()
+            procs = int(lines[-1]) if lines else 0
+            probe = "\n".join(lines[:-1])
+        except Exception as e:
+            logger.warning(f"Sandbox cleanup failed on {pc.name}: {e}")
+            return False, ""
+        # 常驻 kernel 本身占用一个进程
+        allowed = pc.baseline_procs + (1 if pc.kernel_session is not None else 0)
+        if procs > allowed:
+            logger.warning(f"Sandbox {pc.name} has {procs - allowed} leftover process(es).")
+            return False, probe
+        return True, probe
+
+    def get_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 容器池容量与回收统计"""
+        with self._lock:
+            created_slots = self.pool_size - len(self._free_slots)
+        return {
+            "backend": self.backend_name,
+            "result_cache": self.result_cache.get_stats() if self.result_cache else {"enabled": False},
+            "pool_size": self.pool_size,
+            "containers": created_slots,
+            "idle": len(self._idle),
+            "kernel_enabled": self.kernel_enabled,
+            "kernels": sum(1 for pc in self._idle if pc.kernel_session is not None),
+            **self._stats
+        }
+
+    def _cache_limits(self, timeout: float) -> Dict[str, Any]:
+        return {"mem_limit": self.mem_limit, "nano_cpus": self.nano_cpus, "timeout": timeout}
+
+    async def _execute(
+        self,
+        code: str,
+        timeout: float,
+        session_id: Optional[str],
+        keep_state: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        [Streaming] 在借出的容器中执行，所有阻塞的 Docker 调用都在专用线程池中进行。
+        - stdout / stderr 分离 (demux)，超时杀死容器内的整个进程组
+        - 调用方取消或提前停止迭代时同样杀死进程，并在后台清理、归还容器
+        - kernel 模式开启且提供 session_id 时，在该会话的常驻 kernel 中执行；
+          默认每次使用全新的命名空间 (只复用已加载的模块)，keep_state=True 时保留上一次的变量
+        """
+        use_kernel = self.kernel_enabled and session_id is not None
+        loop = asyncio.get_running_loop()
+        try:
+            pc = await loop.run_in_executor(self._executor, self._checkout, session_id if use_kernel else None)
+        except Exception as e:
+            logger.error(f"Failed to acquire sandbox container: {e}")
+            yield {"type": "result", "result": self._error_result(f"System Error: Sandbox unavailable ({str(e)})")}
+            return
+
+        run_id = uuid.uuid4().hex
+        run_dir = f"{RUNS_ROOT}/{run_id}"
+        self._stats["runs"] += 1
+        released = False
+        exec_future: Optional[asyncio.Future] = None
+        try:
+            try:
+                cgroup_before = await loop.run_in_executor(
+                    self._executor, self._prepare_run, pc, run_dir, code, session_id if use_kernel else None
+                )
+            except Exception as e:
+                logger.error(f"Failed to write code to sandbox: {e}")
+                released = True
+                await loop.run_in_executor(self._executor, self._finish_run, pc, run_dir, True)
+                yield {"type": "result", "result": self._error_result(f"System Error: Failed to write code ({str(e)})")}
+                return
+
+            # 3. 执行代码：执行线程通过 call_soon_threadsafe 把输出块送回事件循环
+            logger.info(f"Running code in sandbox {pc.name} (run {run_id[:8]})...")
+            chunks: asyncio.Queue = asyncio.Queue()
+
+            def on_chunk(stream: Optional[str], data: Optional[bytes]):
+                loop.call_soon_threadsafe(chunks.put_nowait, (stream, data))
+
+            started = time.monotonic()
+            runner = sandbox_kernel.client_command(self.kernel_preload, keep_state) if use_kernel else None
+            if use_kernel:
+                self._stats["kernel_runs"] += 1
+            exec_future = loop.run_in_executor(self._executor, self._exec_script, pc, run_dir, timeout, on_chunk, runner)
+            # 容器内的 timeout 是第一道防线；宿主侧多等 KILL_GRACE 秒作为兜底
+            deadline = started + timeout + KILL_GRACE_SECONDS
+            timed_out = False
+            contaminated = False
+            buffers = {"stdout": _OutputBuffer(self.max_output_bytes), "stderr": _OutputBuffer(self.max_output_bytes)}
+
+            while True:
+                try:
+                    stream, data = await asyncio.wait_for(chunks.get(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    if timed_out:
+                        # 已发送 kill 仍未退出：放弃等待，容器按污染回收
+                        contaminated = True
+                        break
+                    timed_out = True
+                    await loop.run_in_executor(self._executor, self._kill_run, pc, run_dir, use_kernel)
+                    deadline = time.monotonic() + KILL_GRACE_SECONDS
+                    continue
+                if stream is None:
+                    break
+                text = buffers[stream].append(data)
+                if text:
+                    yield {"type": stream, "data": text, "run_id": run_id}
+
+            exit_code = TIMEOUT_EXIT_CODE
+            if not contaminated:
+                try:
+                    exit_code = await exec_future
+                except Exception as e:
+                    logger.error(f"Sandbox execution error on {pc.name}: {e}")
+                    released = True
+                    await loop.run_in_executor(self._executor, self._finish_run, pc, run_dir, True)
+                    yield {"type": "result", "result": self._error_result(f"System Error: {str(e)}")}
+                    return
+
+            duration = time.monotonic() - started
+            # GNU timeout 超时退出码为 124 (TERM) / 137 (KILL)；OOM killer 同样以 KILL 结束进程，稍后依据 cgroup 区分
+            killed = timed_out or exit_code in (TIMEOUT_EXIT_CODE, 128 + 9)
+            if killed and pc.kernel_session is not None:
+                # 容器内 timeout 只能杀死 client，kernel 仍在执行失控的 cell，必须一并终止
+                await loop.run_in_executor(self._executor, self._kill_kernel, pc)
+
+            released = True
+            artifacts, probe = await loop.run_in_executor(self._executor, self._finish_run, pc, run_dir, contaminated)
+            usage, cgroup_after = sandbox_profile.parse_probe(probe)
+            profile = sandbox_profile.build_profile(run_id, duration, usage, cgroup_before, cgroup_after)
+            oom_killed = profile["oom_killed"] and not timed_out
+            timed_out = killed and not oom_killed
+
+            stdout = buffers["stdout"].getvalue()
+            stderr = buffers["stderr"].getvalue()
+            if timed_out:
+                self._stats["timeouts"] += 1
+                logger.warning(f"⏱️ Sandbox run {run_id[:8]} timed out after {duration:.1f}s. Process killed.")
+                stderr = (stderr + f"\n[SYSTEM] Execution timed out after {timeout:.0f}s and was killed.").lstrip()
+            elif oom_killed and exit_code == 128 + 9:
+                logger.warning(f"💥 Sandbox run {run_id[:8]} was OOM-killed (mem_limit={self.mem_limit}).")
+                stderr = (stderr + f"\n[SYSTEM] Execution was killed: out of memory (limit {self.mem_limit}).").lstrip()
+
+            result = self._build_result(
+                stdout, stderr, artifacts, exit_code, timed_out, duration,
+                buffers["stdout"].truncated or buffers["stderr"].truncated, profile
+            )
+            yield {"type": "result", "result": result, "cacheable": not contaminated}
+        finally:
+            if not released:
+                # 被取消 / 迭代被提前关闭：后台终止进程并归还容器，不阻塞取消流程
+                self._spawn_background(self._abort_run(pc, run_dir, exec_future, use_kernel))
+
+    def _prepare_run(self, pc: PooledContainer, run_dir: str, code: str, session_id: Optional[str] = None) -> Dict[str, int]:
+        """写入脚本 (必要时安装 kernel)，返回执行前的 cgroup 计数器快照"""
         # 1. 代码预处理与封装 (注入 matplotlib Agg 后端)
         wrapped_code = self._wrap_code_with_plot_saving(code)
-        
         # 2. [Secure Fix] 使用 put_archive 安全写入代码文件
         # 废弃: setup_cmd = f"cat <<EOF > /tmp/script.py..." (Vulnerable)
+        # 脚本写入 outputs/ 的文件会作为产出物返回；同一次 exec 中读取 cgroup 计数器
+        setup = pc.container.exec_run(
+            ["sh", "-c", f"mkdir -p {run_dir}/{sandbox_artifacts.OUTPUT_DIR} && {sandbox_profile.CGROUP_STATS_CMD}"]
+        )
+        _, cgroup_before = sandbox_profile.parse_probe(setup.output.decode("utf-8", errors="replace"))
+        self._write_file_to_container(pc.container, run_dir, "script.py", wrapped_code)
+
+        if session_id is not None:
+            if not pc.kernel_installed:
+                pc.container.exec_run(["mkdir", "-p", sandbox_kernel.KERNEL_DIR])
+                for filename, source in sandbox_kernel.kernel_files().items():
+                    self._write_file_to_container(pc.container, sandbox_kernel.KERNEL_DIR, filename, source)
+                pc.kernel_installed = True
+            if pc.kernel_session not in (None, session_id):
+                # 容器上是其他会话的 kernel：终止它，由 client 为当前会话重新拉起
+                self._kill_kernel(pc)
+            pc.kernel_session = session_id
+        return cgroup_before
+
+    def _exec_script(self, pc: PooledContainer, run_dir: str, timeout: float, on_chunk, runner: Optional[str] = None) -> int:
+        """
+        在容器内执行脚本 (阻塞)，逐块回调 on_chunk(stream, data)，结束时回调 on_chunk(None, None)。
+        sh 先把自己的 PID 写入 pid 文件再 exec 成 timeout；GNU timeout 会成为新进程组的组长，
+        因此 kill -9 -<pid> 可以一次杀死脚本及其所有子进程。
+        使用底层 API (exec_create / exec_start(stream, demux) / exec_inspect)，
+        因为 exec_run(stream=True) 拿不到退出码。
+        默认通过资源画像启动器运行脚本 (见 tools/sandbox_profile.py)；
+        runner 为替代它的执行命令 (kernel 模式下为 kernel client)。
+        """
+        # 注意: 如果需要捕获 print 输出，确保 python 脚本中有 flush 或使用 -u 参数
+        command = (
+            f"echo $$ > {run_dir}/pid; "
+            f"exec timeout -k {int(KILL_GRACE_SECONDS)} {int(max(1, timeout))} {runner or sandbox_profile.launcher_command()}"
+        )
+        api = self.client.api
+        try:
+            exec_id = api.exec_create(pc.container.id, ["sh", "-c", command], workdir=run_dir)["Id"]
+            for stdout, stderr in api.exec_start(exec_id, stream=True, demux=True):
+                if stdout:
+                    on_chunk("stdout", stdout)
+                if stderr:
+                    on_chunk("stderr", stderr)
+            exit_code = api.exec_inspect(exec_id).get("ExitCode")
+            return -1 if exit_code is None else exit_code
+        finally:
+            on_chunk(None, None)
+
+    def _kill_run(self, pc: PooledContainer, run_dir: str, kill_kernel: bool = False):
+        """通过 pid 文件杀死本次执行的整个进程组 (kernel 模式下连同 kernel 一起终止)"""
         try:
-            self._write_file_to_container("/tmp", "script.py", wrapped_code)
+            pc.container.exec_run(["sh", "-c", f"kill -9 -$(cat {run_dir}/pid) 2>/dev/null; true"])
         except Exception as e:
-            logger.error(f"Failed to write code to sandbox: {e}")
-            return "", f"System Error: Failed to write code ({str(e)})", []
-        
-        # 3. 执行代码
-        logger.info("Running code in sandbox...")
-        # 注意: 如果需要捕获 print 输出，确保 python 脚本中有 flush 或使用 -u 参数
-        exec_result = self.container.exec_run("python -u /tmp/script.py")
-        
-        stdout = exec_result.output.decode("utf-8", errors="replace")
-        stderr = ""
-        if exec_result.exit_code != 0:
-            # 简单处理: 如果失败，通常 stdout 包含错误堆栈
-            stderr = stdout 
-            stdout = ""
-
-        # 4. [Real Feature] 尝试提取生成的图片
-        images = self._extract_image_from_container("/tmp/plot.png")
-        if images:
-            logger.info(f"📸 Retrieved {len(images)} image(s) from sandbox.")
-        
-        return stdout, stderr, images
+            logger.warning(f"Failed to kill sandbox run in {pc.name}: {e}")
+        if kill_kernel:
+            self._kill_kernel(pc)
+
+    def _kill_kernel(self, pc: PooledContainer):
+        try:
+            pc.container.exec_run(["sh", "-c", sandbox_kernel.kill_command()])
+        except Exception as e:
+            logger.warning(f"Failed to kill sandbox kernel in {pc.name}: {e}")
+        pc.kernel_session = None
+
+    def _finish_run(
+        self,
+        pc: PooledContainer,
+        run_dir: str,
+        contaminated: bool = False
+    ) -> Tuple[List[Dict[str, Any]], str]:
+        """提取产出物、清理临时目录并归还容器；返回 (产出物, 资源画像原始输出)"""
+        artifacts: List[Dict[str, Any]] = []
+        probe = ""
+        try:
+            if not contaminated:
+                # 4. [Real Feature] 提取生成的图片与文件
+                artifacts = self._extract_artifacts(pc, run_dir)
+                if artifacts:
+                    logger.info(f"📸 Retrieved {len(artifacts)} artifact(s) from sandbox.")
+        finally:
+            clean, probe = self._cleanup_run(pc, run_dir)
+            if not clean:
+                contaminated = True
+            self._checkin(pc, contaminated)
+        return artifacts, probe
+
+    async def _abort_run(
+        self,
+        pc: PooledContainer,
+        run_dir: str,
+        exec_future: Optional[asyncio.Future],
+        kill_kernel: bool = False
+    ):
+        """取消后的收尾：杀死进程，等待执行线程退出，然后清理并归还容器"""
+        loop = asyncio.get_running_loop()
+        contaminated = False
+        try:
+            await loop.run_in_executor(self._executor, self._kill_run, pc, run_dir, kill_kernel)
+            if exec_future is not None:
+                try:
+                    await asyncio.wait_for(exec_future, KILL_GRACE_SECONDS)
+                except Exception:
+                    contaminated = True
+        finally:
+            await loop.run_in_executor(self._executor, self._finish_run, pc, run_dir, contaminated)
+        self._stats["cancelled"] += 1
+        logger.info(f"🛑 Sandbox run in {pc.name} cancelled and cleaned up.")
 
-    def _write_file_to_container(self, dest_dir: str, filename: str, content: str):
+    def _write_file_to_container(self, container, dest_dir: str, filename: str, content: str):
         """
         将字符串内容以文件的形式写入容器指定目录 (安全原子操作)
         """
@@ -119,59 +640,94 @@ class DockerSandbox:
         
         tar_stream.seek(0)
         # 上传 tar 包，Docker 会自动解压到 dest_dir
-        self.container.put_archive(path=dest_dir, data=tar_stream)
+        container.put_archive(path=dest_dir, data=tar_stream)
 
-    def _extract_image_from_container(self, filepath: str) -> List[Dict[str, str]]:
+    def _extract_artifacts(self, pc: PooledContainer, run_dir: str) -> List[Dict[str, Any]]:
         """
-        从容器中提取指定文件并转换为 Base64 (用于前端展示)
+        [Artifacts] 一次 get_archive 取回整个产出物目录，按 tar 流增量解析
+        (受单文件大小、总大小与文件数限制，文件名带 run_id 前缀)
         """
-        images = []
         try:
-            # get_archive 返回 (stream, stat)
-            stream, stat = self.container.get_archive(filepath)
-            
-            # 将 stream 读入内存
-            file_obj = io.BytesIO()
-            for chunk in stream:
-                file_obj.write(chunk)
-            file_obj.seek(0)
-            
-            # 解压 tar 流
-            with tarfile.open(fileobj=file_obj, mode='r') as tar:
-                # 获取文件名 (通常是 basename)
-                member_name = os.path.basename(filepath)
-                # 能够容错：有时 tar 内的文件名可能带路径，遍历寻找
-                target_member = None
-                for m in tar.getmembers():
-                    if m.name.endswith(member_name):
-                        target_member = m
-                        break
-                
-                if target_member:
-                    img_data = tar.extractfile(target_member).read()
-                    b64_img = base64.b64encode(img_data).decode('utf-8')
-                    
-                    images.append({
-                        "type": "image", 
-                        "filename": member_name,
-                        # 前端可直接使用的 Data URI
-                        "data": f"data:image/png;base64,{b64_img}" 
-                    })
-                    
+            stream, _ = pc.container.get_archive(f"{run_dir}/{sandbox_artifacts.OUTPUT_DIR}")
+            artifacts, _ = sandbox_artifacts.extract_artifacts(
+                stream,
+                prefix=os.path.basename(run_dir)[:8],
+                max_file_bytes=self.max_artifact_bytes,
+                max_total_bytes=self.max_artifacts_total_bytes,
+                max_files=self.max_artifacts
+            )
+            return artifacts
         except docker.errors.NotFound:
-            # 文件不存在，说明代码没有生成图片，正常情况
-            pass
+            # 目录不存在 (例如 kill 之后)，说明没有产出物
+            return []
         except Exception as e:
-            logger.warning(f"Failed to extract image artifact: {e}")
-            
-        return images
-
-    def _wrap_code_with_plot_saving(self, code: str) -> str:
-        """注入 matplotlib 保存逻辑 (简化版)"""
-        if "matplotlib" in code or "plt." in code:
-            # 强制非交互式后端，防止报错
-            header = "import matplotlib\nmatplotlib.use('Agg')\nimport matplotlib.pyplot as plt\n"
-            # 捕获可能的绘图并保存
-            footer = "\ntry:\n    if plt.get_fignums():\n        plt.savefig('/tmp/plot.png')\n        print('[SYSTEM] Plot saved to /tmp/plot.png')\nexcept Exception as e:\n    print(f'[SYSTEM] Plot save failed: {e}')"
-            return header + code + footer
-        return code
+            logger.warning(f"Failed to extract sandbox artifacts: {e}")
+            return []
+
+def create_sandbox(backend: str = SANDBOX_BACKEND) -> SandboxBackend:
+    """
+    [Sandbox Backend] 按配置创建执行后端: docker / local / auto。
+    auto 优先使用 Docker，SDK 未安装或 Docker daemon 不可达时回退到本地子进程后端。
+    阻塞调用 (可能包含镜像构建)，异步代码请使用 aget_default_sandbox。
+    """
+    if backend == "local":
+        return LocalSandbox()
+    if backend == "docker":
+        sandbox = DockerSandbox()
+        sandbox.prepare_image()
+        return sandbox
+    try:
+        sandbox = DockerSandbox()
+        # 先确认 daemon 可达再准备镜像，Docker 不可用的主机不必为构建尝试付出代价
+        sandbox.client.ping()
+        sandbox.prepare_image()
+        return sandbox
+    except Exception as e:
+        logger.warning(f"Docker unavailable ({e}). Falling back to local sandbox backend.")
+        return LocalSandbox()
+
+# 进程级共享的沙箱后端，首次使用时创建
+_default_sandbox: Optional[SandboxBackend] = None
+_default_sandbox_lock = threading.Lock()
+
+def get_default_sandbox() -> SandboxBackend:
+    """阻塞调用：首次使用时创建共享后端 (可能等待启动预热线程中的镜像构建)"""
+    global _default_sandbox
+    with _default_sandbox_lock:
+        if _default_sandbox is None:
+            _default_sandbox = create_sandbox()
+        return _default_sandbox
+
+async def aget_default_sandbox() -> SandboxBackend:
+    """事件循环中获取共享后端：创建与等锁都在线程池中进行，事件循环不会被镜像构建卡住"""
+    if _default_sandbox is not None:
+        return _default_sandbox
+    return await asyncio.get_running_loop().run_in_executor(None, get_default_sandbox)
+
+def preflight_code(code: str) -> List[Dict[str, Any]]:
+    """[Pre-flight] 针对共享沙箱的执行前静态检查；沙箱尚未创建时跳过导入检查，按基础镜像的版本检查语法"""
+    sandbox = _default_sandbox
+    if sandbox is not None:
+        return sandbox.preflight(code)
+    version = sandbox_image.base_python_version() if SANDBOX_BACKEND != "local" else None
+    return preflight_check(code, None, SandboxBackend.injected_names(code), version)
+
+def prewarm_default_sandbox():
+    """[Startup] 准备镜像 (必要时构建) 并预热容器池；阻塞调用，应在后台线程中执行"""
+    try:
+        get_default_sandbox().warm_up()
+    except Exception as e:
+        logger.error(f"Sandbox prewarm failed: {e}")
+
+async def run_python_code(
+    code: str,
+    timeout: Optional[float] = None,
+    session_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    在共享沙箱后端中执行代码 (Async)，输出以 sandbox_output 事件实时推送。
+    session_id: 编码会话标识，kernel 模式下同一会话复用常驻解释器。
+    返回 {"stdout", "stderr", "images", "files", "returncode", "timed_out", "duration", "truncated", "cached", "profile"}
+    """
+    sandbox = await aget_default_sandbox()
+    return await sandbox.run_code(code, timeout=timeout, session_id=session_id)
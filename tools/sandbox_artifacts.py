@@ -0,0 +1,154 @@
+"""
+[Artifacts] 沙箱产出物的提取
+代码运行结束后，run_dir/outputs 下的所有文件 (包括自动保存的每一张 matplotlib 图) 通过一次
+get_archive 以 tar 流的形式取回，边接收边解析，不在内存中拼接整个归档。
+"""
+import io
+import os
+import stat
+import base64
+import logging
+import mimetypes
+import tarfile
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger("Tools-Sandbox")
+
+# 产出物目录 (相对于 run_dir，也就是脚本的工作目录)
+OUTPUT_DIR = "outputs"
+
+# 文件头魔数 -> MIME，优先于扩展名判断
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+)
+
+def detect_mime(filename: str, data: bytes) -> str:
+    """按文件头魔数识别 MIME，无法识别时按扩展名猜测"""
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:512].lstrip().startswith(b"<svg") or (filename.endswith(".svg") and b"<svg" in data[:1024]):
+        return "image/svg+xml"
+    guessed, _ = mimetypes.guess_type(filename)
+    return guessed or "application/octet-stream"
+
+class _ChunkReader(io.RawIOBase):
+    """把 docker get_archive 返回的字节块迭代器包装成只读文件对象，供 tarfile 流式模式读取"""
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+def extract_artifacts(
+    chunks: Iterable[bytes],
+    prefix: str,
+    max_file_bytes: int,
+    max_total_bytes: int,
+    max_files: int
+) -> Tuple[List[Dict[str, object]], List[str]]:
+    """
+    增量解析产出物目录的 tar 流。
+    返回 (artifacts, skipped)：artifacts 为 {"type", "filename", "mime", "size", "data"} 列表
+    (type 为 image / file，data 为可直接给前端使用的 Data URI，filename 带 prefix 以区分不同运行)，
+    skipped 为因超出大小 / 数量限制而跳过的文件名。
+    """
+    artifacts: List[Dict[str, object]] = []
+    skipped: List[str] = []
+    total = 0
+    with tarfile.open(fileobj=io.BufferedReader(_ChunkReader(chunks)), mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            # 归档以目录名为根: outputs/figure_1.png -> figure_1.png
+            name = member.name.split("/", 1)[1] if "/" in member.name else member.name
+            if len(artifacts) >= max_files or member.size > max_file_bytes or total + member.size > max_total_bytes:
+                # 流式模式下不读取的成员数据会在迭代到下一个成员时被跳过
+                skipped.append(name)
+                continue
+            data = tar.extractfile(member).read()
+            total += len(data)
+            artifacts.append(_make_artifact(name, data, prefix))
+    if skipped:
+        logger.warning(f"Skipped {len(skipped)} sandbox artifact(s) over the size/count limits: {skipped}")
+    return artifacts, skipped
+
+def collect_artifacts(
+    output_dir: str,
+    prefix: str,
+    max_file_bytes: int,
+    max_total_bytes: int,
+    max_files: int
+) -> Tuple[List[Dict[str, object]], List[str]]:
+    """
+    从本机目录收集产出物 (本地后端使用)，返回值与限制同 extract_artifacts。
+    只读取普通文件，符号链接一律跳过，防止脚本借此读取宿主机上的文件。
+    """
+    artifacts: List[Dict[str, object]] = []
+    skipped: List[str] = []
+    total = 0
+    if not os.path.isdir(output_dir) or os.path.islink(output_dir):
+        return artifacts, skipped
+    for root, dirs, files in os.walk(output_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, output_dir)
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            if len(artifacts) >= max_files or st.st_size > max_file_bytes or total + st.st_size > max_total_bytes:
+                skipped.append(name)
+                continue
+            with open(path, "rb") as f:
+                data = f.read(max_file_bytes + 1)
+            total += len(data)
+            artifacts.append(_make_artifact(name, data, prefix))
+    if skipped:
+        logger.warning(f"Skipped {len(skipped)} sandbox artifact(s) over the size/count limits: {skipped}")
+    return artifacts, skipped
+
+def _make_artifact(name: str, data: bytes, prefix: str) -> Dict[str, object]:
+    mime = detect_mime(name, data)
+    return {
+        "type": "image" if mime.startswith("image/") else "file",
+        "filename": f"{prefix}_{name.replace('/', '_')}",
+        "mime": mime,
+        "size": len(data),
+        "data": f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+    }
+
+def figure_saving_footer(output_dir: str = OUTPUT_DIR) -> str:
+    """保存所有打开的 matplotlib 图 (而不只是当前图) 到产出物目录"""
+    return (
+        "\ntry:\n"
+        "    for _fig_num in plt.get_fignums():\n"
+        f"        plt.figure(_fig_num).savefig(f'{output_dir}/figure_{{_fig_num}}.png')\n"
+        "    if plt.get_fignums():\n"
+        f"        print(f'[SYSTEM] Saved {{len(plt.get_fignums())}} figure(s) to {output_dir}/')\n"
+        "except Exception as e:\n"
+        "    print(f'[SYSTEM] Plot save failed: {e}')"
+    )
+
+def split_artifacts(artifacts: List[Dict[str, object]]) -> Tuple[List[Dict[str, object]], List[Dict[str, object]]]:
+    """按类型拆分为 (images, files)"""
+    images = [a for a in artifacts if a["type"] == "image"]
+    files = [a for a in artifacts if a["type"] != "image"]
+    return images, files
@@ -0,0 +1,257 @@
+"""
+[Sandbox Backend] 代码执行后端的公共接口
+- DockerSandbox (tools/sandbox.py): 容器池，隔离最强
+- LocalSandbox (tools/local_sandbox.py): 本机子进程 + rlimits，无需 Docker，启动只需毫秒级
+两者产出相同的流式事件与结果结构，结果缓存、matplotlib 注入与事件推送在这里统一实现。
+"""
+import abc
+import codecs
+import asyncio
+import logging
+from typing import List, Optional, Dict, Any, AsyncIterator, Set, Tuple
+
+from config.keys import (
+    SANDBOX_EXEC_TIMEOUT, SANDBOX_MAX_OUTPUT_BYTES,
+    SANDBOX_RESULT_CACHE_ENABLED, SANDBOX_RESULT_CACHE_MAX_BYTES, SANDBOX_RESULT_CACHE_MAX_ENTRIES,
+    SANDBOX_MAX_ARTIFACT_BYTES, SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES, SANDBOX_MAX_ARTIFACTS
+)
+from tools import sandbox_artifacts
+from tools.sandbox_cache import ExecutionResultCache, is_deterministic, is_cacheable_result
+from tools.preflight import preflight_check
+from core.events import emit_event
+from core.telemetry import sandbox_metrics
+from core.logger_setup import node_id_ctx
+
+logger = logging.getLogger("Tools-Sandbox")
+
+# GNU timeout 的超时退出码；各后端统一用它表示被超时杀死
+TIMEOUT_EXIT_CODE = 124
+
+class _OutputBuffer:
+    """单个输出流的有界缓冲：按 UTF-8 增量解码，超过 max_bytes 后截断并丢弃后续输出"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.truncated = False
+        self._parts: List[str] = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def append(self, data: bytes) -> str:
+        """追加一块输出，返回本次应转发的文本 (截断后返回空串，仅首次返回截断提示)"""
+        if self.truncated:
+            return ""
+        remaining = self.max_bytes - self.size
+        if len(data) > remaining:
+            data = data[:remaining]
+            self.truncated = True
+        self.size += len(data)
+        text = self._decoder.decode(data, final=self.truncated)
+        if self.truncated:
+            text += f"\n[SYSTEM] Output truncated after {self.max_bytes} bytes.\n"
+        self._parts.append(text)
+        return text
+
+    def getvalue(self) -> str:
+        return "".join(self._parts) + ("" if self.truncated else self._decoder.decode(b"", final=True))
+
+class SandboxBackend(abc.ABC):
+    """
+    沙箱后端基类。子类实现 _execute (实际执行) 与 get_stats，
+    并通过 image 属性与 _cache_limits 标识自己的执行环境 (参与结果缓存键)。
+    """
+    backend_name = "base"
+    image = ""
+
+    def __init__(
+        self,
+        exec_timeout: float = SANDBOX_EXEC_TIMEOUT,
+        max_output_bytes: int = SANDBOX_MAX_OUTPUT_BYTES,
+        result_cache: bool = SANDBOX_RESULT_CACHE_ENABLED,
+        max_artifact_bytes: int = SANDBOX_MAX_ARTIFACT_BYTES,
+        max_artifacts_total_bytes: int = SANDBOX_MAX_ARTIFACTS_TOTAL_BYTES,
+        max_artifacts: int = SANDBOX_MAX_ARTIFACTS
+    ):
+        self.exec_timeout = exec_timeout
+        self.max_output_bytes = max_output_bytes
+        self.max_artifact_bytes = max_artifact_bytes
+        self.max_artifacts_total_bytes = max_artifacts_total_bytes
+        self.max_artifacts = max_artifacts
+        # [Result Cache] 相同的确定性代码直接返回上次结果，不再真正执行
+        self.result_cache: Optional[ExecutionResultCache] = None
+        if result_cache:
+            self.result_cache = ExecutionResultCache(SANDBOX_RESULT_CACHE_MAX_BYTES, SANDBOX_RESULT_CACHE_MAX_ENTRIES)
+        self._background: set = set()
+        # [Pre-flight] 执行环境中可导入的顶层模块与解释器版本 (由子类探测；None 表示未知)
+        self._available_modules: Optional[Set[str]] = None
+        self._python_version: Optional[Tuple[int, int]] = None
+
+    def warm_up(self):
+        """预热执行环境 (默认无需预热)"""
+
+    @abc.abstractmethod
+    def _execute(
+        self,
+        code: str,
+        timeout: float,
+        session_id: Optional[str],
+        keep_state: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        实际执行 (Async Iterator)，产出与 stream_code 相同的块；
+        最后的 result 块可附带 "cacheable": False 表示结果受环境异常影响，不应缓存。
+        """
+
+    @abc.abstractmethod
+    def _cache_limits(self, timeout: float) -> Dict[str, Any]:
+        """影响执行结果的资源限制 (参与结果缓存键)"""
+
+    @abc.abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 后端运行统计"""
+
+    def available_modules(self) -> Optional[Set[str]]:
+        return self._available_modules
+
+    def python_version(self) -> Optional[Tuple[int, int]]:
+        return self._python_version
+
+    def preflight(self, code: str) -> List[Dict[str, Any]]:
+        """[Pre-flight] 执行前静态检查，返回发现的问题 (见 tools/preflight.py)"""
+        return preflight_check(code, self.available_modules(), self.injected_names(code), self.python_version())
+
+    @staticmethod
+    def injected_names(code: str) -> Set[str]:
+        """沙箱在执行前自动注入到脚本中的名字"""
+        return {"matplotlib", "plt"} if SandboxBackend._needs_plot_wrapper(code) else set()
+
+    @staticmethod
+    def _needs_plot_wrapper(code: str) -> bool:
+        return "matplotlib" in code or "plt." in code or "seaborn" in code
+
+    async def run_code(
+        self,
+        code: str,
+        timeout: Optional[float] = None,
+        emit_output: bool = True,
+        session_id: Optional[str] = None,
+        keep_state: bool = False
+    ) -> Dict[str, Any]:
+        """
+        [Async] 执行代码并返回 {"stdout", "stderr", "images", "files", "returncode", "timed_out", "duration", "truncated", "cached", "profile"}。
+        emit_output=True 时，输出增量以 sandbox_output 事件实时推送到当前工作流的事件流。
+        session_id / keep_state 见 stream_code。
+        """
+        result = None
+        async for chunk in self.stream_code(code, timeout=timeout, session_id=session_id, keep_state=keep_state):
+            if chunk["type"] == "result":
+                result = chunk["result"]
+            elif emit_output:
+                emit_event("sandbox_output", {
+                    "run_id": chunk["run_id"],
+                    "stream": chunk["type"],
+                    "data": chunk["data"],
+                    "node_id": node_id_ctx.get()
+                })
+        if result and emit_output and result.get("profile"):
+            emit_event("sandbox_profile", {**result["profile"], "node_id": node_id_ctx.get()})
+        return result or self._error_result("System Error: Sandbox produced no result")
+
+    async def stream_code(
+        self,
+        code: str,
+        timeout: Optional[float] = None,
+        session_id: Optional[str] = None,
+        keep_state: bool = False
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        [Streaming] 流式执行代码 (Async Iterator)。
+        依次产出 {"type": "stdout" | "stderr", "data": str, "run_id": str}，
+        最后产出 {"type": "result", "result": {...}} (结构同 run_code 的返回值)。
+        - 每个流最多缓冲 max_output_bytes 字节；超过 timeout (墙钟) 时杀死进程，timed_out=True
+        - 调用方取消或提前停止迭代时同样杀死进程并在后台清理
+        - session_id / keep_state: 持久 kernel 的会话与是否保留变量 (后端支持时生效)
+        - 确定性代码命中结果缓存时直接回放缓存的输出，result["cached"]=True
+        """
+        timeout = timeout or self.exec_timeout
+
+        cache_key = self._result_cache_key(code, timeout, keep_state)
+        if cache_key is not None:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                logger.info("⚡ Sandbox result cache hit. Skipping execution.")
+                for stream in ("stdout", "stderr"):
+                    if cached[stream]:
+                        yield {"type": stream, "data": cached[stream], "run_id": "cached"}
+                yield {"type": "result", "result": {**cached, "cached": True, "duration": 0.0, "profile": None}}
+                return
+
+        async for chunk in self._execute(code, timeout, session_id, keep_state):
+            if chunk["type"] == "result":
+                result = chunk["result"]
+                if result.get("profile"):
+                    sandbox_metrics.record(result["profile"], result["timed_out"])
+                # 只缓存正常结束的运行；超时 / OOM / 环境异常是暂时性的，不能被回放
+                if cache_key is not None:
+                    if chunk.get("cacheable", True) and is_cacheable_result(result):
+                        self.result_cache.set(cache_key, dict(result))
+                    else:
+                        self.result_cache.record_uncacheable()
+                yield {"type": "result", "result": result}
+            else:
+                yield chunk
+
+    @staticmethod
+    def _error_result(message: str) -> Dict[str, Any]:
+        return {
+            "stdout": "", "stderr": message, "images": [], "files": [], "returncode": -1,
+            "timed_out": False, "duration": 0.0, "truncated": False, "cached": False, "profile": None
+        }
+
+    @staticmethod
+    def _build_result(
+        stdout: str,
+        stderr: str,
+        artifacts: List[Dict[str, Any]],
+        returncode: int,
+        timed_out: bool,
+        duration: float,
+        truncated: bool,
+        profile: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        images, files = sandbox_artifacts.split_artifacts(artifacts)
+        return {
+            "stdout": stdout,
+            "stderr": stderr,
+            "images": images,
+            "files": files,
+            "returncode": returncode,
+            "timed_out": timed_out,
+            "duration": round(duration, 3),
+            "truncated": truncated,
+            "cached": False,
+            "profile": profile
+        }
+
+    def _result_cache_key(self, code: str, timeout: float, keep_state: bool) -> Optional[str]:
+        """可缓存时返回缓存键；依赖 kernel 持久状态或含不确定因素的代码返回 None"""
+        if self.result_cache is None:
+            return None
+        if keep_state or not is_deterministic(code):
+            self.result_cache.record_uncacheable()
+            return None
+        wrapped_code = self._wrap_code_with_plot_saving(code)
+        return ExecutionResultCache.make_key(wrapped_code, self.image, self._cache_limits(timeout))
+
+    def _spawn_background(self, coro):
+        """保持后台任务的强引用，避免被 GC 提前回收"""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _wrap_code_with_plot_saving(self, code: str) -> str:
+        """注入 matplotlib 保存逻辑：所有打开的图都保存到产出物目录"""
+        if self._needs_plot_wrapper(code):
+            # 强制非交互式后端，防止报错
+            header = "import matplotlib\nmatplotlib.use('Agg')\nimport matplotlib.pyplot as plt\n"
+            return header + code + sandbox_artifacts.figure_saving_footer()
+        return code
@@ -0,0 +1,129 @@
+import ast
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from core.llm_cache import stable_hash
+
+# 导入即视为结果不可复现的模块 (网络 / 随机数 / 进程外状态)
+NONDETERMINISTIC_MODULES = {
+    "random", "secrets", "uuid", "socket", "ssl", "requests", "urllib", "urllib3", "http",
+    "httpx", "aiohttp", "ftplib", "smtplib", "subprocess", "multiprocessing", "threading", "asyncio"
+}
+# 出现即视为不可复现的调用 (按属性名 / 函数名匹配)
+NONDETERMINISTIC_CALLS = {
+    "now", "utcnow", "today", "time", "time_ns", "perf_counter", "monotonic", "urandom",
+    "getrandom", "input", "default_rng", "rand", "randn", "randint", "random", "choice",
+    "shuffle", "permutation", "normal", "uniform", "sample"
+}
+# 出现随机数调用时，若同时显式设置了种子则仍视为可复现
+SEED_CALLS = {"seed", "manual_seed", "set_seed"}
+
+def is_deterministic(code: str) -> bool:
+    """
+    静态判断代码的执行结果是否可复现 (保守策略：不确定即返回 False)。
+    - 导入网络 / 随机数 / 并发相关模块 -> 否
+    - 调用时间、随机数等函数且没有设置随机种子 -> 否
+    - 语法错误 -> 是 (运行必然失败，结果本身不会被缓存)
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True
+
+    calls = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name.split(".")[0] in NONDETERMINISTIC_MODULES for alias in node.names):
+                return False
+        elif isinstance(node, ast.ImportFrom):
+            if (node.module or "").split(".")[0] in NONDETERMINISTIC_MODULES:
+                return False
+        elif isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Attribute):
+                calls.add(func.attr)
+            elif isinstance(func, ast.Name):
+                calls.add(func.id)
+
+    risky = calls & NONDETERMINISTIC_CALLS
+    if not risky:
+        return True
+    # 只有随机数调用 (不含时间 / 输入) 且设置了种子时才可缓存
+    time_or_io = risky & {"now", "utcnow", "today", "time", "time_ns", "perf_counter", "monotonic", "urandom", "getrandom", "input"}
+    return not time_or_io and bool(calls & SEED_CALLS)
+
+def is_cacheable_result(result: Dict[str, Any]) -> bool:
+    """
+    只缓存正常结束的运行 (退出码 0、未超时、未被 OOM 杀死)。
+    超时与 OOM 取决于当时的机器负载与内存压力，回放这类失败会让相同代码永远无法重试成功。
+    """
+    profile = result.get("profile") or {}
+    return result["returncode"] == 0 and not result["timed_out"] and not profile.get("oom_killed")
+
+class ExecutionResultCache:
+    """
+    [Result Cache] 沙箱执行结果的内容寻址缓存
+    键 = (包装后的代码, 镜像, 资源限制, 超时) 的哈希；只存放 is_cacheable_result 的结果。
+    按条目数与总字节数 LRU 淘汰。线程安全。
+    """
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "uncacheable": 0}
+
+    @staticmethod
+    def make_key(wrapped_code: str, image: str, limits: Dict[str, Any]) -> str:
+        return stable_hash({"code": wrapped_code, "image": image, "limits": limits})
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def set(self, key: str, result: Dict[str, Any]):
+        size = len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8"))
+        with self._lock:
+            if size > self.max_bytes:
+                # 单条结果超过总容量 (例如巨大的图片)，不缓存
+                self._stats["uncacheable"] += 1
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[key] = (size, result)
+            self._bytes += size
+            self._stats["sets"] += 1
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def record_uncacheable(self):
+        with self._lock:
+            self._stats["uncacheable"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                **self._stats
+            }
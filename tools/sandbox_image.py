@@ -0,0 +1,138 @@
+"""
+[Sandbox Image] 预装依赖的沙箱镜像
+- 依赖集合在配置中声明 (SANDBOX_PACKAGES)，据此生成 Dockerfile；
+  镜像 tag 取 Dockerfile 内容的哈希，依赖不变时直接复用本地镜像，变更后自动得到新 tag
+- 依赖安装单独一层并在构建时预编译字节码、生成 matplotlib 字体缓存，
+  首次 import 的一次性开销在构建时付清
+- 启动时检查镜像是否存在，不存在则在本地构建；构建失败时回退到基础镜像
+"""
+import io
+import re
+import json
+import logging
+from typing import List, Optional, Set, Tuple
+
+from config.keys import SANDBOX_BASE_IMAGE, SANDBOX_PACKAGES, SANDBOX_IMAGE_REPO, SANDBOX_IMAGE_AUTO_BUILD
+from core.llm_cache import stable_hash
+
+logger = logging.getLogger("Tools-Sandbox")
+
+# pip 包名与 import 名不一致的常见库
+_IMPORT_NAMES = {
+    "scikit-learn": "sklearn",
+    "pillow": "PIL",
+    "beautifulsoup4": "bs4",
+    "opencv-python-headless": "cv2",
+    "opencv-python": "cv2",
+    "pyyaml": "yaml",
+    "python-dateutil": "dateutil",
+}
+
+def import_names(packages: List[str]) -> List[str]:
+    """把依赖声明 (可带版本约束，如 pandas==2.1.4) 转换为 import 名"""
+    names = []
+    for spec in packages:
+        name = spec
+        for sep in ("==", ">=", "<=", "~=", "!=", ">", "<", "[", ";"):
+            name = name.split(sep)[0]
+        name = name.strip().lower()
+        if name:
+            names.append(_IMPORT_NAMES.get(name, name.replace("-", "_")))
+    return names
+
+def warm_modules(packages: List[str]) -> List[str]:
+    """预热时需要 import 的模块 (matplotlib 需要导入 pyplot 才会加载字体缓存)"""
+    return ["matplotlib.pyplot" if m == "matplotlib" else m for m in import_names(packages)]
+
+def warm_import_command(packages: List[str]) -> List[str]:
+    """容器启动时 import 一次声明的库，只预热页缓存，不会在之后的解释器中保留 (单个模块失败不影响其他模块)"""
+    script = (
+        "import importlib\n"
+        f"for m in {warm_modules(packages)!r}:\n"
+        "    try:\n"
+        "        importlib.import_module(m)\n"
+        "    except Exception:\n"
+        "        pass\n"
+    )
+    return ["python", "-c", script]
+
+# 输出解释器版本 [major, minor] 与可导入的全部顶层模块 (各一行 JSON)，供执行前的静态检查使用
+LIST_MODULES_SCRIPT = (
+    "import sys, pkgutil, json; "
+    "print(json.dumps(list(sys.version_info[:2]))); "
+    "print(json.dumps(sorted(set(sys.builtin_module_names) | {m.name for m in pkgutil.iter_modules()})))"
+)
+
+def _probe_lines(output) -> List[str]:
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", errors="replace")
+    return output.strip().splitlines()
+
+def parse_module_list(output) -> Optional[Set[str]]:
+    """解析 LIST_MODULES_SCRIPT 输出中的模块列表，失败返回 None"""
+    try:
+        return set(json.loads(_probe_lines(output)[-1]))
+    except Exception:
+        return None
+
+def parse_python_version(output) -> Optional[Tuple[int, int]]:
+    """解析 LIST_MODULES_SCRIPT 输出中的解释器版本，失败返回 None"""
+    try:
+        lines = _probe_lines(output)
+        major, minor = json.loads(lines[-2])
+        return int(major), int(minor)
+    except Exception:
+        return None
+
+def base_python_version(base_image: str = SANDBOX_BASE_IMAGE) -> Optional[Tuple[int, int]]:
+    """从官方 python 基础镜像的 tag 推断解释器版本 (例如 python:3.9-slim -> (3, 9))，无法推断时返回 None"""
+    match = re.match(r"^(?:.*/)?python:(\d+)\.(\d+)", base_image)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def render_dockerfile(base_image: str = SANDBOX_BASE_IMAGE, packages: Optional[List[str]] = None) -> str:
+    packages = SANDBOX_PACKAGES if packages is None else packages
+    lines = [
+        f"FROM {base_image}",
+        "ENV PIP_NO_CACHE_DIR=1 PIP_DISABLE_PIP_VERSION_CHECK=1 MPLBACKEND=Agg",
+    ]
+    if packages:
+        # 依赖层：按声明顺序固定，内容不变时命中 Docker 层缓存
+        lines.append("RUN pip install " + " ".join(f"'{p}'" for p in packages))
+        # 预编译字节码 + 首次 import (matplotlib 在这里生成字体缓存)
+        lines.append("RUN python -m compileall -q $(python -c 'import site; print(site.getsitepackages()[0])') || true")
+        lines.append(f"RUN python -c \"import importlib; [importlib.import_module(m) for m in {warm_modules(packages)!r}]\"")
+    lines.append("WORKDIR /tmp")
+    return "\n".join(lines) + "\n"
+
+def image_tag(dockerfile: str) -> str:
+    """镜像 tag = Dockerfile 内容哈希，依赖集合变化时自动换新 tag"""
+    return f"{SANDBOX_IMAGE_REPO}:{stable_hash(dockerfile)[:12]}"
+
+def ensure_image(client, base_image: str = SANDBOX_BASE_IMAGE, packages: Optional[List[str]] = None) -> str:
+    """
+    返回可用的沙箱镜像 tag：本地已存在则直接使用，否则按配置构建 (阻塞，可能需要几分钟)。
+    构建被禁用或失败时回退到基础镜像 (此时声明的依赖不可用)。
+    """
+    import docker
+
+    dockerfile = render_dockerfile(base_image, packages)
+    tag = image_tag(dockerfile)
+    try:
+        client.images.get(tag)
+        logger.info(f"📦 Sandbox image {tag} found.")
+        return tag
+    except docker.errors.ImageNotFound:
+        pass
+
+    if not SANDBOX_IMAGE_AUTO_BUILD:
+        logger.warning(f"Sandbox image {tag} not found and auto build is disabled. Using {base_image}.")
+        return base_image
+
+    logger.info(f"📦 Building sandbox image {tag} (first run only)...")
+    try:
+        client.images.build(fileobj=io.BytesIO(dockerfile.encode("utf-8")), tag=tag, rm=True)
+        logger.info(f"📦 Sandbox image {tag} built.")
+        return tag
+    except Exception as e:
+        logger.error(f"Failed to build sandbox image {tag}: {e}. Falling back to {base_image}.")
+        return base_image
@@ -0,0 +1,188 @@
+"""
+[Persistent Kernel] 沙箱容器内的常驻 Python 执行服务 (类似精简版 Jupyter kernel)
+
+- server: 在 Unix Socket 上监听，启动时预加载重量级库 (numpy / pandas / matplotlib)，
+  之后每个 cell 在同一个解释器内执行，省去进程启动与 import 开销。
+- client: 由 DockerSandbox 在容器内以普通脚本方式启动 (受 timeout 与进程组 kill 约束)，
+  把 cell 发给 server 并把输出按 stdout / stderr 原样写回，退出码与脚本一致。
+  server 不存在或已崩溃时由 client 自动拉起。
+
+协议: 4 字节大端长度前缀 + JSON。
+"""
+from typing import Dict, List
+
+# 容器内的安装位置与 Socket 路径 (每个容器最多一个 kernel)
+KERNEL_DIR = "/opt/swarm_kernel"
+KERNEL_SOCKET = "/tmp/swarm_kernel/kernel.sock"
+KERNEL_PIDFILE = KERNEL_SOCKET + ".pid"
+SERVER_PATH = f"{KERNEL_DIR}/server.py"
+CLIENT_PATH = f"{KERNEL_DIR}/client.py"
+
+# client 退出码: kernel 无法启动 / 执行中 kernel 崩溃
+EXIT_KERNEL_START_FAILED = 97
+EXIT_KERNEL_DIED = 98
+
+_FRAMING = '''
+import json, struct
+
+def send(conn, obj):
+    data = json.dumps(obj).encode("utf-8")
+    conn.sendall(struct.pack(">I", len(data)) + data)
+
+def _read_exact(conn, n):
+    buf = b""
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+def recv(conn):
+    header = _read_exact(conn, 4)
+    if header is None:
+        return None
+    payload = _read_exact(conn, struct.unpack(">I", header)[0])
+    return None if payload is None else json.loads(payload.decode("utf-8"))
+'''
+
+SERVER_SOURCE = _FRAMING + '''
+import io, os, socket, sys, traceback, importlib
+
+SOCK = sys.argv[1]
+PRELOAD = [m for m in (sys.argv[2] if len(sys.argv) > 2 else "").split(",") if m]
+
+# 预加载重量级库 (失败的忽略，由 cell 自己报错)
+for name in PRELOAD:
+    try:
+        if name == "matplotlib":
+            import matplotlib
+            matplotlib.use("Agg")
+            import matplotlib.pyplot
+        else:
+            importlib.import_module(name)
+    except Exception:
+        pass
+
+_persistent = {"__name__": "__main__"}
+
+class _Forward(io.TextIOBase):
+    """把 print 输出实时转发给 client"""
+    def __init__(self, conn, name):
+        self.conn, self.name = conn, name
+    def writable(self):
+        return True
+    def write(self, s):
+        if s:
+            send(self.conn, {"stream": self.name, "data": s})
+        return len(s)
+
+def run_cell(conn, req):
+    ns = _persistent if req.get("keep_state") else {"__name__": "__main__"}
+    cwd = req["cwd"]
+    os.chdir(cwd)
+    sys.path.insert(0, cwd)
+    old_out, old_err = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _Forward(conn, "stdout"), _Forward(conn, "stderr")
+    rc = 0
+    try:
+        with open(req["path"], encoding="utf-8") as f:
+            code = compile(f.read(), req["path"], "exec")
+        exec(code, ns)
+    except SystemExit as e:
+        rc = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        rc = 1
+    finally:
+        sys.stdout, sys.stderr = old_out, old_err
+        if cwd in sys.path:
+            sys.path.remove(cwd)
+        # 图形状态跨 cell 共享，执行后清空，避免下一个 cell 保存到旧图
+        plt = sys.modules.get("matplotlib.pyplot")
+        if plt is not None:
+            plt.close("all")
+    send(conn, {"exit": rc})
+
+def main():
+    os.makedirs(os.path.dirname(SOCK), exist_ok=True)
+    if os.path.exists(SOCK):
+        os.unlink(SOCK)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCK)
+    server.listen(1)
+    with open(SOCK + ".pid", "w") as f:
+        f.write(str(os.getpid()))
+    while True:
+        conn, _ = server.accept()
+        try:
+            req = recv(conn)
+            if req is None:
+                continue
+            if req.get("op") == "exec":
+                run_cell(conn, req)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            conn.close()
+
+main()
+'''
+
+CLIENT_SOURCE = _FRAMING + '''
+import os, socket, subprocess, sys, time
+
+SOCK, SERVER, PRELOAD, OP = sys.argv[1:5]
+
+def connect():
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(SOCK)
+    return conn
+
+try:
+    conn = connect()
+except OSError:
+    # kernel 不存在或已崩溃：在独立会话中拉起，避免随本进程组被 kill
+    os.makedirs(os.path.dirname(SOCK), exist_ok=True)
+    subprocess.Popen(
+        [sys.executable, "-u", SERVER, SOCK, PRELOAD],
+        stdin=subprocess.DEVNULL, stdout=open(SOCK + ".log", "ab"), stderr=subprocess.STDOUT,
+        start_new_session=True
+    )
+    deadline = time.time() + 60
+    while True:
+        try:
+            conn = connect()
+            break
+        except OSError:
+            if time.time() > deadline:
+                print("[SYSTEM] Kernel failed to start.", file=sys.stderr)
+                sys.exit(%(start_failed)d)
+            time.sleep(0.05)
+
+send(conn, {"op": "exec", "path": os.path.abspath(sys.argv[5]), "cwd": os.getcwd(), "keep_state": OP == "exec_keep"})
+
+while True:
+    msg = recv(conn)
+    if msg is None:
+        print("[SYSTEM] Kernel died during execution.", file=sys.stderr)
+        sys.exit(%(died)d)
+    if "exit" in msg:
+        sys.exit(msg["exit"])
+    stream = sys.stdout if msg["stream"] == "stdout" else sys.stderr
+    stream.write(msg["data"])
+    stream.flush()
+''' % {"start_failed": EXIT_KERNEL_START_FAILED, "died": EXIT_KERNEL_DIED}
+
+def kernel_files() -> Dict[str, str]:
+    """需要安装到容器 KERNEL_DIR 下的文件 {文件名: 源码}"""
+    return {"server.py": SERVER_SOURCE, "client.py": CLIENT_SOURCE}
+
+def client_command(preload: List[str], keep_state: bool = False, script: str = "script.py") -> str:
+    """在 run_dir 中通过 kernel 执行 script 的命令 (替代 python -u script.py)"""
+    op = "exec_keep" if keep_state else "exec"
+    return f"python -u {CLIENT_PATH} {KERNEL_SOCKET} {SERVER_PATH} {','.join(preload) or '-'} {op} {script}"
+
+def kill_command() -> str:
+    """杀死 kernel 进程 (超时 / 会话切换时使用)"""
+    return f"kill -9 $(cat {KERNEL_PIDFILE} 2>/dev/null) 2>/dev/null; rm -f {KERNEL_SOCKET} {KERNEL_PIDFILE}; true"
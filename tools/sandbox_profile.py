@@ -0,0 +1,122 @@
+"""
+[Profiling] 单次沙箱执行的资源画像: 墙钟时间、CPU 时间、峰值内存、是否被 OOM 杀死
+- 脚本通过一个极小的启动器运行 (runpy，同一进程内，不增加解释器启动开销)，
+  退出时把 getrusage 的 CPU 时间与 ru_maxrss 写入 run_dir/.usage.json
+- Docker 后端另外在执行前后读取容器 cgroup 计数器 (CPU 用量、oom_kill)，
+  容器同一时间只被一次执行独占，前后差值即本次执行的消耗 (包括子进程与 kernel)
+被 kill 的执行不会写出 .usage.json，对应字段为 None。
+"""
+import json
+import shlex
+from typing import Any, Dict, Optional, Tuple
+
+USAGE_FILE = ".usage.json"
+
+# 在用户脚本所在进程内运行脚本，退出时 (包括异常与 sys.exit) 记录资源用量。
+# 异常回溯去掉启动器自身的栈帧，与直接运行 python script.py 的输出一致。
+LAUNCHER_SOURCE = '''
+import atexit, json, os, resource, runpy, sys, traceback
+_script = sys.argv[1]
+_usage_path = os.path.abspath(%(usage_file)r)
+_state = {"memory_error": False}
+def _report():
+    me, kids = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    data = {
+        "cpu_time": me.ru_utime + me.ru_stime + kids.ru_utime + kids.ru_stime,
+        "max_rss_kb": max(me.ru_maxrss, kids.ru_maxrss),
+        "memory_error": _state["memory_error"]
+    }
+    try:
+        with open(_usage_path, "w") as f:
+            json.dump(data, f)
+    except Exception:
+        pass
+atexit.register(_report)
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(_script, run_name="__main__")
+except SystemExit:
+    raise
+except BaseException as e:
+    _state["memory_error"] = isinstance(e, MemoryError)
+    tb = e.__traceback__
+    while tb is not None and tb.tb_frame.f_code.co_filename != _script:
+        tb = tb.tb_next
+    traceback.print_exception(type(e), e, tb or e.__traceback__)
+    sys.exit(1)
+''' % {"usage_file": USAGE_FILE}
+
+# 读取 cgroup 计数器，每行输出 "cg_<key> <value>"，兼容 cgroup v2 与 v1
+CGROUP_STATS_CMD = (
+    "for f in /sys/fs/cgroup/cpu.stat /sys/fs/cgroup/memory.events /sys/fs/cgroup/memory/memory.oom_control; do "
+    "[ -f $f ] && sed 's/^/cg_/' $f; done; "
+    "[ -f /sys/fs/cgroup/cpuacct/cpuacct.usage ] && echo cg_cpuacct_usage $(cat /sys/fs/cgroup/cpuacct/cpuacct.usage); "
+    "true"
+)
+
+def launcher_argv(python: str, script: str = "script.py") -> list:
+    return [python, "-u", "-c", LAUNCHER_SOURCE, script]
+
+def launcher_command(script: str = "script.py") -> str:
+    """容器内的 shell 命令形式 (替代 python -u script.py)"""
+    return " ".join(shlex.quote(arg) for arg in launcher_argv("python", script))
+
+def probe_command(run_dir: str) -> str:
+    """执行结束后读取 .usage.json 与 cgroup 计数器"""
+    return f"cat {run_dir}/{USAGE_FILE} 2>/dev/null; echo; {CGROUP_STATS_CMD}"
+
+def parse_probe(text: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+    """解析 probe 输出，返回 (usage, cgroup 计数器)"""
+    usage = None
+    counters: Dict[str, int] = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("{"):
+            try:
+                usage = json.loads(line)
+            except ValueError:
+                pass
+        elif line.startswith("cg_"):
+            parts = line.split()
+            if len(parts) == 2 and parts[1].isdigit():
+                counters[parts[0][3:]] = int(parts[1])
+    return usage, counters
+
+def _cgroup_cpu_seconds(counters: Dict[str, int]) -> Optional[float]:
+    if "usage_usec" in counters:
+        return counters["usage_usec"] / 1e6
+    if "cpuacct_usage" in counters:
+        return counters["cpuacct_usage"] / 1e9
+    return None
+
+def build_profile(
+    run_id: str,
+    wall_time: float,
+    usage: Optional[Dict[str, Any]] = None,
+    cgroup_before: Optional[Dict[str, int]] = None,
+    cgroup_after: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
+    """
+    合并两种来源：CPU 时间优先使用 cgroup 差值 (包含被 kill 的进程)，否则使用 getrusage；
+    峰值内存来自 getrusage；cgroup oom_kill 计数增加或脚本抛出 MemoryError 视为 OOM。
+    """
+    cpu_time = None
+    oom_killed = bool(usage and usage.get("memory_error"))
+    if cgroup_before and cgroup_after:
+        before, after = _cgroup_cpu_seconds(cgroup_before), _cgroup_cpu_seconds(cgroup_after)
+        if before is not None and after is not None:
+            cpu_time = max(0.0, after - before)
+        if cgroup_after.get("oom_kill", 0) > cgroup_before.get("oom_kill", 0):
+            oom_killed = True
+    if cpu_time is None and usage:
+        cpu_time = float(usage.get("cpu_time") or 0.0)
+
+    peak_rss = int(usage["max_rss_kb"]) * 1024 if usage and usage.get("max_rss_kb") else None
+    return {
+        "run_id": run_id,
+        "wall_time_s": round(wall_time, 3),
+        "cpu_time_s": round(cpu_time, 3) if cpu_time is not None else None,
+        "cpu_utilization": round(cpu_time / wall_time, 3) if cpu_time is not None and wall_time > 0 else None,
+        "peak_rss_bytes": peak_rss,
+        "oom_killed": oom_killed
+    }
@@ -0,0 +1,201 @@
+"""
+[Semantic Cache] 语义缓存层 (建立在 VectorMemoryTool 的向量索引之上)
+- 命名空间：按 (model, system_instruction, crew, response_schema) 的内容哈希隔离，不同上下文之间互不命中
+- 条目 id = 命名空间 + query 的稳定哈希 (跨进程一致)，重复写入覆盖同一条目而不是堆积
+- TTL：条目带 expires_at，过期后不再命中并被删除
+- 容量：超过 max_entries 后按 LRU / LFU 淘汰；访问统计保存在进程内，启动时从本地索引恢复
+- 阈值：默认 SEMANTIC_CACHE_THRESHOLD，可按 crew 名或模型名单独配置
+"""
+import time
+import heapq
+import asyncio
+import logging
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config.keys import (
+    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_THRESHOLDS, SEMANTIC_CACHE_TTL,
+    SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_EVICTION
+)
+from core.llm_cache import stable_hash
+
+logger = logging.getLogger("Tools-Memory")
+
+CACHE_ENTRY_TYPE = "cache_entry"
+EVICTION_POLICIES = ("lru", "lfu")
+# 查询时多取几条候选，跳过已过期的条目
+_CANDIDATES = 3
+
+def namespace_key(
+    model: str,
+    system_instruction: str = "",
+    crew: Optional[str] = None,
+    response_schema: Any = None
+) -> str:
+    if hasattr(response_schema, "model_json_schema"):
+        response_schema = response_schema.model_json_schema()
+    return stable_hash({
+        "model": model or "",
+        "system_instruction": system_instruction or "",
+        "crew": crew or "",
+        "response_schema": response_schema
+    })[:16]
+
+class SemanticCache:
+    """
+    index: 向量索引 (同步查询，放到线程池中执行)
+    embed: 异步嵌入函数
+    submit: 异步写入函数 (VectorMemoryTool 的 write-behind 队列)，
+            接受 {"id", "text", "metadata"} 或 {"op": "delete", "ids"}
+    """
+    def __init__(
+        self,
+        index,
+        embed: Callable[[str], Awaitable[List[float]]],
+        submit: Callable[[Dict[str, Any]], Awaitable[None]],
+        ttl: float = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        eviction: str = SEMANTIC_CACHE_EVICTION,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        thresholds: Optional[Dict[str, float]] = None
+    ):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown SEMANTIC_CACHE_EVICTION: {eviction}")
+        self.index = index
+        self.embed = embed
+        self.submit = submit
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.eviction = eviction
+        self.threshold = threshold
+        self.thresholds = SEMANTIC_CACHE_THRESHOLDS if thresholds is None else thresholds
+        # id -> {"namespace", "expires_at", "last_access", "hits"}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        self._seed()
+
+    def _seed(self):
+        """从索引恢复已有条目 (Pinecone 无法廉价枚举，只跟踪此后写入或命中的条目)"""
+        for vector_id, metadata in self.index.items({"type": CACHE_ENTRY_TYPE}):
+            self._entries[vector_id] = {
+                "namespace": metadata.get("namespace"),
+                # 旧版本写入的条目没有命名空间与有效期，视为已过期，下次写入时清理
+                "expires_at": metadata.get("expires_at", 0) if metadata.get("namespace") else 0,
+                "last_access": metadata.get("created_at", 0),
+                "hits": 0
+            }
+        if self._entries:
+            logger.info(f"⚡️ Semantic cache restored {len(self._entries)} entries from the index.")
+
+    def threshold_for(self, model: str, crew: Optional[str] = None) -> float:
+        if crew and crew in self.thresholds:
+            return self.thresholds[crew]
+        if model in self.thresholds:
+            return self.thresholds[model]
+        return self.threshold
+
+    async def lookup(
+        self,
+        query: str,
+        model: str = "",
+        system_instruction: str = "",
+        crew: Optional[str] = None,
+        response_schema: Any = None,
+        threshold: Optional[float] = None
+    ) -> Optional[str]:
+        namespace = namespace_key(model, system_instruction, crew, response_schema)
+        vector = await self.embed(query)
+        if not vector:
+            return None
+        loop = asyncio.get_running_loop()
+        matches = await loop.run_in_executor(None, partial(
+            self.index.query, vector, top_k=_CANDIDATES, filter={"type": CACHE_ENTRY_TYPE, "namespace": namespace}
+        ))
+        threshold = self.threshold_for(model, crew) if threshold is None else threshold
+        now = time.time()
+        expired = []
+        result = None
+        for match in matches:
+            if match.score < threshold:
+                break
+            if match.metadata.get("expires_at", 0) <= now:
+                expired.append(match.id)
+                continue
+            entry = self._entries.setdefault(match.id, {
+                "namespace": namespace, "expires_at": match.metadata["expires_at"], "last_access": now, "hits": 0
+            })
+            entry["last_access"] = now
+            entry["hits"] += 1
+            result = match.metadata.get("response_text")
+            logger.info(f"⚡️ [Cache Hit] Query: '{query[:20]}...' (Score: {match.score:.4f})")
+            break
+        if expired:
+            self._stats["expired"] += len(expired)
+            await self._drop(expired)
+        self._stats["hits" if result is not None else "misses"] += 1
+        return result
+
+    async def store(
+        self,
+        query: str,
+        response: str,
+        model: str = "",
+        system_instruction: str = "",
+        crew: Optional[str] = None,
+        response_schema: Any = None
+    ):
+        namespace = namespace_key(model, system_instruction, crew, response_schema)
+        vector_id = f"cache-{namespace}-{stable_hash(query)[:24]}"
+        now = time.time()
+        await self.submit({
+            "id": vector_id,
+            "text": query,
+            "metadata": {
+                "type": CACHE_ENTRY_TYPE,
+                "namespace": namespace,
+                "query_text": query,
+                "response_text": response,
+                "created_at": now,
+                "expires_at": now + self.ttl
+            }
+        })
+        entry = self._entries.setdefault(vector_id, {"namespace": namespace, "hits": 0})
+        entry["expires_at"] = now + self.ttl
+        entry["last_access"] = now
+        self._stats["stores"] += 1
+        await self._evict(now)
+
+    async def _evict(self, now: float):
+        """删除过期条目；超过容量时按策略淘汰 (多淘汰 10% 摊薄排序开销)"""
+        victims = [vector_id for vector_id, entry in self._entries.items() if entry["expires_at"] <= now]
+        self._stats["expired"] += len(victims)
+        over = len(self._entries) - len(victims) - self.max_entries
+        if over > 0:
+            expired = set(victims)
+            candidates = ((i, e) for i, e in self._entries.items() if i not in expired)
+            if self.eviction == "lfu":
+                key = lambda item: (item[1]["hits"], item[1]["last_access"])
+            else:
+                key = lambda item: item[1]["last_access"]
+            evicted = [i for i, _ in heapq.nsmallest(over + self.max_entries // 10, candidates, key=key)]
+            self._stats["evictions"] += len(evicted)
+            victims.extend(evicted)
+        if victims:
+            await self._drop(victims)
+
+    async def _drop(self, ids: List[str]):
+        for vector_id in ids:
+            self._entries.pop(vector_id, None)
+        # 删除与写入走同一个队列，保证不会先删后写
+        await self.submit({"op": "delete", "ids": list(ids)})
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "eviction": self.eviction,
+            "ttl_s": self.ttl,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            **self._stats
+        }
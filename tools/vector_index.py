@@ -0,0 +1,409 @@
+"""
+[Vector Index] 向量索引后端
+- PineconeIndex: 托管的 Pinecone 索引 (每次查询一次网络往返)
+- LocalVectorIndex: 进程内索引，无需任何外部服务
+  向量归一化后存放在一块连续的 float32 矩阵中，精确余弦检索 = 一次矩阵-向量乘法；
+  集合变大时自动启用 IVF (倒排文件) 近似检索，只扫描离查询最近的几个簇
+两者接受相同的 upsert 记录格式与 Pinecone 风格的元数据过滤条件，返回相同的 VectorMatch。
+"""
+import abc
+import math
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from pinecone import Pinecone
+except ImportError:
+    Pinecone = None
+
+from config.keys import (
+    PINECONE_API_KEY, VECTOR_INDEX_NAME, MEMORY_BACKEND,
+    MEMORY_ANN_MIN_VECTORS, MEMORY_ANN_NPROBE, MEMORY_LOCAL_PATH
+)
+
+logger = logging.getLogger("Tools-Memory")
+
+# 本地索引为这些元数据字段维护列式存储，过滤时向量化比较
+INDEXED_FIELDS = ("type", "task_id", "agent", "namespace")
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+class VectorIndex(abc.ABC):
+    """向量索引接口 (同步；调用方负责放到线程池中执行)"""
+    backend_name = "base"
+
+    @abc.abstractmethod
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        """写入或覆盖 [{"id", "values", "metadata"}]"""
+
+    @abc.abstractmethod
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 1,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[VectorMatch]:
+        """按余弦相似度返回最相近的 top_k 条，filter 为 Pinecone 风格的元数据条件"""
+
+    @abc.abstractmethod
+    def delete(self, ids: List[str]):
+        """删除指定 id (不存在的 id 忽略)"""
+
+    @abc.abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """[Monitoring] 索引统计"""
+
+    def items(self, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """枚举满足条件的 (id, metadata)；不支持廉价枚举的后端返回空列表"""
+        return []
+
+    def close(self):
+        """释放文件句柄等资源 (默认无需处理)"""
+
+class PineconeIndex(VectorIndex):
+    backend_name = "pinecone"
+
+    def __init__(self, api_key: str, index_name: str):
+        self.pc = Pinecone(api_key=api_key)
+        self.index = self.pc.Index(index_name)
+
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        self.index.upsert(vectors=vectors)
+
+    def query(self, vector, top_k=1, filter=None) -> List[VectorMatch]:
+        response = self.index.query(vector=list(vector), top_k=top_k, include_metadata=True, filter=filter)
+        if not response or not response.matches:
+            return []
+        return [VectorMatch(m.id, float(m.score), dict(m.metadata or {})) for m in response.matches]
+
+    def delete(self, ids: List[str]):
+        self.index.delete(ids=ids)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend_name}
+
+_FILTER_OPS = ("$eq", "$ne", "$in", "$nin")
+
+def _membership(operand: Any) -> Callable[[Any], bool]:
+    """$in / $nin 的成员判断：集合只构建一次；取值不可哈希 (例如列表) 时退回线性比较"""
+    items = list(operand)
+    try:
+        members = frozenset(items)
+    except TypeError:
+        members = None
+
+    def contains(value: Any) -> bool:
+        if members is not None:
+            try:
+                return value in members
+            except TypeError:
+                pass
+        return value in items
+    return contains
+
+def _compile_condition(condition: Any) -> Callable[[Any], bool]:
+    """
+    把单个字段的过滤条件编译为谓词 (每次查询编译一次，逐行复用)。
+    缺失的字段与 None 同样处理：只能被 {"$eq": None} / {"$in": [None]} 命中，满足 $ne / $nin。
+    """
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    tests: List[Callable[[Any], bool]] = []
+    for op, operand in condition.items():
+        if op not in _FILTER_OPS:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if op == "$eq":
+            tests.append(lambda value, operand=operand: value == operand)
+        elif op == "$ne":
+            tests.append(lambda value, operand=operand: value != operand)
+        else:
+            contains = _membership(operand)
+            if op == "$in":
+                tests.append(contains)
+            else:
+                tests.append(lambda value, contains=contains: not contains(value))
+    if len(tests) == 1:
+        return tests[0]
+    return lambda value: all(test(value) for test in tests)
+
+def _match_condition(value: Any, condition: Any) -> bool:
+    return _compile_condition(condition)(value)
+
+def match_filter(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    """Pinecone 风格的元数据过滤 (支持等值与 $eq / $ne / $in / $nin)"""
+    if not filter:
+        return True
+    return all(_match_condition(metadata.get(key), condition) for key, condition in filter.items())
+
+def _column_mask(column: np.ndarray, condition: Any) -> np.ndarray:
+    """
+    对列式存储的字段逐行求值。列是 object 数组且可能混有 None，
+    np.isin / 广播比较在这种列上行为不可靠 (还会把列表取值展开)，因此用编译好的 Python 谓词。
+    """
+    return np.fromiter(map(_compile_condition(condition), column), dtype=bool, count=len(column))
+
+class LocalVectorIndex(VectorIndex):
+    """
+    进程内向量索引 (线程安全)。
+    - 向量写入时归一化，检索分数即余弦相似度
+    - 矩阵按倍数扩容；删除时把最后一行移到空位，保持连续
+    - 向量数达到 ann_min_vectors 后训练 IVF (k-means, nlist ≈ √n)，查询只扫描 nprobe 个簇；
+      之后每增长一倍重新训练。ann_min_vectors=0 表示始终精确检索
+    """
+    backend_name = "local"
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        ann_min_vectors: int = MEMORY_ANN_MIN_VECTORS,
+        nprobe: int = MEMORY_ANN_NPROBE
+    ):
+        self.dim = dim
+        self.ann_min_vectors = ann_min_vectors
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Dict[str, Any]] = []
+        self._columns: Dict[str, np.ndarray] = {name: np.empty(0, dtype=object) for name in INDEXED_FIELDS}
+        # [IVF] 簇中心与每行所属的簇
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        self._stats = {"queries": 0, "ann_queries": 0, "upserts": 0, "deletes": 0, "trainings": 0}
+
+    def __len__(self) -> int:
+        return self._size
+
+    # --- 写入 ---
+
+    def _normalize(self, values) -> np.ndarray:
+        vector = np.asarray(values, dtype=np.float32).reshape(-1)
+        if self.dim is None:
+            self.dim = vector.shape[0]
+            self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Vector dimension {vector.shape[0]} does not match index dimension {self.dim}")
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _reserve(self, capacity: int):
+        if capacity <= self._matrix.shape[0]:
+            return
+        new_capacity = max(capacity, 2 * self._matrix.shape[0], 64)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+        self._grow_columns(new_capacity)
+
+    def _grow_columns(self, capacity: int):
+        """扩容与行对齐的数组 (元数据列、IVF 簇分配)"""
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=object)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        assignments[:self._size] = self._assignments[:self._size]
+        self._assignments = assignments
+
+    def _set_row(self, row: int, vector: np.ndarray, metadata: Dict[str, Any]):
+        self._matrix[row] = vector
+        self._metadata[row] = metadata
+        for name, column in self._columns.items():
+            column[row] = metadata.get(name)
+        if self._centroids is not None:
+            self._assignments[row] = int(np.argmax(self._centroids @ vector))
+
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        with self._lock:
+            for record in vectors:
+                vector = self._normalize(record["values"])
+                metadata = dict(record.get("metadata") or {})
+                row = self._rows.get(record["id"])
+                if row is None:
+                    self._reserve(self._size + 1)
+                    row = self._size
+                    self._size += 1
+                    self._ids.append(record["id"])
+                    self._metadata.append(metadata)
+                    self._rows[record["id"]] = row
+                self._set_row(row, vector, metadata)
+            self._stats["upserts"] += len(vectors)
+            self._maybe_train()
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for vector_id in ids:
+                row = self._rows.pop(vector_id, None)
+                if row is None:
+                    continue
+                last = self._size - 1
+                if row != last:
+                    # 最后一行移入空位，矩阵保持连续
+                    moved_id = self._ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._ids[row] = moved_id
+                    self._metadata[row] = self._metadata[last]
+                    for column in self._columns.values():
+                        column[row] = column[last]
+                    self._assignments[row] = self._assignments[last]
+                    self._rows[moved_id] = row
+                self._ids.pop()
+                self._metadata.pop()
+                for column in self._columns.values():
+                    column[last] = None
+                self._size -= 1
+                self._stats["deletes"] += 1
+
+    # --- IVF ---
+
+    def _maybe_train(self):
+        if not self.ann_min_vectors or self._size < self.ann_min_vectors:
+            return
+        if self._centroids is not None and self._size < 2 * self._trained_size:
+            return
+        self._train()
+
+    def _train(self, iterations: int = 10, sample_size: int = 50000):
+        """在样本上做球面 k-means，然后为所有行分配簇"""
+        data = self._matrix[:self._size]
+        nlist = max(1, int(math.sqrt(self._size)))
+        rng = np.random.default_rng(0)
+        sample = data[rng.choice(self._size, min(sample_size, self._size), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].astype(np.float32)
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    center = members.sum(axis=0)
+                    norm = float(np.linalg.norm(center))
+                    centroids[c] = center / norm if norm > 0 else center
+        self._centroids = centroids
+        # 分块分配，避免 n × nlist 的大矩阵
+        for start in range(0, self._size, 8192):
+            block = data[start:start + 8192]
+            self._assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        self._trained_size = self._size
+        self._stats["trainings"] += 1
+        logger.info(f"🧭 Local vector index trained IVF with {nlist} lists over {self._size} vectors.")
+
+    # --- 查询 ---
+
+    def _live_mask(self) -> Optional[np.ndarray]:
+        """有效行掩码；None 表示所有行都有效 (矩阵中没有已删除的行)"""
+        return None
+
+    def _candidate_mask(self, filter: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        live = self._live_mask()
+        if not filter:
+            return live
+        n = self._size
+        mask = np.ones(n, dtype=bool) if live is None else live.copy()
+        for key, condition in filter.items():
+            if key in self._columns:
+                mask &= _column_mask(self._columns[key][:n], condition)
+            else:
+                test = _compile_condition(condition)
+                mask &= np.fromiter((test(m.get(key)) for m in self._metadata), dtype=bool, count=n)
+        return mask
+
+    def query(self, vector, top_k=1, filter=None) -> List[VectorMatch]:
+        with self._lock:
+            self._stats["queries"] += 1
+            if not self._size or top_k <= 0:
+                return []
+            q = self._normalize(vector)
+            mask = self._candidate_mask(filter)
+            if self._centroids is not None:
+                self._stats["ann_queries"] += 1
+                nprobe = min(self.nprobe, len(self._centroids))
+                probes = np.argpartition(-(self._centroids @ q), nprobe - 1)[:nprobe]
+                in_lists = np.isin(self._assignments[:self._size], probes)
+                mask = in_lists if mask is None else mask & in_lists
+            if mask is None:
+                rows = None
+                scores = self._matrix[:self._size] @ q
+            else:
+                rows = np.flatnonzero(mask)
+                if not len(rows):
+                    return []
+                scores = self._matrix[rows] @ q
+            best = self._top_k(scores, top_k)
+            return [
+                VectorMatch(self._ids[r], float(scores[i]), dict(self._metadata[r]))
+                for i, r in ((i, i if rows is None else int(rows[i])) for i in best)
+            ]
+
+    def items(self, filter=None) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            mask = self._candidate_mask(filter)
+            rows = range(self._size) if mask is None else np.flatnonzero(mask)
+            return [(self._ids[r], dict(self._metadata[r])) for r in rows]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        if top_k >= len(scores):
+            return np.argsort(-scores)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return best[np.argsort(-scores[best])]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend_name,
+                "vectors": self._size,
+                "dim": self.dim,
+                "capacity": self._matrix.shape[0],
+                "ann": self._centroids is not None,
+                "ivf_lists": 0 if self._centroids is None else len(self._centroids),
+                **self._stats
+            }
+
+def create_local_index(path: str = MEMORY_LOCAL_PATH) -> LocalVectorIndex:
+    """配置了 path 时使用磁盘持久化的索引 (tools/vector_store.py)，否则仅在内存中"""
+    if path:
+        from tools.vector_store import PersistentVectorIndex
+        try:
+            return PersistentVectorIndex(path)
+        except Exception as e:
+            logger.error(f"Vector store init failed ({path}): {e}. Falling back to memory only.")
+    return LocalVectorIndex()
+
+def create_vector_index(
+    backend: str = MEMORY_BACKEND,
+    api_key: str = PINECONE_API_KEY,
+    index_name: str = VECTOR_INDEX_NAME
+) -> Tuple[Optional[VectorIndex], str]:
+    """
+    按配置创建索引，返回 (索引, 实际后端名)。
+    backend: auto (配置了 Pinecone 则使用，否则关闭记忆) | pinecone | local | none
+    本地索引需显式开启 (MEMORY_BACKEND=local)：它同样依赖 Gemini Embedding，
+    未配置时静默回退只会让每次写入与查询都以 Embedding 失败告终。
+    """
+    backend = (backend or "auto").lower()
+    if backend == "none":
+        return None, "none"
+    if backend == "local":
+        index = create_local_index()
+        return index, index.backend_name
+    if backend not in ("auto", "pinecone"):
+        raise ValueError(f"Unknown MEMORY_BACKEND: {backend}")
+    if api_key and index_name and Pinecone:
+        try:
+            return PineconeIndex(api_key, index_name), "pinecone"
+        except Exception as e:
+            logger.error(f"Pinecone init failed: {e}")
+            return None, "none"
+    logger.warning("Pinecone not configured. Memory & Caching disabled (set MEMORY_BACKEND=local for an in-process index).")
+    return None, "none"
@@ -0,0 +1,465 @@
+"""
+[Vector Store] 持久化到磁盘的本地向量索引
+目录结构 (MEMORY_LOCAL_PATH):
+- CURRENT            当前代 {"generation", "dim", "dtype"}，写临时文件后原子替换
+- vectors.<gen>.bin  只追加的向量文件 (无表头的 float32 / float16 行)，通过 np.memmap 零拷贝加载
+- meta.<gen>.log     只追加的元数据日志 (JSON Lines)：{"op": "put", "id", "row", "metadata"} / {"op": "del", "id"}
+- LOCK               写者锁 (flock)；拿不到锁的进程以只读方式打开，与写者共享同一份页缓存
+崩溃恢复：向量先于日志落盘，加载时截掉写了一半的尾行，未被日志引用的向量行视为无效。
+覆盖与删除只追加墓碑，墓碑占比超过阈值时在后台线程中压缩为新的一代。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # 非 POSIX 平台没有 flock，只支持单进程写入
+    fcntl = None
+
+from config.keys import (
+    MEMORY_VECTOR_DTYPE, MEMORY_FSYNC, MEMORY_COMPACT_RATIO,
+    MEMORY_ANN_MIN_VECTORS, MEMORY_ANN_NPROBE
+)
+from tools.vector_index import LocalVectorIndex, VectorMatch
+
+logger = logging.getLogger("Tools-Memory")
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "LOCK"
+# 墓碑少于该数量时不值得压缩
+COMPACT_MIN_DEAD = 1024
+# 只读进程检查写者新数据的最短间隔 (秒)
+REFRESH_INTERVAL = 1.0
+
+class PersistentVectorIndex(LocalVectorIndex):
+    """
+    mmap 只追加向量存储 (线程安全，单写者多读者)。
+    - 启动只映射向量文件并重放元数据日志，不读取、不复制向量数据
+    - 写入：向量块追加到 vectors 文件，再追加对应的 put 日志；覆盖同一 id 时旧行成为墓碑
+    - 只读进程每 REFRESH_INTERVAL 秒增量读取日志尾部，代数变化 (压缩) 时重新加载
+    - IVF 不持久化，首次查询时按需训练
+    """
+    backend_name = "local-mmap"
+
+    def __init__(
+        self,
+        path: str,
+        dtype: str = MEMORY_VECTOR_DTYPE,
+        fsync: bool = MEMORY_FSYNC,
+        compact_ratio: float = MEMORY_COMPACT_RATIO,
+        read_only: bool = False,
+        ann_min_vectors: int = MEMORY_ANN_MIN_VECTORS,
+        nprobe: int = MEMORY_ANN_NPROBE
+    ):
+        super().__init__(None, ann_min_vectors, nprobe)
+        self.path = path
+        self.storage_dtype = np.dtype(dtype)
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio
+        os.makedirs(path, exist_ok=True)
+        # 写入与压缩互斥；查询只需要 self._lock，压缩期间照常服务
+        self._write_lock = threading.Lock()
+        self._lock_fd: Optional[int] = None
+        self.read_only = read_only or not self._acquire_writer_lock()
+        self._vector_file = None
+        self._log_file = None
+        self._compactor: Optional[threading.Thread] = None
+        self._last_refresh = time.monotonic()
+        self._stats.update({"compactions": 0, "recovered_bytes": 0})
+        with self._lock:
+            self._load()
+        logger.info(
+            f"💾 Vector store {path} loaded: {len(self)} vector(s), generation {self._generation}"
+            f"{' (read-only)' if self.read_only else ''}."
+        )
+
+    def __len__(self) -> int:
+        return self._size - self._dead
+
+    # --- 文件 ---
+
+    def _vectors_path(self, generation: Optional[int] = None) -> str:
+        return os.path.join(self.path, f"vectors.{self._generation if generation is None else generation}.bin")
+
+    def _log_path(self, generation: Optional[int] = None) -> str:
+        return os.path.join(self.path, f"meta.{self._generation if generation is None else generation}.log")
+
+    def _acquire_writer_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        fd = os.open(os.path.join(self.path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            logger.info(f"Vector store {self.path} is held by another process. Opening read-only.")
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, generation: int):
+        """写临时文件后原子替换，读者看到的 CURRENT 总是完整的"""
+        target = os.path.join(self.path, CURRENT_FILE)
+        tmp = target + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "dim": self.dim, "dtype": self.storage_dtype.name}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+
+    def _flush(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _open_appenders(self):
+        self._close_appenders()
+        self._vector_file = open(self._vectors_path(), "ab")
+        self._log_file = open(self._log_path(), "ab")
+
+    def _close_appenders(self):
+        for f in (self._vector_file, self._log_file):
+            if f is not None:
+                f.close()
+        self._vector_file = self._log_file = None
+
+    # --- 加载与恢复 ---
+
+    def _reset_state(self):
+        self._size = 0
+        self._dead = 0
+        self._ids = []
+        self._rows = {}
+        self._metadata = []
+        self._columns = {name: np.empty(0, dtype=object) for name in self._columns}
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._live = np.zeros(0, dtype=bool)
+        self._centroids = None
+        self._trained_size = 0
+        self._mapped_rows = 0
+        self._log_offset = 0
+        self._generation = 0
+        self._matrix = np.zeros((0, self.dim or 0), dtype=self.storage_dtype)
+
+    def _load(self, attempts: int = 3):
+        """映射当前代的向量文件并重放元数据日志 (读者可能与压缩并发，文件被替换时重试)"""
+        for attempt in range(attempts):
+            try:
+                self._load_generation()
+                return
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+
+    def _load_generation(self):
+        self._close_appenders()
+        self._reset_state()
+        manifest = self._read_manifest()
+        if manifest is None:
+            return
+        self._generation = manifest["generation"]
+        self.dim = manifest["dim"]
+        # 已有文件的精度优先于配置
+        self.storage_dtype = np.dtype(manifest["dtype"])
+        self._matrix = np.zeros((0, self.dim), dtype=self.storage_dtype)
+        if not self.read_only:
+            self._recover()
+        self._catch_up()
+        if not self.read_only:
+            self._open_appenders()
+
+    def _recover(self):
+        """截掉崩溃时写了一半的向量行与日志行"""
+        row_bytes = self.dim * self.storage_dtype.itemsize
+        for path, valid in (
+            (self._vectors_path(), lambda size: size - size % row_bytes),
+            (self._log_path(), self._complete_log_bytes),
+        ):
+            if not os.path.exists(path):
+                open(path, "ab").close()
+                continue
+            size = os.path.getsize(path)
+            keep = valid(size)
+            if keep < size:
+                with open(path, "r+b") as f:
+                    f.truncate(keep)
+                self._stats["recovered_bytes"] += size - keep
+                logger.warning(f"Vector store recovered from a partial write: dropped {size - keep} byte(s) of {path}.")
+
+    def _complete_log_bytes(self, size: int) -> int:
+        """日志中最后一个换行符之后的内容是不完整的记录"""
+        with open(self._log_path(), "rb") as f:
+            f.seek(max(0, size - 65536))
+            tail = f.read()
+        if tail.endswith(b"\n") or not tail:
+            return size
+        cut = tail.rfind(b"\n")
+        if cut >= 0:
+            return size - len(tail) + cut + 1
+        if size <= 65536:
+            return 0
+        # 单条记录超过 64KB 的极端情况：整体扫描
+        with open(self._log_path(), "rb") as f:
+            return f.read().rfind(b"\n") + 1
+
+    def _catch_up(self):
+        """读取日志中新增的完整记录并应用 (先映射新增的向量行，日志只会引用已落盘的行)"""
+        with open(self._log_path(), "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self._log_offset += end
+        self._sync_rows()
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping a corrupted record in {self._log_path()}.")
+                continue
+            self._apply(entry)
+
+    def _sync_rows(self):
+        """按向量文件长度扩展行数并重新映射"""
+        row_bytes = self.dim * self.storage_dtype.itemsize
+        rows = os.path.getsize(self._vectors_path()) // row_bytes
+        if rows > self._size:
+            self._extend_rows(rows - self._size)
+        self._remap(rows)
+
+    def _remap(self, rows: int):
+        if rows == self._mapped_rows:
+            return
+        if rows:
+            self._matrix = np.memmap(self._vectors_path(), dtype=self.storage_dtype, mode="r", shape=(rows, self.dim))
+        else:
+            self._matrix = np.zeros((0, self.dim), dtype=self.storage_dtype)
+        self._mapped_rows = rows
+
+    def _extend_rows(self, count: int):
+        """追加 count 个空行 (在被 put 日志引用之前都视为无效)"""
+        capacity = len(self._assignments)
+        if self._size + count > capacity:
+            new_capacity = max(self._size + count, 2 * capacity, 64)
+            self._grow_columns(new_capacity)
+            live = np.zeros(new_capacity, dtype=bool)
+            live[:self._size] = self._live[:self._size]
+            self._live = live
+        self._ids.extend([None] * count)
+        self._metadata.extend({} for _ in range(count))
+        self._size += count
+        self._dead += count
+
+    def _apply(self, entry: Dict[str, Any]):
+        if entry.get("op") == "del":
+            self._kill(entry["id"])
+            return
+        row = entry["row"]
+        if row >= self._size or self._live[row]:
+            logger.warning(f"Skipping a log record that points at an invalid row ({row}).")
+            return
+        self._kill(entry["id"])
+        metadata = entry.get("metadata") or {}
+        self._ids[row] = entry["id"]
+        self._rows[entry["id"]] = row
+        self._metadata[row] = metadata
+        for name, column in self._columns.items():
+            column[row] = metadata.get(name)
+        self._live[row] = True
+        self._dead -= 1
+        if self._centroids is not None:
+            self._assignments[row] = int(np.argmax(self._centroids @ self._matrix[row].astype(np.float32)))
+
+    def _kill(self, vector_id: str):
+        row = self._rows.pop(vector_id, None)
+        if row is None:
+            return
+        self._ids[row] = None
+        self._metadata[row] = {}
+        for column in self._columns.values():
+            column[row] = None
+        self._live[row] = False
+        self._dead += 1
+
+    def _refresh(self):
+        """[Read-only] 读取写者追加的新数据；压缩换代后重新加载"""
+        now = time.monotonic()
+        if not self.read_only or now - self._last_refresh < REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+        with self._lock:
+            manifest = self._read_manifest()
+            if manifest is None:
+                return
+            if manifest["generation"] != self._generation or self.dim is None:
+                self._load()
+                return
+            try:
+                self._catch_up()
+            except FileNotFoundError:
+                self._load()
+
+    # --- 写入 ---
+
+    def _ensure_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Vector store {self.path} is opened read-only (another process holds the writer lock)")
+
+    def _next_row(self) -> int:
+        """向量文件末尾的行号 (此前失败的写入可能留下未被引用的行或半行，以文件为准)"""
+        row_bytes = self.dim * self.storage_dtype.itemsize
+        size = os.fstat(self._vector_file.fileno()).st_size
+        if size % row_bytes:
+            self._vector_file.truncate(size - size % row_bytes)
+        return size // row_bytes
+
+    def _append(self, entries: List[Dict[str, Any]], block: Optional[np.ndarray] = None):
+        """向量先落盘，再写日志；两者都完成后才更新内存中的状态"""
+        if block is not None:
+            self._vector_file.write(block.tobytes())
+            self._flush(self._vector_file)
+        payload = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        self._log_file.write(payload.encode("utf-8"))
+        self._flush(self._log_file)
+
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        self._ensure_writable()
+        if not vectors:
+            return
+        with self._write_lock:
+            block = np.stack([self._normalize(record["values"]) for record in vectors]).astype(self.storage_dtype)
+            if self._vector_file is None:
+                # 首次写入：维度确定后创建第 0 代
+                self._matrix = np.zeros((0, self.dim), dtype=self.storage_dtype)
+                self._write_manifest(self._generation)
+                self._open_appenders()
+            start = self._next_row()
+            entries = [
+                {"op": "put", "id": record["id"], "row": start + i, "metadata": dict(record.get("metadata") or {})}
+                for i, record in enumerate(vectors)
+            ]
+            self._append(entries, block)
+            with self._lock:
+                self._sync_rows()
+                for entry in entries:
+                    self._apply(entry)
+                self._stats["upserts"] += len(entries)
+                self._maybe_train()
+        self._maybe_compact()
+
+    def delete(self, ids: List[str]):
+        self._ensure_writable()
+        with self._write_lock:
+            entries = [{"op": "del", "id": vector_id} for vector_id in dict.fromkeys(ids) if vector_id in self._rows]
+            if not entries:
+                return
+            self._append(entries)
+            with self._lock:
+                for entry in entries:
+                    self._apply(entry)
+                self._stats["deletes"] += len(entries)
+        self._maybe_compact()
+
+    # --- 压缩 ---
+
+    def _maybe_compact(self):
+        if self.read_only or (self._compactor is not None and self._compactor.is_alive()):
+            return
+        if self._dead < COMPACT_MIN_DEAD or self._dead < self.compact_ratio * self._size:
+            return
+        self._compactor = threading.Thread(target=self.compact, name="vector-store-compactor", daemon=True)
+        self._compactor.start()
+
+    def compact(self):
+        """
+        把有效行写入新的一代并原子切换 CURRENT。
+        复制期间持有写锁 (写入排队)，查询继续使用旧映射；旧文件在切换后删除，
+        仍映射着旧文件的只读进程不受影响，下次刷新时切换到新代。
+        """
+        with self._write_lock:
+            started = time.monotonic()
+            with self._lock:
+                live_rows = np.flatnonzero(self._live[:self._size])
+                records = [(self._ids[r], self._metadata[r]) for r in live_rows]
+                matrix = self._matrix
+                old_generation = self._generation
+            generation = old_generation + 1
+            try:
+                with open(self._vectors_path(generation), "wb") as f:
+                    for start in range(0, len(live_rows), 8192):
+                        f.write(np.ascontiguousarray(matrix[live_rows[start:start + 8192]]).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self._log_path(generation), "wb") as f:
+                    for row, (vector_id, metadata) in enumerate(records):
+                        entry = {"op": "put", "id": vector_id, "row": row, "metadata": metadata}
+                        f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._write_manifest(generation)
+            except Exception as e:
+                logger.error(f"Vector store compaction failed: {e}")
+                for path in (self._vectors_path(generation), self._log_path(generation)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return
+            with self._lock:
+                dropped = self._dead
+                self._load()
+                self._stats["compactions"] += 1
+            for path in (self._vectors_path(old_generation), self._log_path(old_generation)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            logger.info(
+                f"🧹 Vector store compacted to generation {generation}: "
+                f"dropped {dropped} dead row(s) in {time.monotonic() - started:.2f}s."
+            )
+
+    # --- 查询 ---
+
+    def _live_mask(self) -> Optional[np.ndarray]:
+        return self._live[:self._size]
+
+    def query(self, vector, top_k=1, filter=None) -> List[VectorMatch]:
+        self._refresh()
+        if self._centroids is None and self.ann_min_vectors and len(self) >= self.ann_min_vectors:
+            with self._lock:
+                self._maybe_train()
+        return super().query(vector, top_k=top_k, filter=filter)
+
+    def close(self):
+        with self._write_lock:
+            self._close_appenders()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        with self._lock:
+            stats.update({
+                "vectors": len(self),
+                "dead_rows": self._dead,
+                "path": self.path,
+                "generation": self._generation,
+                "dtype": self.storage_dtype.name,
+                "read_only": self.read_only
+            })
+        return stats
@@ -7,18 +7,21 @@ from datetime import datetime
 
 from langgraph.checkpoint.memory import MemorySaver
 
-from config.keys import GATEWAY_API_BASE, GATEWAY_SECRET, PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME
+from config.keys import GATEWAY_API_BASE, GEMINI_API_KEYS, PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME
 from core.rotator import GeminiKeyRotator
 from tools.memory import VectorMemoryTool
 from tools.search import GoogleSearchTool
 from core.models import ProjectState, TaskNode, TaskStatus, ArtifactVersion
 from workflow.graph import build_agent_workflow
-from core.logger_setup import node_id_ctx, trace_id_ctx, phase_ctx, token_usage_ctx
+from core.logger_setup import node_id_ctx, trace_id_ctx, phase_ctx, token_usage_ctx, thread_id_ctx
+from core.events import event_sink_ctx
+from core.telemetry import new_usage_counter
+from core.api_models import StreamEvent
 
 logger = logging.getLogger("Brain-Engine")
 GLOBAL_CHECKPOINTER = MemorySaver()
 
-_rotator = GeminiKeyRotator(GATEWAY_API_BASE, GATEWAY_SECRET)
+_rotator = GeminiKeyRotator(GATEWAY_API_BASE, GEMINI_API_KEYS)
 _memory_tool = VectorMemoryTool(PINECONE_API_KEY, PINECONE_ENVIRONMENT, VECTOR_INDEX_NAME)
 _search_tool = GoogleSearchTool()
 _app = build_agent_workflow(_rotator, _memory_tool, _search_tool, checkpointer=GLOBAL_CHECKPOINTER)
@@ -63,6 +66,44 @@ def validate_subtree_output(node: TaskNode) -> Dict[str, Any]:
         return {"valid": False, "msg": "Protocol Violation: Summary too short"}
     return {"valid": True}
 
+async def _astream_with_events(current_input: Any, config: Dict[str, Any]) -> AsyncGenerator[tuple, None]:
+    """
+    [Streaming] 将 LangGraph 状态快照与节点内部推送的增量事件 (token / sandbox_output 等) 合并为一个流。
+    产出 ("state", event) 或 ("event", payload)。增量事件无需等待节点结束即可转发。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def _sink(event_type: str, data: Dict[str, Any]):
+        queue.put_nowait(("event", StreamEvent(event_type=event_type, data=data).model_dump()))
+
+    async def _pump():
+        try:
+            async for event in _app.astream(current_input, config=config, stream_mode="values"):
+                await queue.put(("state", event))
+        except Exception as e:
+            await queue.put(("error", e))
+        finally:
+            await queue.put(("done", None))
+
+    # 子任务在创建时复制上下文，因此图中所有节点都能拿到该事件出口
+    token = event_sink_ctx.set(_sink)
+    try:
+        pump_task = asyncio.create_task(_pump())
+    finally:
+        event_sink_ctx.reset(token)
+
+    try:
+        while True:
+            kind, item = await queue.get()
+            if kind == "done":
+                break
+            if kind == "error":
+                raise item
+            yield kind, item
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+
 async def run_workflow(user_input: str, thread_id: str) -> AsyncGenerator[Dict[str, Any], None]:
     if _app is None:
         yield {"event_type": "error", "data": "Workflow Engine not initialized."}
@@ -73,6 +114,8 @@ async def run_workflow(user_input: str, thread_id: str) -> AsyncGenerator[Dict[s
         current_trace_id = str(uuid.uuid4())
         trace_id_ctx.set(current_trace_id)
 
+    thread_id_ctx.set(thread_id)
+    token_usage_ctx.set(new_usage_counter())
     config = {"configurable": {"thread_id": thread_id}}
     
     snapshot = _app.get_state(config)
@@ -106,7 +149,11 @@ async def run_workflow(user_input: str, thread_id: str) -> AsyncGenerator[Dict[s
     last_vector_clock = {}
 
     try:
-        async for event in _app.astream(current_input, config=config, stream_mode="values"):
+        async for kind, event in _astream_with_events(current_input, config):
+            if kind == "event":
+                # 增量事件 (token / sandbox_output 等) 直接透传
+                yield event
+                continue
             if 'project_state' not in event: continue
             ps: ProjectState = event['project_state']
             
@@ -209,6 +256,9 @@ async def run_workflow(user_input: str, thread_id: str) -> AsyncGenerator[Dict[s
             if ps.final_report:
                 yield {"event_type": "final_report", "data": ps.final_report}
 
+        # [Cost Telemetry] 本轮运行的累计 Token 用量
+        yield {"event_type": "token_usage", "data": dict(token_usage_ctx.get() or {})}
+
         final_snapshot = _app.get_state(config)
         if final_snapshot.next:
             yield {"event_type": "interrupt", "data": {"node": final_snapshot.next[0], "msg": "Paused for HITL."}}